@@ -4,7 +4,8 @@ Functionality to run tests for the Process classes defined in the plugins
 from __future__ import print_function, absolute_import
 
 from .base import TestProcessPlugin, process_test
+from .fixtures import fixture
 
-__all__ = ('TestProcessPlugin', 'process_test')
+__all__ = ('TestProcessPlugin', 'process_test', 'fixture')
 
 __version__ = "0.1.0"
\ No newline at end of file
@@ -5,26 +5,65 @@ from __future__ import print_function, absolute_import
 
 import functools
 import inspect
+import itertools
+import json
+import time
 import traceback
+import warnings
 
 from collections import namedtuple
 
-from aiida.plugins.entry_point import load_entry_point_from_string
-from aiida.engine import run_get_node
-
+from .benchmarking import (DEFAULT_ALPHA, DEFAULT_BENCHMARK_REPEATS, DEFAULT_THRESHOLD, BenchmarkBaselines,
+                           compare_benchmark, get_calcjob_runtime)
 from .code_builders import CODE_BUILDERS
+from .code_builders.base import DEFAULT_COMPUTER_NAME
+from .computers import ComputerPool
+from .dependencies import get_dependency_errors, get_required_tests, sort_tests
+from .discovery import print_class_description
+from .fingerprint import get_test_fingerprint
+from .fixtures import map_nodes
+from .parameters import expand_parameters, get_case_names
+from .resources import ResourceMonitor, summarize_resources
+from .timeouts import get_remaining_time, get_test_timeout, kill_submitted_process, run_get_node_with_timeout
+from .timing import monotonic, timed
+
+# Default interval (in seconds) between checks of the state of submitted processes
+DEFAULT_POLL_INTERVAL = 2.
 
 SingleTest = namedtuple(
     'SingleTest', 
-    ['priority', 'test_function_name', 'entrypoint_name', 'generate_function', 'test_function'])
+    ['priority', 'test_function_name', 'entrypoint_name', 'generate_function', 'test_function', 'timeout',
+     'depends_on', 'parameters'])
+
+def process_test(priority, entrypoint_name, generate_function, timeout=None, depends_on=None,  # pylint: disable=too-many-arguments
+                 parameters=None, ids=None):
+    """
+    A decorator to mark test for a given Process class defined in a plugin
+
+    :param timeout: optional wall-clock timeout of the process, in seconds
+        (see :py:mod:`aiida_plugin_ci.timeouts` for the default)
+    :param depends_on: optional name (or list of names) of other tests of the class whose
+        process nodes are needed to generate the inputs (see :py:mod:`aiida_plugin_ci.dependencies`).
+        In this case, ``generate_function`` is called with a second argument, a dictionary
+        mapping these names to the process nodes of the upstream tests.
+    :param parameters: optional parameters of the test, either a list of dictionaries or a dictionary
+        of lists of values (see :py:mod:`aiida_plugin_ci.parameters`). The test is then run once per
+        case, as a test named ``<test_name>[<id>]``, and the parameters of the case are passed as
+        keyword arguments both to ``generate_function`` and to the test function.
+    :param ids: optional callable returning the id of a case, given the dictionary of its parameters
+    """
+    if isinstance(depends_on, str):
+        depends_on = [depends_on]
 
-def process_test(priority, entrypoint_name, generate_function):
-    """A decorator to mark test for a given Process class defined in a plugin"""
     def decorator_function(func):
         func._test_method_data = {  # pylint: disable=protected-access
             'priority': priority,
             'entrypoint_name': entrypoint_name,
-            'generate_function': generate_function
+            'generate_function': generate_function,
+            'timeout': timeout,
+            'depends_on': tuple(depends_on or ()),
+            'parameters': parameters,
+            'ids': ids,
         }
 
         @functools.wraps(func)
@@ -35,13 +74,210 @@ def process_test(priority, entrypoint_name, generate_function):
     return decorator_function
 
 
-class TestProcessPlugin(object):
+def get_builder_spec_key(code_declaration):
+    """
+    Return a string uniquely identifying the builder specification in a ``code_resources`` entry.
+
+    Two code declarations with the same key (same builder type and parameters) build exactly
+    the same code, even if they are used with different input plugins.
+    """
+    return json.dumps({
+        'type': code_declaration.get('type'),
+        'parameters': code_declaration.get('parameters'),
+    }, sort_keys=True)
+
+
+def build_code(code_declaration, progress=None):
+    """
+    Instantiate the code builder for an entry of ``code_resources`` and build the code.
+
+    :param progress: optional callable, set as the progress callback of the builder
+        (see :py:meth:`CodeBuilder.set_progress_callback`) during the build
+
+    :return: a tuple ``(code_builder, status)``. On failure, ``code_builder`` is None and
+        ``status`` contains the information on the exception. In both cases, ``status['timings']``
+        contains the seconds spent in the ``builder_construction`` and ``build`` phases
+        (plus the phases returned by the ``get_build_timings()`` method of the builder).
+    """
+    status = {'timings': {}}
+    try:
+        with timed(status['timings'], 'builder_construction'):
+            code_builder = CODE_BUILDERS[code_declaration['type']](
+                **code_declaration['parameters']
+            )
+    except Exception as exception:
+        TestProcessPlugin._set_exception_to_status(  # pylint: disable=protected-access
+            status, 'FETCHING_BUILDER_FAILED', exception)
+        return None, status
+
+    code_builder.set_progress_callback(progress)
+    try:
+        with timed(status['timings'], 'build'):
+            code_builder.build()
+    except Exception as exception:
+        TestProcessPlugin._set_exception_to_status(  # pylint: disable=protected-access
+            status, 'BUILDING_CODE_FAILED', exception)
+        return None, status
+    finally:
+        status['timings'].update(code_builder.get_build_timings())
+        code_builder.set_progress_callback(None)
+
+    return code_builder, status
+
+
+class CalculationCachingIgnored(UserWarning):
+    """Warning emitted when AiiDA caching is requested in concurrent mode, where it does not apply"""
+
+
+# Returned when preparing a test that cannot be dispatched yet, all its computers being full
+_COMPUTERS_BUSY = object()
+
+
+def _discard_record(record):  # pylint: disable=unused-argument
+    """Default for the ``report`` callable of :py:meth:`TestProcessPlugin.run`"""
+
+
+def enable_calculation_caching(entrypoint_name):
+    """
+    Return a context manager enabling AiiDA caching for the given entry point
+    (e.g. ``aiida.calculations:templatereplacer``).
+
+    With aiida-core < 1.1, caching can only be enabled globally.
+    """
+    from aiida.manage.caching import enable_caching
+
+    try:
+        return enable_caching(identifier=entrypoint_name)
+    except TypeError:
+        return enable_caching()
+
+
+def get_cache_source(process_node):
+    """
+    Return the UUID of the node a process node was cloned from, or None if it was not cloned
+    """
+    try:
+        return process_node.get_cache_source()
+    except AttributeError:
+        return None
+
+
+def get_excepted_process_status(process_node):
+    """
+    Return the status of a test whose process terminated in the excepted state.
+
+    The node only stores the formatted traceback, whose last line is in the
+    ``ExceptionClass: message`` format.
+    """
+    traceback_string = process_node.exception or ''
+    last_line = traceback_string.strip().splitlines()[-1] if traceback_string.strip() else ''
+    exception_class, _, exception_message = last_line.partition(': ')
+    return {
+        'status': 'ENGINE_RUN_EXCEPTED',
+        'exception_traceback': traceback_string,
+        'exception_message': exception_message,
+        'exception_class': exception_class.rpartition('.')[2],
+    }
+
+
+def share_unstored_nodes(inputs, shared_nodes):
+    """
+    Return the inputs with each unstored node replaced by an equal node (same class and hash)
+    met before, if any, so that the nodes shared by several tests (e.g. the cases of a
+    parametrized test) are stored only once.
+
+    :param shared_nodes: a dictionary mapping ``(class, hash)`` to the unstored nodes met so far,
+        updated in place
+    """
+    def share_node(node):
+        if node.is_stored:
+            return node
+        node_hash = node.get_hash()
+        if node_hash is None:
+            return node
+        return shared_nodes.setdefault((type(node), node_hash), node)
+
+    return map_nodes(inputs, share_node)
+
+
+def collect_tests(cls):
+    """
+    Collect all tests of a class in a sorted list of ``SingleTest``
+
+    Parametrized tests are expanded into one ``SingleTest`` per case.
+    """
+    test_methods = {}
+
+    for name, test_function in inspect.getmembers(cls):
+        # both so that it works both as a classmethod and as a normal method
+        if (inspect.isfunction(test_function) or inspect.ismethod(test_function)) and name.startswith('test_'):
+            # This is set by the decorator
+            test_method_data = getattr(test_function, '_test_method_data', None)
+            if test_method_data is None:
+                continue
+            if test_method_data.get('parameters') is None:
+                cases = {name: None}
+            else:
+                case_parameters = expand_parameters(test_method_data['parameters'])
+                cases = dict(zip(
+                    get_case_names(name, case_parameters, test_method_data.get('ids')), case_parameters))
+            for case_name, parameters in cases.items():
+                # Sorted in this way to sort first by priority, then by name
+                test_methods[(test_method_data['priority'], case_name)] = (
+                    test_method_data['entrypoint_name'],
+                    test_method_data['generate_function'],
+                    test_function,
+                    test_method_data.get('timeout'),
+                    test_method_data.get('depends_on', ()),
+                    parameters,
+                )
+
+    test_list = []
+    for priority, name in sorted(test_methods):
+        test = test_methods[(priority, name)]
+        test_list.append(SingleTest(
+            priority = priority, 
+            test_function_name = name,
+            entrypoint_name = test[0],
+            generate_function = test[1],
+            test_function = test[2],
+            timeout = test[3],
+            depends_on = test[4],
+            parameters = test[5]
+        ))
+    
+    return test_list
+
+
+class TestProcessPluginMeta(type):
+    """
+    Metaclass of ``TestProcessPlugin``, collecting the tests of each class once, when it is created
+    """
+    def __init__(cls, name, bases, namespace):
+        super(TestProcessPluginMeta, cls).__init__(name, bases, namespace)
+        cls._tests = collect_tests(cls)
+
+
+# Defined this way to set the metaclass both in python 2 and 3
+_TestProcessPluginBase = TestProcessPluginMeta(str('_TestProcessPluginBase'), (object,), {})
+
+
+class TestProcessPlugin(_TestProcessPluginBase):
     """
     Base implementation 
     """
     code_resources = None # Should be a dict
+
+    def __init__(self):
+        # Seconds spent in the class-level phases (setup of codes and resources)
+        self.class_timings = {}
+        # Process nodes of the tests that were run, by test name
+        self.process_nodes = {}
+        # Instance pools started by setup_codes(), by code name
+        self.instance_pools = {}
     
-    def setup_codes(self):
+    def setup_codes(self, prebuilt_codes=None, computer_name=DEFAULT_COMPUTER_NAME, instance_pool_size=None,  # pylint: disable=too-many-locals,too-many-branches
+                    computer_names=None):
         """Implemented in the base class.
 
         Reads the ``self.code_resources`` specification, installs the codes and creates AiiDA ``Code`` instances that can be
@@ -49,6 +285,26 @@ class TestProcessPlugin(object):
 
         After being called, self.codes will be a dictionary with the same keys as ``self.code_resources``, the value
         being a stored AiiDA Code configured for the code as declared in ``self.code_resources``.
+        Similarly, ``self.code_builders`` will contain the code builders that built them.
+        The seconds spent in each phase of the setup of each code are stored in
+        ``self.class_timings['codes']`` (for prebuilt codes, these include the time
+        spent building them, even if the build was shared with other classes).
+
+        :param prebuilt_codes: optional dictionary mapping the builder spec key (see
+            :py:func:`get_builder_spec_key`) to the ``(code_builder, status)`` tuple returned by
+            :py:func:`build_code`, e.g. as returned by :py:func:`aiida_plugin_ci.planning.build_all`.
+            Codes found there are not built again.
+        :param computer_name: the name of the AiiDA computer on which codes are set up
+        :param instance_pool_size: if specified, a pool of this many persistent instances is started
+            for each code whose builder supports it (see :py:meth:`CodeBuilder.start_instance_pool`),
+            and the code is set up to run in the pool. The pools are stored in ``self.instance_pools``,
+            and must be stopped with :py:meth:`teardown_codes`; the seconds spent starting each pool
+            are stored in the ``start_instances`` phase of the timings of its code.
+        :param computer_names: optional list of names of computers on which to set up the codes, instead of
+            ``computer_name`` (see :py:mod:`aiida_plugin_ci.computers`); a code whose declaration has a
+            ``computers`` key is only set up on the listed ones. ``self.codes_by_computer`` then maps each
+            computer name to the dictionary of codes set up on it, ``self.computer_names`` lists the
+            computers on which all codes are set up, and ``self.codes`` contains the codes on the first one.
 
         .. note:: If you want to add more things and you subclass this, do not forget to call the super().
         """
@@ -59,32 +315,55 @@ class TestProcessPlugin(object):
         if code_resources is None:
             code_resources = {}
         
-        self.codes = {}
+        if computer_names is None:
+            computer_names = [computer_name]
+        self.codes_by_computer = {name: {} for name in computer_names}
+        self.code_builders = {}
+        self.class_timings.setdefault('codes', {})
         for code_name, code_declaration in code_resources.items():
-            try:
-                code_builder = CODE_BUILDERS[code_declaration['type']](
-                    **code_declaration['parameters']
-                )
-            except Exception as exception:
-                status = {}
-                self._set_exception_to_status(status, 'FETCHING_BUILDER_FAILED', exception)
+            spec_key = get_builder_spec_key(code_declaration)
+            if prebuilt_codes is not None and spec_key in prebuilt_codes:
+                code_builder, status = prebuilt_codes[spec_key]
+            else:
+                code_builder, status = build_code(code_declaration)
+            code_timings = dict(status.get('timings', {}))
+            self.class_timings['codes'][code_name] = code_timings
+            if code_builder is None:
                 info[code_name] = status
                 success = False
                 continue
 
-            try:
-                code_builder.build()
-            except Exception as exception:
-                status = {}
-                self._set_exception_to_status(status, 'BUILDING_CODE_FAILED', exception)
-                info[code_name] = status
+            full_exec_command = None
+            if instance_pool_size:
+                try:
+                    with timed(code_timings, 'start_instances'):
+                        pool = code_builder.start_instance_pool(instance_pool_size)
+                except Exception as exception:
+                    status = {}
+                    self._set_exception_to_status(status, 'START_INSTANCES_FAILED', exception)
+                    info[code_name] = status
+                    success = False
+                    continue
+                if pool is not None:
+                    self.instance_pools[code_name] = pool
+                    full_exec_command = pool.get_exec_command()
+
+            code_computers = [name for name in computer_names if name in code_declaration.get('computers', computer_names)]
+            if not code_computers:
+                info[code_name] = {
+                    'status': 'NO_COMPUTER',
+                    'message': "None of the computers of the code ({}) is used by this run".format(
+                        ", ".join(code_declaration['computers'])),
+                }
                 success = False
                 continue
 
             try:
-                aiida_code = code_builder.setup_aiida_code(
-                    input_plugin_name=code_declaration.get('input_plugin_name', None), 
-                    code_name=code_name)
+                with timed(code_timings, 'setup_aiida_code'):
+                    for name in code_computers:
+                        self.codes_by_computer[name][code_name] = code_builder.setup_aiida_code(
+                            input_plugin_name=code_declaration.get('input_plugin_name', None), 
+                            code_name=code_name, computer_name=name, full_exec_command=full_exec_command)
             except Exception as exception:
                 status = {}
                 self._set_exception_to_status(status, 'SETUP_AIIDA_CODE_FAILED', exception)
@@ -92,17 +371,40 @@ class TestProcessPlugin(object):
                 success = False
                 continue
             
-            self.codes[code_name] = aiida_code
+            self.code_builders[code_name] = code_builder
+
+        self.computer_names = [
+            name for name in computer_names if set(self.codes_by_computer[name]) == set(code_resources)
+        ]
+        self.codes = dict(self.codes_by_computer[(self.computer_names or computer_names)[0]])
+        if success and not self.computer_names:
+            for code_name in code_resources:
+                info[code_name] = {
+                    'status': 'NO_COMPUTER',
+                    'message': "No computer of this run is used by all the codes of the class",
+                }
+            success = False
     
         return success, info
 
+    def teardown_codes(self):
+        """
+        Stop the instance pools started by :py:meth:`setup_codes`. Called at the end of :py:meth:`run`.
+
+        .. note:: If you subclass this, do not forget to call the super().
+        """
+        for code_name in sorted(self.instance_pools):
+            self.instance_pools[code_name].stop()
+        self.instance_pools = {}
+
     def setup_resources(self):
         """
         Setup some resources (i.e., load some data in the database). 
         
         By default, no resources are setup, you can extend this in a plugin.
         If you create data and you want to reference it, you can set it into
-        ``self`` to be reused in later methods.
+        ``self`` to be reused in later methods. To reuse data also in other classes
+        or in later runs, rather define a fixture (see :py:mod:`aiida_plugin_ci.fixtures`).
         """
             
     @classmethod
@@ -110,56 +412,34 @@ class TestProcessPlugin(object):
         return cls.setup_resources != TestProcessPlugin.setup_resources
 
     @classmethod
-    def print_description(cls):
-        if cls.defines_custom_resources():
-            print("  * Test will setup custom resources")
+    def get_description(cls):
+        """
+        Return the description of the class, in the same format as
+        :py:func:`aiida_plugin_ci.discovery.get_manifest`
+        """
+        return {
+            'module': cls.__module__,
+            'class': cls.__name__,
+            'defines_custom_resources': cls.defines_custom_resources(),
+            'code_names': sorted(cls.code_resources or {}),
+            'tests': [{
+                'name': test.test_function_name,
+                'priority': test.priority,
+                'entrypoint_name': test.entrypoint_name,
+                'generate_function': test.generate_function.__name__,
+                'depends_on': list(test.depends_on),
+            } for test in cls.get_tests()],
+            'static': True,
+        }
 
-        if cls.code_resources:
-            print("  * Codes to setup:")
-            for code_name in cls.code_resources.keys(): 
-                print("    - {}".format(code_name))
-    
-        test_methods = cls.get_tests()
-        if test_methods:
-            print("  * Test methods:")
-            for test in test_methods:
-                print("    - {} (priority {})".format(test.test_function_name, test.priority))
-                print("      Generating inputs for entrypoint '{}' via function '{}'".format(
-                    test.entrypoint_name, test.generate_function.__name__
-                    ))
+    @classmethod
+    def print_description(cls):
+        print_class_description(cls.get_description())
 
     @classmethod
     def get_tests(cls): 
-        """Get all tests in a sorted list"""
-
-        test_methods = {}
-
-        for name, test_function in inspect.getmembers(cls):
-            # both so that it works both as a classmethod and as a normal method
-            if (inspect.isfunction(test_function) or inspect.ismethod(test_function)) and name.startswith('test_'):
-                # This is set by the decorator
-                test_method_data = getattr(test_function, '_test_method_data', None)
-                if test_method_data is None:
-                    continue
-                # Sorted in this way to sort first by priority, then by name
-                test_methods[(test_method_data['priority'], name)] = (
-                    test_method_data['entrypoint_name'],
-                    test_method_data['generate_function'],
-                    test_function,
-                )
-
-        test_list = []
-        for priority, name in sorted(test_methods):
-            test = test_methods[(priority, name)]
-            test_list.append(SingleTest(
-                priority = priority, 
-                test_function_name = name,
-                entrypoint_name = test[0],
-                generate_function = test[1],
-                test_function = test[2]
-            ))
-        
-        return test_list
+        """Get all tests in a sorted list (collected once, when the class is created)"""
+        return list(cls._tests)
 
     @staticmethod
     def _set_exception_to_status(status_dict, status_string, exception):
@@ -171,18 +451,17 @@ class TestProcessPlugin(object):
         status_dict['exception_message'] = str(exception)
         status_dict['exception_class'] = exception.__class__.__name__
 
-    def _run_get_status(self, ProcessClass, inputs, test_function):
-        status = {}
+    def _test_node_get_status(self, process_node, test_function, timings, parameters=None):
+        """
+        Call the test function on the node of a process that was run, and return the status
 
-        try:
-            _, process_node = run_get_node(ProcessClass, **inputs)
-        except Exception as exc:
-            self._set_exception_to_status(status, 'ENGINE_RUN_EXCEPTED', exc)
-            return status
+        :param parameters: for a case of a parametrized test, its parameters
+        """
+        status = {}
 
-        # aiida.engine.run() didn't crash
         try:
-            status['ret_code'] = test_function(self, process_node)
+            with timed(timings, 'test_function'):
+                status['ret_code'] = test_function(self, process_node, **(parameters or {}))
         except Exception as exc:
             self._set_exception_to_status(status, 'TEST_FUNCTION_EXCEPTED', exc)
             return status
@@ -195,13 +474,264 @@ class TestProcessPlugin(object):
 
         return status
 
+    @staticmethod
+    def _run_get_node(ProcessClass, inputs, timeout, resource_monitor=None, key=None):
+        """
+        Run the process, killing it after ``timeout`` seconds (if not None).
+
+        :param resource_monitor: optional :py:class:`aiida_plugin_ci.resources.ResourceMonitor`,
+            monitoring the process (under ``key``) while it runs
+        :return: a tuple ``(process_node, timed_out)``
+        """
+        if timeout is None and resource_monitor is None:
+            from aiida.engine import run_get_node
+            _, process_node = run_get_node(ProcessClass, **inputs)
+            return process_node, False
+        if resource_monitor is None:
+            return run_get_node_with_timeout(ProcessClass, inputs, timeout)
+        return run_get_node_with_timeout(
+            ProcessClass, inputs, timeout, on_start=functools.partial(resource_monitor.add, key),
+            on_tick=functools.partial(resource_monitor.update_job_pids, [key]),
+            tick_interval=resource_monitor.interval)
+
+    def _run_get_status(self, ProcessClass, inputs, test, timings, calculation_caching, timeout=None,  # pylint: disable=too-many-arguments
+                        resource_monitor=None):
+        status = {}
+        run_get_node = functools.partial(
+            self._run_get_node, ProcessClass, inputs, timeout, resource_monitor, test.test_function_name)
+
+        try:
+            with timed(timings, 'run_get_node'):
+                if calculation_caching:
+                    with enable_calculation_caching(test.entrypoint_name):
+                        process_node, timed_out = run_get_node()
+                else:
+                    process_node, timed_out = run_get_node()
+        except Exception as exc:
+            self._set_exception_to_status(status, 'ENGINE_RUN_EXCEPTED', exc)
+            return status
+
+        if timed_out:
+            self.process_nodes[test.test_function_name] = process_node
+            return {'status': 'TIMEOUT', 'timeout': timeout}
+
+        # aiida.engine.run() didn't crash
+        self.process_nodes[test.test_function_name] = process_node
+        status = self._test_node_get_status(process_node, test.test_function, timings, test.parameters)
+        status['cached_from'] = get_cache_source(process_node)
+        return status
+
+    def _submit_tier(self, tier, prepare, record_status, run_status, poll_interval,  # pylint: disable=too-many-arguments,too-many-locals
+                     resource_monitor=None):
+        """
+        Submit the tests of a tier to the daemon, each as soon as the tests it depends on are
+        done, and run the test function of each test as soon as its process terminates.
+
+        For each test, the time spent submitting the process and the time from the
+        submission until the process was found terminated are stored in the ``submit``
+        and ``engine`` phases of its timings.
+        Processes still running after their timeout (if not None) are killed, and their
+        tests get the ``TIMEOUT`` status.
+
+        :param tier: a list of ``SingleTest``, sorted by :py:func:`aiida_plugin_ci.dependencies.sort_tests`
+        :param prepare: a callable returning, for a test whose dependencies are done, a tuple
+            ``(ProcessClass, inputs, timings, timeout)``, None if the test must not be
+            submitted (in this case, it already recorded its status), or ``_COMPUTERS_BUSY``
+            if it must be prepared again later
+        :param record_status: a callable recording the status of a test in ``run_status``
+        :param run_status: the dictionary with the statuses of the tests done so far
+        :param poll_interval: seconds to wait between checks of the process states
+        :param resource_monitor: optional :py:class:`aiida_plugin_ci.resources.ResourceMonitor`,
+            monitoring each process from its submission (its jobs are looked up at each check)
+        """
+        from aiida.engine import submit
 
-    def run(self, verbose=False):
+        waiting = list(tier)
+        running = {}
+        while waiting or running:
+            for test in list(waiting):
+                if not all(upstream_name in run_status for upstream_name in test.depends_on):
+                    continue
+                prepared = prepare(test)
+                if prepared is _COMPUTERS_BUSY:
+                    continue
+                waiting.remove(test)
+                if prepared is None:
+                    continue
+                ProcessClass, inputs, timings, timeout = prepared
+                try:
+                    with timed(timings, 'submit'):
+                        process_node = submit(ProcessClass, **inputs)
+                except Exception as exc:
+                    status = {}
+                    self._set_exception_to_status(status, 'ENGINE_RUN_EXCEPTED', exc)
+                    record_status(test.test_function_name, status)
+                    continue
+                self.process_nodes[test.test_function_name] = process_node
+                if resource_monitor is not None:
+                    resource_monitor.add(test.test_function_name, process_node)
+                running[test.test_function_name] = (test, process_node, monotonic(), timings, timeout)
+
+            num_done = 0
+            for test_name in sorted(running):
+                test, process_node, submitted_at, timings, timeout = running[test_name]
+                now = monotonic()
+                timed_out = timeout is not None and now - submitted_at > timeout
+                if not process_node.is_terminated and not timed_out:
+                    continue
+                running.pop(test_name)
+                num_done += 1
+                timings['engine'] = now - submitted_at
+                if not process_node.is_terminated:
+                    kill_submitted_process(process_node, timeout)
+                    record_status(test_name, {'status': 'TIMEOUT', 'timeout': timeout})
+                    continue
+                if process_node.is_excepted:
+                    # Same status as when run_get_node() raises
+                    status = get_excepted_process_status(process_node)
+                else:
+                    status = self._test_node_get_status(process_node, test.test_function, timings, test.parameters)
+                status['cached_from'] = get_cache_source(process_node)
+                record_status(test_name, status)
+
+            if resource_monitor is not None and running:
+                resource_monitor.update_job_pids(list(running))
+            # If some tests are done, their dependents can be submitted right away
+            if running and not num_done:
+                time.sleep(poll_interval)
+
+    def _prepare_test(self, test, timings, upstream_nodes=None):
         """
-        Run all tests in the class in the order specified by the priorities
+        Load the Process class and generate the inputs for a test.
+
+        :param upstream_nodes: for a test with dependencies, a dictionary mapping the names of
+            the tests it depends on to their process nodes, passed to the generate function
+        :return: a tuple ``(ProcessClass, inputs, status)``; if anything fails, ``ProcessClass``
+            and ``inputs`` are None and ``status`` contains the failure information
         """
-        run_status = {}
-        success, info = self.setup_codes()
+        status = {}
+        try:
+            from aiida.plugins.entry_point import load_entry_point_from_string
+            ProcessClass = load_entry_point_from_string(test.entrypoint_name)
+        except Exception as exc:
+            self._set_exception_to_status(
+                status, 'CALCULATION_ENTRYPOINT_LOADING_FAILED', exc)
+            return None, None, status
+
+        try:
+            with timed(timings, 'generate_function'):
+                if test.depends_on:
+                    inputs = test.generate_function(self, upstream_nodes, **(test.parameters or {}))
+                else:
+                    inputs = test.generate_function(self, **(test.parameters or {}))
+        except Exception as exc:
+            self._set_exception_to_status(
+                status, 'GENERATE_INPUTS_FAILED', exc)
+            return None, None, status
+
+        return ProcessClass, inputs, status
+
+    def run(self, verbose=False, prebuilt_codes=None, concurrent=False,  # pylint: disable=too-many-arguments
+            poll_interval=DEFAULT_POLL_INTERVAL, computer_name=DEFAULT_COMPUTER_NAME, report=None, tests=None,
+            previous_fingerprints=None, calculation_caching=False, default_timeout=None, deadline=None,
+            resource_accounting=False, instance_pool_size=None, computers=None, expected_durations=None):
+        """
+        Run all tests in the class in the order specified by the priorities and the dependencies
+
+        Tests whose upstream tests (see :py:mod:`aiida_plugin_ci.dependencies`) did not succeed get the
+        ``SKIPPED`` status, tests with invalid dependencies the ``INVALID_DEPENDENCIES`` status.
+        The process node of each test that was run is stored in ``self.process_nodes``.
+
+        The status of each test contains, under the ``timings`` key, the seconds spent in
+        each phase of the test. The class-level timings (setup of codes and resources, and
+        the ``total``) are stored in ``self.class_timings``.
+
+        :param prebuilt_codes: passed to :py:meth:`setup_codes`
+        :param computer_name: passed to :py:meth:`setup_codes`
+        :param concurrent: if True, all tests with the same priority are submitted
+            together to the daemon (that must be running), each as soon as the tests it
+            depends on are done, and the test function of each test is called as soon as
+            its process terminated. Tests with different priorities are still run one
+            priority after the other.
+        :param poll_interval: in concurrent mode, seconds between checks of the process states
+        :param report: optional callable, called with a record (a dictionary, see
+            :py:mod:`aiida_plugin_ci.reporting`) as soon as each code is set up and each test
+            finishes, and with a ``class`` record at the end. The ``class`` key of the records
+            is not set, it is up to the caller to add it if needed.
+        :param tests: optional list of names of the tests to run (by default, all tests are run);
+            the tests they depend on are also run
+        :param previous_fingerprints: optional dictionary mapping test names to the fingerprint
+            of their last successful run (see :py:mod:`aiida_plugin_ci.fingerprint`). Tests whose
+            fingerprint did not change are not run, and get the ``CACHED`` status.
+            The fingerprint of each test is stored in its status under the ``fingerprint`` key.
+        :param calculation_caching: if True, AiiDA caching is enabled for the entry point of each
+            test while running it, so that a calculation identical to one already in the profile is
+            cloned instead of executed. In concurrent mode, the caching configuration of the daemon
+            applies instead, and a ``CalculationCachingIgnored`` warning is emitted. In both cases, the UUID of the node the calculation was cloned from (or
+            None) is stored in the ``cached_from`` key of the status.
+        :param default_timeout: the timeout in seconds of the tests that do not define one
+            (see :py:mod:`aiida_plugin_ci.timeouts`). Tests exceeding their timeout are killed
+            and get the ``TIMEOUT`` status.
+        :param deadline: optional ``time.time()`` value by which all tests must be done. Running
+            tests are killed when it is reached, and tests not started yet get the ``SKIPPED`` status.
+        :param resource_accounting: if True, the resources used by the local jobs of each test are
+            sampled while it runs (see :py:mod:`aiida_plugin_ci.resources`), and stored under the
+            ``resources`` key of its status; their sum over the tests is added, under the same
+            key, to the ``class`` record.
+        :param instance_pool_size: passed to :py:meth:`setup_codes`; the pools are stopped at the
+            end of the run, also if it fails.
+        :param computers: optional list of ``(computer_name, max_concurrent)`` tuples, the pool of
+            computers over which the tests are dispatched (see :py:mod:`aiida_plugin_ci.computers`),
+            instead of ``computer_name``; ``max_concurrent`` (None for no limit) is the maximum number
+            of tests running at the same time on the computer. With more than one computer, the name
+            of the computer of each test is stored in the ``computer`` key of its status.
+        :param expected_durations: optional dictionary mapping test names to their expected duration
+            in seconds: within each priority, the tests expected to take longest (with the tests
+            depending on them) are run (or, in concurrent mode, submitted) first
+            (see :py:mod:`aiida_plugin_ci.dependencies`).
+        """
+        if report is None:
+            report = _discard_record
+        if concurrent and calculation_caching:
+            warnings.warn(
+                "calculation_caching is ignored in concurrent mode: the calculations are run by the daemon, "
+                "with its own caching configuration", CalculationCachingIgnored)
+        self.class_timings = {}
+        self.process_nodes = {}
+        resource_monitor = ResourceMonitor() if resource_accounting else None
+        with timed(self.class_timings, 'total'):
+            if resource_monitor is not None:
+                resource_monitor.start()
+            try:
+                run_status = self._run(
+                    verbose, prebuilt_codes, concurrent, poll_interval, computers or [(computer_name, None)], report, tests,
+                    previous_fingerprints or {}, calculation_caching, default_timeout, deadline, resource_monitor,
+                    instance_pool_size, expected_durations)
+            finally:
+                if resource_monitor is not None:
+                    resource_monitor.stop()
+                with timed(self.class_timings, 'teardown_codes'):
+                    self.teardown_codes()
+        class_record = {'type': 'class', 'timings': self.class_timings}
+        if resource_accounting:
+            class_record['resources'] = summarize_resources(run_status)
+        report(class_record)
+        return run_status
+
+    def _setup_class(self, verbose, prebuilt_codes, computers, report, instance_pool_size=None):  # pylint: disable=too-many-arguments
+        """
+        Setup the codes (reporting a ``code_setup`` record for each of them) and the resources
+
+        :param computers: a list of ``(computer_name, max_concurrent)`` tuples, as in :py:meth:`run`
+        :return: False if the setup of some code failed (and resources were not set up), True otherwise
+        """
+        success, info = self.setup_codes(
+            prebuilt_codes=prebuilt_codes, computer_names=[name for name, _ in computers],
+            instance_pool_size=instance_pool_size)
+        for code_name in sorted(self.code_resources or {}):
+            code_status = dict(info.get(code_name, {'status': 'SUCCESS'}))
+            code_status['timings'] = self.class_timings['codes'].get(code_name, {})
+            report({'type': 'code_setup', 'code': code_name, 'status': code_status})
         if verbose:
             print("  -> Codes setup: {}".format("SUCCESS" if success else "FAILED"))
         if not success:
@@ -209,36 +739,268 @@ class TestProcessPlugin(object):
             for key in info:
                 print("       * {}".format(key))
                 print("         {}".format(info[key]))
-            return run_status
+            return False
 
-        self.setup_resources()
+        with timed(self.class_timings, 'setup_resources'):
+            self.setup_resources()
         if verbose:
             print("  -> Resources setup")
+        return True
 
-        for test in self.get_tests():
-            test_status = {}
-
-            try:
-                ProcessClass = load_entry_point_from_string(test.entrypoint_name)
-            except Exception as exc:
-                self._set_exception_to_status(
-                    test_status, 'CALCULATION_ENTRYPOINT_LOADING_FAILED', exc)
-                run_status[test.test_function_name] = test_status
-                continue
+    def _run(self, verbose, prebuilt_codes, concurrent, poll_interval, computers, report, tests,  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+             previous_fingerprints, calculation_caching, default_timeout, deadline, resource_monitor,
+             instance_pool_size, expected_durations):
+        """Implementation of :py:meth:`run`"""
+        run_status = {}
+        all_tests = self.get_tests()
+        if tests is not None:
+            tests = get_required_tests(all_tests, tests)
+        selected_tests = [test for test in all_tests if tests is None or test.test_function_name in tests]
+
+        def budget_exhausted():
+            return deadline is not None and time.time() >= deadline
+
+        def skip_status(reason='the budget of the suite is exhausted'):
+            return {'status': 'SKIPPED', 'reason': reason, 'timings': {}}
+
+        if budget_exhausted():
+            # Do not even setup the codes
+            for test in selected_tests:
+                run_status[test.test_function_name] = skip_status()
+                report({'type': 'test', 'test': test.test_function_name, 'status': run_status[test.test_function_name]})
+            if verbose:
+                print("  -> {} test(s) skipped, the budget of the suite is exhausted".format(len(selected_tests)))
+            return run_status
 
-            try:
-                inputs = test.generate_function(self)
-            except Exception as exc:
-                self._set_exception_to_status(
-                    test_status, 'GENERATE_INPUTS_FAILED', exc)
-                run_status[test.test_function_name] = test_status
-                continue
+        if not self._setup_class(verbose, prebuilt_codes, computers, report, instance_pool_size):
+            return run_status
 
-            test_status = self._run_get_status(ProcessClass, inputs, test.test_function)
-            run_status[test.test_function_name] = test_status
+        test_timings = {}
+        test_fingerprints = {}
+        image_checksums = {
+            code_name: code_builder.get_image_checksum() for code_name, code_builder in self.code_builders.items()
+        }
+        limits = dict(computers)
+        computer_pool = ComputerPool([(name, limits[name]) for name in self.computer_names])
+        # Fingerprints are computed with the codes of the first computer, whichever the test is dispatched to
+        fingerprint_codes = {
+            code.uuid: self.codes_by_computer[self.computer_names[0]][code_name]
+            for codes in self.codes_by_computer.values() for code_name, code in codes.items()
+        }
 
+        def record_status(test_name, test_status):
+            test_status['timings'] = test_timings[test_name]
+            computer = computer_pool.get_computer(test_name)
+            computer_pool.release(test_name)
+            if computer is not None and len(computer_pool) > 1:
+                test_status['computer'] = computer
+            resources = resource_monitor.remove(test_name) if resource_monitor is not None else None
+            if resources is not None:
+                test_status['resources'] = resources
+            if test_fingerprints.get(test_name) is not None:
+                test_status['fingerprint'] = test_fingerprints[test_name]
+            run_status[test_name] = test_status
+            report({'type': 'test', 'test': test_name, 'status': test_status})
             if verbose:
-                print("  -> test '{}' run, status: {}".format(
-                    test.test_function_name, test_status.get('status', "UNKNOWN")
+                print("  -> test '{}' run, status: {}{}".format(
+                    test_name, test_status.get('status', "UNKNOWN"),
+                    " (calculation from AiiDA cache)" if test_status.get('cached_from') else ""
                 ))
+
+        dependency_errors = get_dependency_errors(all_tests)
+        # Tests whose process nodes are needed by other tests: never skipped as CACHED
+        upstream_names = {upstream_name for test in selected_tests for upstream_name in test.depends_on}
+        shared_nodes = {}
+
+        def prepare(test):
+            """
+            Prepare a test whose dependencies are done, on the computer it is dispatched to: return
+            None if it must not be run (its status is then recorded), ``_COMPUTERS_BUSY`` if no computer
+            is available, else a tuple ``(ProcessClass, inputs, timings, timeout)``
+            """
+            test_name = test.test_function_name
+            timings = test_timings[test_name] = {}
+            if budget_exhausted():
+                record_status(test_name, skip_status())
+                return None
+            for upstream_name in test.depends_on:
+                if run_status[upstream_name].get('status') != 'SUCCESS':
+                    record_status(test_name, skip_status("the upstream test '{}' did not succeed".format(upstream_name)))
+                    return None
+
+            # Run on the computer of the first upstream test, where its remote folders are
+            upstream_computers = [computer_pool.get_computer(upstream_name) for upstream_name in test.depends_on]
+            computer = computer_pool.acquire(test_name, [name for name in upstream_computers if name][:1] or None)
+            if computer is None:
+                return _COMPUTERS_BUSY
+            self.codes = self.codes_by_computer[computer]
+
+            ProcessClass, inputs, test_status = self._prepare_test(
+                test, timings, {upstream_name: self.process_nodes[upstream_name] for upstream_name in test.depends_on})
+            if ProcessClass is None:
+                record_status(test_name, test_status)
+                return None
+            inputs = share_unstored_nodes(inputs, shared_nodes)
+
+            with timed(timings, 'fingerprint'):
+                fingerprint = test_fingerprints[test_name] = get_test_fingerprint(
+                    type(self), map_nodes(inputs, lambda node: fingerprint_codes.get(node.uuid, node)),
+                    test.entrypoint_name, image_checksums)
+            if (fingerprint is not None and previous_fingerprints.get(test_name) == fingerprint and
+                    test_name not in upstream_names):
+                record_status(test_name, {'status': 'CACHED'})
+                return None
+            timeout = get_remaining_time(get_test_timeout(test.timeout, inputs, default_timeout), deadline)
+            return ProcessClass, inputs, timings, timeout
+
+        for test in selected_tests:
+            if test.test_function_name in dependency_errors:
+                test_timings[test.test_function_name] = {}
+                record_status(test.test_function_name, {
+                    'status': 'INVALID_DEPENDENCIES', 'reason': dependency_errors[test.test_function_name]})
+        selected_tests = [test for test in selected_tests if test.test_function_name not in dependency_errors]
+
+        for _, tier in itertools.groupby(selected_tests, key=lambda test: test.priority):
+            tier = sort_tests(list(tier), expected_durations)
+            if concurrent:
+                self._submit_tier(tier, prepare, record_status, run_status, poll_interval, resource_monitor)
+                continue
+            for test in tier:
+                prepared = prepare(test)
+                if prepared is _COMPUTERS_BUSY:
+                    # Nothing else runs in serial mode: waiting would not free a slot
+                    record_status(test.test_function_name, skip_status("no computer available to run the test"))
+                elif prepared is not None:
+                    ProcessClass, inputs, timings, timeout = prepared
+                    record_status(test.test_function_name, self._run_get_status(
+                        ProcessClass, inputs, test, timings, calculation_caching, timeout, resource_monitor))
+
+        return run_status
+
+    def benchmark(self, repeats=DEFAULT_BENCHMARK_REPEATS, verbose=False, prebuilt_codes=None,  # pylint: disable=too-many-arguments
+                  computer_name=DEFAULT_COMPUTER_NAME, report=None, tests=None, baselines=None,
+                  threshold=DEFAULT_THRESHOLD, alpha=DEFAULT_ALPHA, update_baselines=False, default_timeout=None):
+        """
+        Run each test ``repeats`` times and compare its wall times and the runtimes of its calculation
+        jobs to its baseline (see :py:mod:`aiida_plugin_ci.benchmarking`).
+
+        Tests are run one at a time, with AiiDA caching disabled, and regenerating their inputs at each
+        repeat. A test that does not succeed in a repeat is not repeated further, and gets the status of
+        that repeat. A test that succeeds in all repeats gets the ``PERF_REGRESSION`` status if it is
+        significantly slower than its baseline in either of them (listed under ``regressions``), the
+        ``SUCCESS`` status otherwise. In both cases, the ``benchmark`` key of its status contains the
+        ``wall_times`` and ``calcjob_times`` samples and, if there is a baseline, the result of the
+        comparison of each of them under ``baseline``.
+
+        :param prebuilt_codes: passed to :py:meth:`setup_codes`
+        :param computer_name: passed to :py:meth:`setup_codes`
+        :param report: as in :py:meth:`run`
+        :param tests: as in :py:meth:`run`
+        :param baselines: the :py:class:`aiida_plugin_ci.benchmarking.BenchmarkBaselines` to compare
+            to (and to update); by default, those in the state directory (saved at the end)
+        :param threshold: minimal relative slowdown of the medians to report a regression
+        :param alpha: significance level of the comparison
+        :param update_baselines: if True, the samples of the tests that succeeded replace their
+            baselines; otherwise, only the tests without a baseline get one
+        :param default_timeout: as in :py:meth:`run`
+        """
+        from aiida.manage.caching import disable_caching
+
+        if repeats < 1:
+            raise ValueError("The number of repeats must be at least 1, got {}".format(repeats))
+        if report is None:
+            report = _discard_record
+        save_baselines = baselines is None
+        if baselines is None:
+            baselines = BenchmarkBaselines()
+        class_name = '{}.{}'.format(type(self).__module__, type(self).__name__)
+        self.class_timings = {}
+        self.process_nodes = {}
+        run_status = {}
+
+        with timed(self.class_timings, 'total'):
+            if self._setup_class(verbose, prebuilt_codes, [(computer_name, None)], report):
+                all_tests = self.get_tests()
+                if tests is not None:
+                    tests = get_required_tests(all_tests, tests)
+                selected_tests = [test for test in all_tests if tests is None or test.test_function_name in tests]
+
+                def record_status(test_name, status):
+                    run_status[test_name] = status
+                    report({'type': 'test', 'test': test_name, 'status': status})
+                    if verbose:
+                        print("  -> test '{}' benchmarked, status: {}{}".format(
+                            test_name, status.get('status', "UNKNOWN"),
+                            " ({})".format(", ".join(status['regressions'])) if status.get('regressions') else ""))
+
+                # Before sorting, that leaves out the tests in dependency cycles
+                dependency_errors = get_dependency_errors(all_tests)
+                for test in selected_tests:
+                    if test.test_function_name in dependency_errors:
+                        record_status(test.test_function_name, {
+                            'status': 'INVALID_DEPENDENCIES', 'reason': dependency_errors[test.test_function_name]})
+
+                selected_tests = [test for test in selected_tests if test.test_function_name not in dependency_errors]
+                for test in sort_tests(selected_tests):
+                    test_name = test.test_function_name
+                    if any(run_status[upstream_name]['status'] not in ('SUCCESS', 'PERF_REGRESSION')
+                           for upstream_name in test.depends_on):
+                        status = {'status': 'SKIPPED', 'reason': 'an upstream test did not succeed'}
+                    else:
+                        with disable_caching():
+                            status = self._benchmark_test(test, repeats, default_timeout)
+                    if 'benchmark' in status:
+                        status.update(self._compare_benchmark(
+                            baselines, class_name, test_name, status, threshold, alpha, update_baselines))
+                    record_status(test_name, status)
+        report({'type': 'class', 'timings': self.class_timings})
+
+        if save_baselines:
+            baselines.save()
         return run_status
+
+    def _benchmark_test(self, test, repeats, default_timeout):
+        """
+        Run a test ``repeats`` times (or until it does not succeed), and return the status of the last run,
+        with the samples under the ``benchmark`` key (if all runs succeeded)
+        """
+        upstream_nodes = {upstream_name: self.process_nodes[upstream_name] for upstream_name in test.depends_on}
+        wall_times = []
+        calcjob_times = []
+        for _ in range(repeats):
+            timings = {}
+            ProcessClass, inputs, status = self._prepare_test(test, timings, upstream_nodes)
+            if ProcessClass is None:
+                break
+            timeout = get_test_timeout(test.timeout, inputs, default_timeout)
+            status = self._run_get_status(ProcessClass, inputs, test, timings, False, timeout)
+            status['timings'] = timings
+            if status.get('status') != 'SUCCESS':
+                break
+            wall_times.append(timings['run_get_node'])
+            calcjob_times.append(get_calcjob_runtime(self.process_nodes[test.test_function_name]))
+        else:
+            status['benchmark'] = {'wall_times': wall_times, 'calcjob_times': calcjob_times}
+        return status
+
+    @staticmethod
+    def _compare_benchmark(baselines, class_name, test_name, status, threshold, alpha, update_baselines):  # pylint: disable=too-many-arguments
+        """
+        Compare the samples of a benchmarked test to its baseline, updating the baseline if requested
+        (or if there is none)
+
+        :return: the keys to update in the status of the test
+        """
+        samples = status['benchmark']
+        baseline = baselines.get(class_name, test_name)
+        update = {}
+        comparisons = compare_benchmark(samples, baseline, threshold, alpha) if baseline is not None else {}
+        if comparisons:
+            update['benchmark'] = dict(samples, baseline=comparisons)
+            regressions = sorted(metric for metric, comparison in comparisons.items() if comparison['regression'])
+            if regressions:
+                update['status'] = 'PERF_REGRESSION'
+                update['regressions'] = regressions
+        if baseline is None or (update_baselines and samples['wall_times']):
+            baselines.set(class_name, test_name, samples['wall_times'], samples['calcjob_times'])
+        return update
@@ -0,0 +1,162 @@
+"""
+Performance regression checks: repeated runs of the tests compared to stored baselines
+
+In benchmark mode (see :py:meth:`aiida_plugin_ci.TestProcessPlugin.benchmark`), each test
+is run several times, measuring its wall time (the time spent in ``run_get_node``)
+and the runtime of its calculation jobs (from their creation to their last modification).
+
+The wall times and the calculation job runtimes are each compared to the samples of a
+baseline with a one-sided Mann-Whitney U test: a test is reported with the
+``PERF_REGRESSION`` status if, for either of them, the probability of being this much slower
+by chance is below ``alpha`` and the median is more than ``threshold`` (relative) above the
+median of the baseline. With the exact test, at least 4 repeats (and 4 baseline samples) are
+needed to detect a regression with ``alpha=0.05``.
+
+Baselines are stored as JSON, by default in the state directory; the file can also be
+committed in the repository of the plugin.
+"""
+from __future__ import absolute_import, division
+
+import itertools
+import json
+import math
+import os
+import time
+
+from .state import get_state_file
+
+BASELINES_FILENAME = 'benchmark-baselines.json'
+DEFAULT_BENCHMARK_REPEATS = 5
+# Minimal relative slowdown of the median of a metric to report a regression
+DEFAULT_THRESHOLD = 0.1
+# Significance level of the statistical test
+DEFAULT_ALPHA = 0.05
+# Samples compared to their baseline, by key in the samples and in the baselines
+BENCHMARK_METRICS = ('wall_times', 'calcjob_times')
+# Above this number of permutations, the normal approximation of the U statistic is used
+MAX_EXACT_PERMUTATIONS = 20000
+
+
+def median(values):
+    """Return the median of a non-empty list of numbers"""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.
+
+
+def _u_statistic(samples, baseline):
+    """Return the Mann-Whitney U statistic of ``samples`` against ``baseline`` (ties count half)"""
+    return sum(1. if value > other else 0.5 if value == other else 0. for value in samples for other in baseline)
+
+
+def _num_combinations(num, choose):
+    return math.factorial(num) // (math.factorial(choose) * math.factorial(num - choose))
+
+
+def get_slowdown_p_value(samples, baseline):
+    """
+    Return the p-value of the one-sided Mann-Whitney U test that ``samples`` are larger than ``baseline``
+
+    The exact permutation distribution is used for small samples, its normal approximation otherwise.
+    """
+    num_samples, num_baseline = len(samples), len(baseline)
+    u_statistic = _u_statistic(samples, baseline)
+
+    if _num_combinations(num_samples + num_baseline, num_samples) <= MAX_EXACT_PERMUTATIONS:
+        pooled = list(samples) + list(baseline)
+        num_extreme = num_total = 0
+        for indices in itertools.combinations(range(len(pooled)), num_samples):
+            chosen = set(indices)
+            permuted_samples = [pooled[index] for index in indices]
+            permuted_baseline = [value for index, value in enumerate(pooled) if index not in chosen]
+            num_total += 1
+            if _u_statistic(permuted_samples, permuted_baseline) >= u_statistic - 1e-9:
+                num_extreme += 1
+        return num_extreme / num_total
+
+    mean = num_samples * num_baseline / 2.
+    standard_deviation = math.sqrt(num_samples * num_baseline * (num_samples + num_baseline + 1) / 12.)
+    z_score = (u_statistic - 0.5 - mean) / standard_deviation
+    return 0.5 * math.erfc(z_score / math.sqrt(2.))
+
+
+def compare_to_baseline(samples, baseline_samples, threshold=DEFAULT_THRESHOLD, alpha=DEFAULT_ALPHA):
+    """
+    Compare the samples of a metric of a test (e.g. its wall times) to those of its baseline
+
+    :return: a dictionary with the ``median`` of the baseline, the relative ``slowdown`` of the
+        medians, the ``p_value`` of the slowdown and whether it is a ``regression``
+    """
+    baseline_median = median(baseline_samples)
+    slowdown = median(samples) / baseline_median - 1. if baseline_median > 0 else 0.
+    p_value = get_slowdown_p_value(samples, baseline_samples)
+    return {
+        'median': baseline_median,
+        'slowdown': slowdown,
+        'p_value': p_value,
+        'regression': p_value < alpha and slowdown > threshold,
+    }
+
+
+def compare_benchmark(samples, baseline, threshold=DEFAULT_THRESHOLD, alpha=DEFAULT_ALPHA):
+    """
+    Compare each metric (``BENCHMARK_METRICS``) of the samples of a test to its baseline,
+    skipping the metrics without samples in either of them
+
+    :param samples: a dictionary mapping the metrics to the samples of the test
+    :param baseline: a dictionary mapping the metrics to the samples of the baseline
+    :return: a dictionary mapping the compared metrics to the result of :py:func:`compare_to_baseline`
+    """
+    return {
+        metric: compare_to_baseline(samples[metric], baseline[metric], threshold, alpha)
+        for metric in BENCHMARK_METRICS if samples.get(metric) and baseline.get(metric)
+    }
+
+
+def get_calcjob_runtime(process_node):
+    """
+    Return the seconds from the creation to the last modification of the calculation jobs
+    of a process (itself, or the ones it called), summed
+    """
+    from aiida.orm import CalcJobNode
+
+    runtime = 0.
+    for node in [process_node] + list(getattr(process_node, 'called_descendants', [])):
+        if isinstance(node, CalcJobNode):
+            runtime += (node.mtime - node.ctime).total_seconds()
+    return runtime
+
+
+class BenchmarkBaselines(object):
+    """
+    Baselines of the wall times and calculation job runtimes of the tests, by class and test name
+    """
+    def __init__(self, path=None):
+        self.path = path or get_state_file(BASELINES_FILENAME)
+        try:
+            with open(self.path) as handle:
+                self._data = json.load(handle)
+        except (IOError, OSError, ValueError):
+            self._data = {}
+
+    def get(self, class_name, test_name):
+        """
+        Return the baseline of a test (a dictionary with the ``wall_times`` and ``calcjob_times``
+        samples), or None if there is none
+        """
+        return self._data.get(class_name, {}).get(test_name)
+
+    def set(self, class_name, test_name, wall_times, calcjob_times):
+        """Set the baseline of a test"""
+        self._data.setdefault(class_name, {})[test_name] = {
+            'wall_times': wall_times, 'calcjob_times': calcjob_times, 'time': time.time()
+        }
+
+    def save(self):
+        """Write the baselines to disk"""
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            handle.write(json.dumps(self._data, sort_keys=True, indent=2))
+        os.rename(tmp_path, self.path)
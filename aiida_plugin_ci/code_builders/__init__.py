@@ -4,8 +4,14 @@ Module to manage code builders
 In particular, contains a CODE_BUILDERS dictionary that maps to the 
 respective classes
 """
+from .httpimage import HttpImage
+from .localexecutable import LocalExecutable
+from .localmirror import LocalMirror
 from .singularityhub import SingularityHub
 
 CODE_BUILDERS = {
+    'httpimage': HttpImage,
+    'localexecutable': LocalExecutable,
+    'localmirror': LocalMirror,
     'singularityhub': SingularityHub,
 }
@@ -2,11 +2,70 @@
 Module containing the base class for builders
 """
 import abc
+import hashlib
+import json
+import re
+import subprocess
+import threading
+
+# Name of the computer on which codes are set up, unless specified otherwise
+DEFAULT_COMPUTER_NAME = 'localhost'
+
+# Name of the extra storing the hash used to find codes that can be reused
+CODE_HASH_EXTRA = 'aiida_plugin_ci_code_hash'
+
+# In-process registry of the codes already set up, keyed by their hash
+_CODE_REGISTRY = {}
+_CODE_REGISTRY_LOCK = threading.Lock()
+
+
+def check_output_with_progress(command, progress=None, cwd=None):
+    """
+    Run a command like ``subprocess.check_output`` (with the standard error merged into the
+    output), calling ``progress`` with each line of output as soon as it is printed. Lines
+    are split also on carriage returns, so that progress bars are reported as they update.
+
+    :raise subprocess.CalledProcessError: if the command returns a non-zero exit code
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
+    output = []
+    pending = b''
+    while True:
+        chunk = process.stdout.read1(4096) if hasattr(process.stdout, 'read1') else process.stdout.readline()
+        if not chunk:
+            break
+        output.append(chunk)
+        lines = re.split(b'[\r\n]', pending + chunk)
+        pending = lines.pop()
+        if progress is not None:
+            for line in lines:
+                if line.strip():
+                    progress(line.decode('utf8', 'replace').rstrip())
+    if pending.strip() and progress is not None:
+        progress(pending.decode('utf8', 'replace').rstrip())
+    process.stdout.close()
+    return_code = process.wait()
+    output = b''.join(output)
+    if return_code:
+        raise subprocess.CalledProcessError(return_code, command, output)
+    return output
+
+
+def get_code_hash(computer_uuid, full_exec_command, input_plugin_name, label, image_checksum):
+    """
+    Return a hash identifying an AiiDA code set up for a built code
+    """
+    return hashlib.sha256(json.dumps([
+        computer_uuid, full_exec_command, input_plugin_name, label, image_checksum
+    ]).encode('utf8')).hexdigest()
+
 
 class CodeBuilder(object):
     """
     Base class for a builder
     """
+    _progress_callback = None
+
     @abc.abstractmethod
     def build(self):
         """
@@ -23,22 +82,93 @@ class CodeBuilder(object):
         In the future, extend it to a list of string? Requires adaptation in AiiDA
         """
 
-    def setup_aiida_code(self, input_plugin_name, code_name):
+    def set_progress_callback(self, callback):
+        """
+        Set a callable, called by ``build()`` with a string describing its progress (e.g. each
+        line of output of a download) as soon as it is available; None to disable it.
+        """
+        self._progress_callback = callback
+
+    def report_progress(self, message):
+        """Report the progress of ``build()`` to the progress callback, if any"""
+        if self._progress_callback is not None:
+            self._progress_callback(message)
+
+    def get_image_checksum(self):  # pylint: disable=no-self-use
+        """
+        Return a checksum (e.g. sha256) identifying the built code, if available.
+
+        Should be called after ``build()``. By default returns None.
+        """
+        return None
+
+    def get_build_timings(self):  # pylint: disable=no-self-use
+        """
+        Return a dictionary with the seconds spent in builder-specific phases of ``build()``
+        (e.g. waiting for a lock), added to the timings of the build status.
+
+        By default returns an empty dictionary.
+        """
+        return {}
+
+    def start_instance_pool(self, size):  # pylint: disable=no-self-use,unused-argument
+        """
+        Start a pool of ``size`` persistent instances of the built code, that calculations are
+        routed to instead of starting the code from scratch, and return it.
+
+        The returned object has a ``get_exec_command()`` method, returning the execution
+        command to set up in AiiDA to use the pool, and a ``stop()`` method.
+        Should be called after ``build()``. By default returns None (pools are not supported).
+        """
+        return None
+
+    def setup_aiida_code(self, input_plugin_name, code_name, computer_name=DEFAULT_COMPUTER_NAME,
+                         full_exec_command=None):
         """
         Setup the code in AiiDA.
 
-        It expects to find already an AiiDA computer, named 'localhost', 
-        and setup with a local transport.
+        It expects to find already an AiiDA computer, named 'localhost' 
+        (or ``computer_name``), and setup with a local transport.
+        The execution command is ``full_exec_command`` if given (e.g. to use an
+        instance pool), else the one returned by ``get_full_exec_command()``.
+
+        An already stored code with the same computer, execution command,
+        input plugin, label and image checksum is reused if it exists:
+        first from an in-process registry, then by querying the database
+        (codes created here carry the hash of these properties in the
+        ``CODE_HASH_EXTRA`` extra). Otherwise, a new code is stored.
 
         It returns the configured AiiDA code.
         """
-        from aiida.orm import Computer, Code
+        from aiida.orm import Computer, Code, QueryBuilder
+
+        computer = Computer.objects.get(name=computer_name)
+        if full_exec_command is None:
+            full_exec_command = self.get_full_exec_command()
+        code_hash = get_code_hash(
+            computer_uuid=computer.uuid, full_exec_command=full_exec_command,
+            input_plugin_name=input_plugin_name, label=code_name,
+            image_checksum=self.get_image_checksum())
+
+        with _CODE_REGISTRY_LOCK:
+            if code_hash in _CODE_REGISTRY:
+                return _CODE_REGISTRY[code_hash]
 
-        computer = Computer.objects.get(name='localhost')
-        code = Code(
-            remote_computer_exec=(computer, self.get_full_exec_command()), 
-            input_plugin_name=input_plugin_name, label=code_name)
-        code.store()
+            query = QueryBuilder()
+            query.append(Code, filters={'extras.{}'.format(CODE_HASH_EXTRA): code_hash})
+            query.limit(1)
+            result = query.first()
+            if result is not None:
+                code = result[0]
+            else:
+                code = Code(
+                    remote_computer_exec=(computer, full_exec_command), 
+                    input_plugin_name=input_plugin_name, label=code_name)
+                # Set before storing, so that the extra is stored together with the code:
+                # a code stored without it would never be found again
+                code.set_extra(CODE_HASH_EXTRA, code_hash)
+                code.store()
+            _CODE_REGISTRY[code_hash] = code
         return code
 
     @classmethod
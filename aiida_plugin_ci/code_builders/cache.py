@@ -0,0 +1,274 @@
+"""
+Persistent cache of the container images fetched by the code builders
+
+The cache lives in the same directory as the images themselves and keeps
+a JSON index keyed by the fully resolved reference of each image (e.g. the
+``shub://`` pull string, including registry, tag and commit).
+For every entry it records the file name, size, sha256 checksum and the
+time it was fetched and last used, plus global hit/miss counters.
+
+References pinned to a commit are immutable, so they are always served from
+the cache if the file is present. Unpinned references (e.g. a moving tag)
+are served from the cache only for ``unpinned_max_age`` seconds after they
+were fetched.
+
+When the total size of the cached images exceeds the disk budget, the least
+recently used entries are evicted. Images looked up or added by a process that
+is still running are never evicted, since its test classes may not have run yet
+(e.g. while the codes of the following classes are being built). Images hard-linked
+from elsewhere (e.g. from a local mirror) do not count towards the budget, since
+they take no additional space.
+"""
+from __future__ import print_function, absolute_import
+
+import errno
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .locking import file_lock
+
+IMAGE_CACHE_INDEX_FILENAME = 'image-cache-index.json'
+# Default disk budget for the cached images, in bytes
+DEFAULT_MAX_SIZE = int(os.environ.get('AIIDA_PLUGIN_CI_IMAGE_CACHE_MAX_SIZE', 20 * 1024**3))
+# Default validity of unpinned references (e.g. only a tag), in seconds
+DEFAULT_UNPINNED_MAX_AGE = int(os.environ.get('AIIDA_PLUGIN_CI_IMAGE_CACHE_UNPINNED_MAX_AGE', 24 * 3600))
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_file_checksum(path, block_size=1024 * 1024):
+    """Return the sha256 hex digest of the file at ``path``"""
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def _is_process_alive(pid):
+    """Return whether a process with the given PID is running"""
+    try:
+        os.kill(pid, 0)
+    except OSError as exception:
+        # EPERM: the process exists, but belongs to another user
+        return exception.errno == errno.EPERM
+    return True
+
+
+def _add_user(entry):
+    """Record that the current process uses the image of an index entry"""
+    users = [pid for pid in entry.get('users', []) if _is_process_alive(pid)]
+    if os.getpid() not in users:
+        users.append(os.getpid())
+    entry['users'] = users
+
+
+def _is_in_use(entry):
+    """Return whether a running process uses the image of an index entry"""
+    return any(_is_process_alive(pid) for pid in entry.get('users', []))
+
+
+def get_image_cache(cache_dir):
+    """
+    Return the (process-wide) ImageCache instance for the given directory
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    with _CACHES_LOCK:
+        if cache_dir not in _CACHES:
+            _CACHES[cache_dir] = ImageCache(cache_dir)
+        return _CACHES[cache_dir]
+
+
+class ImageCache(object):
+    """
+    Index of the images stored in a directory, with LRU eviction
+    """
+    def __init__(self, cache_dir, max_size=None, unpinned_max_age=None):
+        """
+        :param cache_dir: the directory where images (and the index) are stored
+        :param max_size: the disk budget in bytes (default: ``DEFAULT_MAX_SIZE``)
+        :param unpinned_max_age: seconds for which an unpinned reference is considered
+            valid (default: ``DEFAULT_UNPINNED_MAX_AGE``)
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = DEFAULT_MAX_SIZE if max_size is None else max_size
+        self.unpinned_max_age = DEFAULT_UNPINNED_MAX_AGE if unpinned_max_age is None else unpinned_max_age
+        self._lock = threading.RLock()
+
+    @property
+    def index_path(self):
+        """Full path to the JSON index file"""
+        return os.path.join(self.cache_dir, IMAGE_CACHE_INDEX_FILENAME)
+
+    def _index_lock(self):
+        """
+        Return a context manager locking the index, also against other processes
+        """
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError:
+                if not os.path.isdir(self.cache_dir):
+                    raise
+        return file_lock(self.index_path + '.lock')
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as handle:
+                index = json.load(handle)
+        except (IOError, OSError, ValueError):
+            index = {}
+        index.setdefault('entries', {})
+        index.setdefault('hits', 0)
+        index.setdefault('misses', 0)
+        return index
+
+    def _save_index(self, index):
+        # Write to a temporary file first, then rename (atomic on POSIX)
+        tmp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            handle.write(json.dumps(index, sort_keys=True, indent=2))
+        os.rename(tmp_path, self.index_path)
+
+    def lookup(self, key, filename, pinned):
+        """
+        Look for a valid cached image for the given key.
+
+        The lookup counts as a hit only if the entry is in the index, the file
+        is on disk with the expected size and, for unpinned references, the entry is
+        not older than ``unpinned_max_age``. The checksum is not recomputed here
+        to keep hits cheap.
+
+        :param key: the fully resolved reference of the image
+        :param filename: the file name (relative to the cache dir) the image should have
+        :param pinned: whether the reference is immutable (e.g. pinned to a commit)
+        :return: the index entry (a dict) on a hit, None on a miss
+        """
+        with self._lock, self._index_lock():
+            index = self._load_index()
+            entry = index['entries'].get(key)
+            now = time.time()
+
+            valid = entry is not None and entry['filename'] == filename
+            if valid:
+                path = os.path.join(self.cache_dir, filename)
+                try:
+                    valid = os.path.getsize(path) == entry['size']
+                except OSError:
+                    valid = False
+            if valid and not pinned:
+                valid = now - entry['created'] <= self.unpinned_max_age
+
+            if valid:
+                entry['last_used'] = now
+                _add_user(entry)
+                index['hits'] += 1
+            else:
+                entry = None
+                index['misses'] += 1
+            self._save_index(index)
+            return entry
+
+    def add(self, key, filename, checksum=None):
+        """
+        Register a freshly fetched image in the index and evict old entries if needed.
+
+        :param key: the fully resolved reference of the image
+        :param filename: the file name (relative to the cache dir) of the image
+        :param checksum: the sha256 checksum of the image, if already known
+            (otherwise it is computed)
+        :return: the new index entry
+        """
+        path = os.path.join(self.cache_dir, filename)
+        if checksum is None:
+            checksum = get_file_checksum(path)
+        with self._lock, self._index_lock():
+            index = self._load_index()
+            now = time.time()
+            entry = {
+                'filename': filename,
+                'size': os.path.getsize(path),
+                'checksum': checksum,
+                'created': now,
+                'last_used': now,
+            }
+            _add_user(entry)
+            index['entries'][key] = entry
+            self._evict(index, keep=key)
+            self._save_index(index)
+            return entry
+
+    def _get_disk_size(self, entry):
+        """
+        Return the space taken by the image of an entry: zero if it is also linked from
+        elsewhere (e.g. hard-linked from a local mirror), None if it is missing
+        """
+        try:
+            stat = os.stat(os.path.join(self.cache_dir, entry['filename']))
+        except OSError:
+            return None
+        return stat.st_size if stat.st_nlink == 1 else 0
+
+    def _get_used_size(self, entries):
+        """Return the space taken by the images of the entries (each file counted once)"""
+        sizes = {entry['filename']: self._get_disk_size(entry) or 0 for entry in entries.values()}
+        return sum(sizes.values())
+
+    def _evict(self, index, keep=None):
+        """
+        Remove least recently used entries (and their files) until the space taken by the
+        images fits in the disk budget. The entry with key ``keep`` and the entries in use
+        by a running process are never evicted, and entries whose image is linked from
+        elsewhere are not evicted either, since that would free no space.
+        """
+        entries = index['entries']
+        total_size = self._get_used_size(entries)
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total_size <= self.max_size:
+                break
+            entry = entries[key]
+            disk_size = self._get_disk_size(entry)
+            if key == keep or _is_in_use(entry) or disk_size == 0:
+                continue
+            del entries[key]
+            # Another entry may point to the same file (e.g. two tags, same commit)
+            if disk_size is None or any(other['filename'] == entry['filename'] for other in entries.values()):
+                continue
+            total_size -= disk_size
+            try:
+                os.remove(os.path.join(self.cache_dir, entry['filename']))
+            except OSError:
+                pass
+
+    def evict(self):
+        """Evict least recently used entries until the cache fits in its disk budget"""
+        with self._lock, self._index_lock():
+            index = self._load_index()
+            self._evict(index)
+            self._save_index(index)
+
+    def get_statistics(self):
+        """Return a dictionary with hit/miss counts, number of entries and total size"""
+        with self._lock, self._index_lock():
+            index = self._load_index()
+        return {
+            'hits': index['hits'],
+            'misses': index['misses'],
+            'num_entries': len(index['entries']),
+            'size': self._get_used_size(index['entries']),
+            'max_size': self.max_size,
+        }
+
+    def print_status(self):
+        """
+        Print information on the status of the cache
+        """
+        stats = self.get_statistics()
+        print("- IMAGE CACHE: {}".format(self.cache_dir))
+        print("  {} hits, {} misses".format(stats['hits'], stats['misses']))
+        print("  {} images, {:.1f} MB used out of {:.1f} MB".format(
+            stats['num_entries'], stats['size'] / 1024.**2, stats['max_size'] / 1024.**2))
@@ -0,0 +1,409 @@
+"""
+Builder fetching an image from a plain HTTP(S) URL (e.g. a web server, or the blob endpoint
+of a container registry)
+
+If the server supports range requests, the image is split in chunks fetched in parallel by
+several connections, and written in place into a partial file next to the image
+(``<image>.part``). The chunks already written are recorded in a JSON file
+(``<image>.part.json``), together with the size and the ``ETag`` (or ``Last-Modified``) of
+the image, so that an interrupted download resumes from the missing chunks at the next build,
+as long as the image did not change on the server (images served without either header are
+always downloaded from the beginning). A chunk whose connection drops is requested again from
+its last byte received.
+
+The sha256 checksum is computed while downloading, without reading the file again: the
+chunks are hashed in order as soon as they are received, keeping in memory only the chunks
+received before the preceding ones (the connections never get more than ``2 * connections``
+chunks ahead of the first chunk not hashed yet). Only the chunks downloaded by a previous
+build are read back from the partial file. The image is renamed to its final name only if the
+checksum matches the expected one, if any: the ``sha256`` parameter or else the
+``sha256:<hex>`` digest in the URL, as in registry blob URLs.
+
+Servers not supporting range requests are read in a single stream, restarting from the
+beginning on errors.
+"""
+from __future__ import division, print_function
+
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    from http.client import HTTPException
+    from urllib.error import HTTPError, URLError
+    from urllib.request import Request, urlopen
+except ImportError:  # Python 2
+    from httplib import HTTPException
+    from urllib2 import HTTPError, Request, URLError, urlopen
+
+from .base import CodeBuilder
+from .cache import get_image_cache
+from .instances import SingularityInstancePool
+from .localmirror import make_executable
+from .locking import file_lock
+from .singularityhub import SINGULARITY_IMAGES_DIR
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_CHUNK_SIZE = 8 * 1024**2
+# Attempts for each chunk (or for the whole image, without range requests)
+DEFAULT_RETRIES = 5
+# Seconds to wait for the server before retrying
+HTTP_TIMEOUT = 60
+READ_SIZE = 64 * 1024
+# HTTP errors that are worth retrying
+RETRIED_HTTP_CODES = (408, 429, 500, 502, 503, 504)
+
+_DIGEST_REGEX = re.compile(r'sha256:([0-9a-f]{64})')
+
+
+class DownloadCancelled(Exception):
+    """Raised in the connections still running when another one failed"""
+
+
+def _is_retriable(exception):
+    """Return whether a download failing with ``exception`` should be retried"""
+    if isinstance(exception, HTTPError):
+        return exception.code in RETRIED_HTTP_CODES
+    return isinstance(exception, (HTTPException, URLError, IOError, OSError))
+
+
+class HttpImage(CodeBuilder):
+    """
+    Builder fetching an image from an HTTP(S) URL (see the module docstring)
+    """
+    def __init__(  # pylint: disable=too-many-arguments
+            self, url, sha256=None, headers=None, connections=DEFAULT_CONNECTIONS, chunk_size=DEFAULT_CHUNK_SIZE,
+            retries=DEFAULT_RETRIES):
+        """
+        Setup a builder.
+
+        :param url: the URL of the image
+        :param sha256: the expected sha256 checksum of the image (by default, the
+            ``sha256:<hex>`` digest in the URL, if any). Images with a checksum are cached forever,
+            the other ones as images referenced by a tag
+            (see :py:mod:`aiida_plugin_ci.code_builders.cache`)
+        :param headers: optional dictionary of additional HTTP headers (e.g. ``Authorization``)
+        :param connections: the maximum number of chunks downloaded at the same time
+        :param chunk_size: the size of the chunks, in bytes
+        :param retries: the number of times a chunk is requested again after an error
+        """
+        self._url = url
+        if sha256 is None:
+            match = _DIGEST_REGEX.search(url)
+            sha256 = match.group(1) if match else None
+        self._sha256 = sha256.lower() if sha256 else None
+        self._headers = dict(headers or {})
+        self._connections = max(1, connections)
+        self._chunk_size = chunk_size
+        self._retries = retries
+        self._image_checksum = None
+        self._lock_wait = None
+        self._download_time = None
+        # Bytes downloaded by this build, and reused from a previous one
+        self.downloaded_bytes = 0
+        self.resumed_bytes = 0
+
+    def get_image_filename(self):
+        """Return the filename of the image in the images directory"""
+        name = self._sha256 or hashlib.sha256(self._url.encode('utf8')).hexdigest()
+        basename = re.sub(r'[^A-Za-z0-9._-]', '-', self._url.split('?')[0].rstrip('/').rpartition('/')[2])
+        if self._sha256 and self._sha256 in basename:
+            # e.g. a registry blob, named after its digest
+            return 'http-{}'.format(basename)
+        return 'http-{}-{}'.format(name[:12], basename or 'image')
+
+    def get_image_full_path(self):
+        """
+        Return full absolute path to the where the image will be (once fetched)
+        """
+        return os.path.abspath(os.path.join(SINGULARITY_IMAGES_DIR, self.get_image_filename()))
+
+    def get_cache_key(self):
+        """Return the key of the image in the image cache"""
+        if self._sha256:
+            return '{}@sha256:{}'.format(self._url, self._sha256)
+        return self._url
+
+    def get_image_checksum(self):
+        """
+        Return the sha256 checksum of the image, or None if the image was not built yet
+        """
+        return self._image_checksum
+
+    def get_build_timings(self):
+        """
+        Return the seconds spent waiting for another process fetching the same image
+        (``lock_wait``) and downloading it (``download``), if ``build()`` was called
+        """
+        timings = {}
+        if self._lock_wait is not None:
+            timings['lock_wait'] = self._lock_wait
+        if self._download_time is not None:
+            timings['download'] = self._download_time
+        return timings
+
+    def _open(self, byte_range=None):
+        """Send a GET request for the image (or the ``(first, last)`` bytes of it) and return the response"""
+        headers = dict(self._headers)
+        if byte_range is not None:
+            headers['Range'] = 'bytes={}-{}'.format(*byte_range)
+        return urlopen(Request(self._url, headers=headers), timeout=HTTP_TIMEOUT)
+
+    def _probe(self):
+        """
+        Return the size of the image (None if unknown), whether the server supports range
+        requests, and the validator of the image (``ETag`` or ``Last-Modified``, or None)
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self._open((0, 0))
+                break
+            except (HTTPException, IOError, OSError) as exception:
+                # Range not satisfiable, e.g. for an empty file: download it in a single stream
+                if isinstance(exception, HTTPError) and exception.code == 416:
+                    return None, False, None
+                attempt += 1
+                self._retry(attempt, exception, "Request for '{}'".format(self._url))
+        try:
+            validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            if response.getcode() == 206:
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                if total.isdigit():
+                    return int(total), True, validator
+            length = response.headers.get('Content-Length')
+            return (int(length) if response.getcode() == 200 and length else None), False, validator
+        finally:
+            response.close()
+
+    def _retry(self, attempt, exception, what):
+        """Wait before retrying a download that failed, or raise ``exception`` if it should not be retried"""
+        if attempt > self._retries or not _is_retriable(exception):
+            raise exception
+        self.report_progress("{} failed ({}), retrying ({}/{})".format(what, exception, attempt, self._retries))
+        time.sleep(min(2**attempt, 30))
+
+    def _download_chunk(self, path, first, last, cancelled):
+        """
+        Download the bytes from ``first`` to ``last`` (included) into the partial file at ``path``,
+        resuming from the last byte received on errors
+
+        :param cancelled: a ``threading.Event``, set to abort the download
+        :return: the downloaded bytes
+        """
+        data = []
+        offset = first
+        attempt = 0
+        with open(path, 'r+b') as handle:
+            handle.seek(first)
+            while offset <= last:
+                try:
+                    response = self._open((offset, last))
+                    try:
+                        if response.getcode() != 206:
+                            raise ValueError("The server ignored the range request for '{}'".format(self._url))
+                        while offset <= last:
+                            if cancelled.is_set():
+                                raise DownloadCancelled()
+                            block = response.read(min(READ_SIZE, last + 1 - offset))
+                            if not block:
+                                raise IOError("Connection closed at byte {} of '{}'".format(offset, self._url))
+                            handle.write(block)
+                            data.append(block)
+                            offset += len(block)
+                    finally:
+                        response.close()
+                except (HTTPException, IOError, OSError) as exception:
+                    attempt += 1
+                    self._retry(attempt, exception, "Download of bytes {}-{}".format(offset, last))
+        return b''.join(data)
+
+    def _download_chunks(self, part_path, size, validator):
+        """
+        Download the image in parallel chunks into the partial file at ``part_path``, resuming
+        the chunks recorded in its state file, and return its sha256 checksum
+        """
+        state_path = '{}.json'.format(part_path)
+        state = {'url': self._url, 'size': size, 'chunk_size': self._chunk_size, 'validator': validator}
+        try:
+            with open(state_path) as handle:
+                previous_state = json.load(handle)
+        except (IOError, OSError, ValueError):
+            previous_state = {}
+        done_before = set()
+        if (os.path.isfile(part_path) and os.path.getsize(part_path) == size and validator is not None and
+                all(previous_state.get(key) == value for key, value in state.items())):
+            done_before = set(previous_state.get('chunks', []))
+        else:
+            with open(part_path, 'wb') as handle:
+                handle.truncate(size)
+        state['chunks'] = sorted(done_before)
+
+        num_chunks = -(-size // self._chunk_size)
+        chunk_bounds = [
+            (index * self._chunk_size, min(size, (index + 1) * self._chunk_size) - 1) for index in range(num_chunks)
+        ]
+        self.resumed_bytes = sum(chunk_bounds[index][1] + 1 - chunk_bounds[index][0] for index in done_before)
+        if done_before:
+            self.report_progress("Resuming the download of '{}' ({:.1f}/{:.1f} MB already downloaded)".format(
+                self._url, self.resumed_bytes / 1024**2, size / 1024**2))
+
+        checksum = hashlib.sha256()
+        next_to_hash = 0
+        # Chunks received but not hashed yet
+        received = {}
+        to_download = collections.deque(index for index in range(num_chunks) if index not in done_before)
+        running = {}
+        cancelled = threading.Event()
+        window = 2 * self._connections
+        executor = ThreadPoolExecutor(max_workers=self._connections)
+        try:
+            with open(part_path, 'rb') as part_handle:
+                while next_to_hash < num_chunks:
+                    while (to_download and len(running) < self._connections and
+                           to_download[0] < next_to_hash + window):
+                        index = to_download.popleft()
+                        future = executor.submit(self._download_chunk, part_path, chunk_bounds[index][0],
+                                                 chunk_bounds[index][1], cancelled)
+                        running[future] = index
+
+                    if next_to_hash in received or next_to_hash in done_before:
+                        data = received.pop(next_to_hash, None)
+                        if data is None:
+                            first, last = chunk_bounds[next_to_hash]
+                            part_handle.seek(first)
+                            data = part_handle.read(last + 1 - first)
+                        checksum.update(data)
+                        next_to_hash += 1
+                        continue
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        index = running.pop(future)
+                        received[index] = future.result()
+                        self.downloaded_bytes += len(received[index])
+                        state['chunks'].append(index)
+                        self._save_state(state_path, state)
+                    self.report_progress("{:.1f}/{:.1f} MB ({:.0f}%)".format(
+                        (self.resumed_bytes + self.downloaded_bytes) / 1024**2, size / 1024**2,
+                        100. * (self.resumed_bytes + self.downloaded_bytes) / max(size, 1)))
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=True)
+        return checksum.hexdigest()
+
+    @staticmethod
+    def _save_state(state_path, state):
+        """Write the state of a chunked download (atomically)"""
+        tmp_path = '{}.{}.tmp'.format(state_path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            json.dump(state, handle)
+        os.rename(tmp_path, state_path)
+
+    def _download_stream(self, part_path):
+        """
+        Download the image in a single stream into the partial file at ``part_path``, restarting
+        from the beginning on errors, and return its sha256 checksum
+        """
+        attempt = 0
+        while True:
+            checksum = hashlib.sha256()
+            self.downloaded_bytes = 0
+            try:
+                response = self._open()
+                try:
+                    with open(part_path, 'wb') as handle:
+                        while True:
+                            block = response.read(READ_SIZE)
+                            if not block:
+                                break
+                            handle.write(block)
+                            checksum.update(block)
+                            self.downloaded_bytes += len(block)
+                finally:
+                    response.close()
+                return checksum.hexdigest()
+            except (HTTPException, IOError, OSError) as exception:
+                attempt += 1
+                self._retry(attempt, exception, "Download of '{}'".format(self._url))
+
+    def build(self):
+        """
+        Fetch the image, unless it is already in the image cache
+        (see :py:mod:`aiida_plugin_ci.code_builders.cache`)
+
+        Builds of the same image are serialized, also across processes, with a lock file next
+        to the image (as for :py:class:`aiida_plugin_ci.code_builders.singularityhub.SingularityHub`).
+
+        :raise ValueError: if the checksum of the image does not match the expected one (the
+            partial file is then removed)
+        """
+        if not os.path.isdir(SINGULARITY_IMAGES_DIR):
+            try:
+                os.makedirs(SINGULARITY_IMAGES_DIR)
+            except OSError:
+                if not os.path.isdir(SINGULARITY_IMAGES_DIR):
+                    raise
+
+        image_filename = self.get_image_filename()
+        image_cache = get_image_cache(SINGULARITY_IMAGES_DIR)
+        lock_path = os.path.join(SINGULARITY_IMAGES_DIR, '{}.lock'.format(image_filename))
+        with file_lock(lock_path) as self._lock_wait:
+            entry = image_cache.lookup(self.get_cache_key(), image_filename, pinned=bool(self._sha256))
+            if entry is not None:
+                # Images fetched before they were made executable
+                if not os.access(self.get_image_full_path(), os.X_OK):
+                    make_executable(self.get_image_full_path())
+                self._image_checksum = entry['checksum']
+                return
+
+            part_path = '{}.part'.format(self.get_image_full_path())
+            start = time.time()
+            size, supports_ranges, validator = self._probe()
+            if supports_ranges:
+                checksum = self._download_chunks(part_path, size, validator)
+            else:
+                checksum = self._download_stream(part_path)
+            self._download_time = time.time() - start
+
+            if self._sha256 is not None and checksum != self._sha256:
+                for path in [part_path, '{}.json'.format(part_path)]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise ValueError("Checksum mismatch for '{}': expected {}, found {}".format(
+                    self._url, self._sha256, checksum))
+            # The image is run directly (e.g. by the wrapper of the pools of instances)
+            make_executable(part_path)
+            os.rename(part_path, self.get_image_full_path())
+            if os.path.exists('{}.json'.format(part_path)):
+                os.remove('{}.json'.format(part_path))
+
+            self._image_checksum = image_cache.add(self.get_cache_key(), image_filename, checksum=checksum)['checksum']
+
+    def start_instance_pool(self, size):
+        """
+        Start a pool of ``size`` persistent instances of the image
+        (see :py:mod:`aiida_plugin_ci.code_builders.instances`)
+        """
+        pool = SingularityInstancePool(self.get_image_full_path(), size)
+        pool.start()
+        return pool
+
+    def get_full_exec_command(self):
+        """
+        Get the full execution command (as a string)
+        """
+        return self.get_image_full_path()
+
+    @classmethod
+    def print_status(cls):
+        """
+        Print information on the status of required dependencies
+        """
+        print("- HTTP IMAGES: fetched into '{}', with up to {} connections per image".format(
+            SINGULARITY_IMAGES_DIR, DEFAULT_CONNECTIONS))
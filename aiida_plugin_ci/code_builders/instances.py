@@ -0,0 +1,268 @@
+"""
+Pools of persistent Singularity instances, to avoid starting a container for each calculation
+
+A pool starts ``size`` instances of an image (``singularity instance start``) and registers
+each of them as a file in the ``<image>.instances`` directory, next to the image. The code is
+then set up with a wrapper script (``<image>.pool.sh``) as its executable: the wrapper runs
+the runscript of the image in one of the registered instances (``singularity exec
+instance://...``), chosen by its PID, or executes the image directly if none is registered.
+The wrapper only depends on the image, so the AiiDA code is the same for all pools (also of
+concurrent processes, that share their instances).
+
+Since a calculation of any process can run in any registered instance, the wrapper counts
+itself as a user of the instance while it runs (a file named by its PID in the
+``<image>.instances/<instance>.users`` directory). Stopping a pool
+(:py:meth:`SingularityInstancePool.stop`, and otherwise when the interpreter exits) retires
+its instances, so that no new calculation is routed to them, and stops those without live
+users; the others are stopped by their last user when it finishes. Instances of processes
+that died without stopping them, and retired instances whose last user was killed, are
+stopped when a new pool of the same image is started.
+"""
+import atexit
+import errno
+import itertools
+import os
+import shutil
+import subprocess
+import threading
+
+try:
+    from shlex import quote
+except ImportError:  # Python 2
+    def quote(string):
+        """Quote a string for the shell, as ``shlex.quote``"""
+        return "'" + string.replace("'", "'\"'\"'") + "'"
+
+INSTANCE_NAME_PREFIX = 'aiida-ci'
+# Suffixes of the entries of the pool directory besides the registered instances (that have no dots)
+RETIRED_SUFFIX = '.retired'
+USERS_SUFFIX = '.users'
+
+WRAPPER_TEMPLATE = """#!/bin/sh
+# Generated by aiida-plugin-ci: run the image in an instance of its warm pool, if any
+pool_dir={pool_dir}
+instances=$(ls "$pool_dir" 2>/dev/null | grep -v '\\.')
+if [ -n "$instances" ]; then
+    count=$(echo "$instances" | wc -l)
+    instance=$(echo "$instances" | sed -n "$(( $$ % count + 1 ))p")
+    users="$pool_dir/$instance.users"
+    # Count as a user first, then check that the instance was not retired meanwhile
+    mkdir -p "$users" 2>/dev/null && touch "$users/$$" 2>/dev/null
+    if [ -f "$pool_dir/$instance" ]; then
+        singularity exec "instance://$instance" /.singularity.d/runscript "$@"
+        status=$?
+        rm -f "$users/$$"
+        # The last user of a retired instance stops it
+        if [ -f "$pool_dir/$instance.retired" ] && [ -z "$(ls "$users" 2>/dev/null)" ]; then
+            singularity instance stop "$instance" >/dev/null 2>&1
+            rm -rf "$pool_dir/$instance.retired" "$users"
+        fi
+        exit $status
+    fi
+    rm -f "$users/$$"
+fi
+exec {image_path} "$@"
+"""
+
+_POOL_COUNTER = itertools.count()
+# Pools started and not stopped yet, stopped at exit
+_ACTIVE_POOLS = set()
+_ACTIVE_POOLS_LOCK = threading.Lock()
+
+
+def get_pool_dir(image_path):
+    """Return the directory where the instances of the pools of an image are registered"""
+    return '{}.instances'.format(image_path)
+
+
+def get_wrapper_path(image_path):
+    """Return the path of the wrapper script running an image in the instances of its pools"""
+    return '{}.pool.sh'.format(image_path)
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+
+def _stop_instance(instance_name):
+    """Stop an instance, ignoring errors (e.g. if it already stopped)"""
+    try:
+        subprocess.check_output(['singularity', 'instance', 'stop', instance_name], stderr=subprocess.STDOUT)
+    except (subprocess.CalledProcessError, OSError):
+        pass
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _get_live_users(pool_dir, instance_name):
+    """
+    Return the PIDs of the wrappers running in an instance, removing the files of those that
+    were killed before unregistering
+    """
+    users_dir = os.path.join(pool_dir, instance_name + USERS_SUFFIX)
+    try:
+        entries = os.listdir(users_dir)
+    except OSError:
+        return []
+    pids = []
+    for entry in entries:
+        try:
+            pid = int(entry)
+        except ValueError:
+            continue
+        if _is_process_alive(pid):
+            pids.append(pid)
+        else:
+            _remove(os.path.join(users_dir, entry))
+    return pids
+
+
+def _retire_instance(pool_dir, instance_name):
+    """Unregister an instance, so that the wrapper does not route new calculations to it"""
+    entry_path = os.path.join(pool_dir, instance_name)
+    try:
+        os.rename(entry_path, entry_path + RETIRED_SUFFIX)
+    except OSError:
+        pass
+
+
+def _stop_if_unused(pool_dir, instance_name):
+    """
+    Stop a retired instance, unless a wrapper is still running in it (the last one stops it)
+
+    :return: whether the instance was stopped
+    """
+    if _get_live_users(pool_dir, instance_name):
+        return False
+    _stop_instance(instance_name)
+    _remove(os.path.join(pool_dir, instance_name + RETIRED_SUFFIX))
+    shutil.rmtree(os.path.join(pool_dir, instance_name + USERS_SUFFIX), ignore_errors=True)
+    return True
+
+
+def write_wrapper(image_path):
+    """
+    Write the wrapper script of an image (atomically, and only if its content changed)
+
+    :return: the path of the wrapper
+    """
+    wrapper_path = get_wrapper_path(image_path)
+    content = WRAPPER_TEMPLATE.format(pool_dir=quote(get_pool_dir(image_path)), image_path=quote(image_path))
+    try:
+        with open(wrapper_path) as handle:
+            if handle.read() == content:
+                return wrapper_path
+    except (IOError, OSError):
+        pass
+    tmp_path = '{}.{}.tmp'.format(wrapper_path, os.getpid())
+    with open(tmp_path, 'w') as handle:
+        handle.write(content)
+    os.chmod(tmp_path, 0o755)
+    os.rename(tmp_path, wrapper_path)
+    return wrapper_path
+
+
+def stop_stale_instances(image_path):
+    """
+    Stop the instances of an image registered by processes that are not running anymore, and
+    the retired instances whose last user was killed
+    """
+    pool_dir = get_pool_dir(image_path)
+    try:
+        entries = os.listdir(pool_dir)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.endswith(RETIRED_SUFFIX):
+            _stop_if_unused(pool_dir, entry[:-len(RETIRED_SUFFIX)])
+            continue
+        if '.' in entry:
+            continue
+        try:
+            with open(os.path.join(pool_dir, entry)) as handle:
+                owner_pid = int(handle.read().strip())
+        except (IOError, OSError, ValueError):
+            continue
+        if not _is_process_alive(owner_pid):
+            _retire_instance(pool_dir, entry)
+            _stop_if_unused(pool_dir, entry)
+
+
+class SingularityInstancePool(object):
+    """
+    A pool of persistent instances of a Singularity image (see the module docstring)
+    """
+    def __init__(self, image_path, size):
+        self.image_path = image_path
+        self.size = size
+        self.instance_names = []
+
+    def start(self):
+        """
+        Start the instances and register them; if one fails to start, those already started are stopped
+
+        :raise subprocess.CalledProcessError: if ``singularity instance start`` fails
+        """
+        stop_stale_instances(self.image_path)
+        write_wrapper(self.image_path)
+        pool_dir = get_pool_dir(self.image_path)
+        if not os.path.isdir(pool_dir):
+            try:
+                os.makedirs(pool_dir)
+            except OSError:
+                # Possibly created concurrently by another pool
+                if not os.path.isdir(pool_dir):
+                    raise
+
+        with _ACTIVE_POOLS_LOCK:
+            _ACTIVE_POOLS.add(self)
+        pool_id = next(_POOL_COUNTER)
+        try:
+            for index in range(self.size):
+                instance_name = '{}-{}-{}-{}'.format(INSTANCE_NAME_PREFIX, os.getpid(), pool_id, index)
+                subprocess.check_output(
+                    ['singularity', 'instance', 'start', self.image_path, instance_name], stderr=subprocess.STDOUT)
+                self.instance_names.append(instance_name)
+                with open(os.path.join(pool_dir, instance_name), 'w') as handle:
+                    handle.write(str(os.getpid()))
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        """
+        Retire the instances, and stop those not in use by a calculation (of this or other
+        processes); the others are stopped by the wrapper when their last calculation finishes.
+        Can be called more than once.
+        """
+        pool_dir = get_pool_dir(self.image_path)
+        # Retire all instances first, so that no new calculation is routed to them
+        for instance_name in self.instance_names:
+            _retire_instance(pool_dir, instance_name)
+        for instance_name in self.instance_names:
+            _stop_if_unused(pool_dir, instance_name)
+        self.instance_names = []
+        with _ACTIVE_POOLS_LOCK:
+            _ACTIVE_POOLS.discard(self)
+
+    def get_exec_command(self):
+        """Return the executable to set up in AiiDA to run the image in the pool"""
+        return get_wrapper_path(self.image_path)
+
+
+@atexit.register
+def stop_active_pools():
+    """Stop all pools started in this process and not stopped yet"""
+    with _ACTIVE_POOLS_LOCK:
+        pools = list(_ACTIVE_POOLS)
+    for pool in pools:
+        pool.stop()
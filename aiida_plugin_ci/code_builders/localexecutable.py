@@ -0,0 +1,71 @@
+"""
+Builder for a local executable script, e.g. to test the runner without network access
+"""
+import hashlib
+import os
+import stat
+
+from .base import CodeBuilder
+
+LOCAL_EXECUTABLES_DIR = os.environ.get(
+    'AIIDA_PLUGIN_CI_LOCAL_EXECUTABLES_DIR', '/tmp/aiida-plugin-ci-executables')
+
+
+class LocalExecutable(CodeBuilder):
+    """
+    Builder writing a script to a local file and making it executable
+    """
+    def __init__(self, script, name='executable'):
+        """
+        Setup a builder.
+
+        :param script: the content of the script, including the shebang line
+            (e.g. ``#!/bin/bash``)
+        :param name: a name for the script file (its checksum is appended to it)
+        """
+        self._script = script
+        self._name = name
+
+    def get_image_checksum(self):
+        """
+        Return the sha256 checksum of the script
+        """
+        return hashlib.sha256(self._script.encode('utf8')).hexdigest()
+
+    def get_executable_full_path(self):
+        """
+        Return the full path of the script
+        """
+        return os.path.join(LOCAL_EXECUTABLES_DIR, '{}-{}'.format(self._name, self.get_image_checksum()[:16]))
+
+    def build(self):
+        """
+        Write the script, if not already there
+        """
+        path = self.get_executable_full_path()
+        if os.path.isfile(path):
+            return
+        if not os.path.isdir(LOCAL_EXECUTABLES_DIR):
+            try:
+                os.makedirs(LOCAL_EXECUTABLES_DIR)
+            except OSError:
+                if not os.path.isdir(LOCAL_EXECUTABLES_DIR):
+                    raise
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            handle.write(self._script)
+        os.chmod(tmp_path, os.stat(tmp_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        os.rename(tmp_path, path)
+
+    def get_full_exec_command(self):
+        """
+        Get the full execution command (as a string)
+        """
+        return self.get_executable_full_path()
+
+    @classmethod
+    def print_status(cls):
+        """
+        Print information on the status of required dependencies
+        """
+        print("- LOCAL EXECUTABLES: stored in {}".format(LOCAL_EXECUTABLES_DIR))
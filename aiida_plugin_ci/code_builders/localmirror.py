@@ -0,0 +1,216 @@
+"""
+Builder for images already available in a local directory (e.g. a mirror on a shared filesystem)
+
+Images are placed in the images directory without copying their content when
+possible: with a hard link if the mirror is on the same filesystem (and the
+image in the mirror is executable, since it is run directly), otherwise
+with a reflink (copy-on-write clone, on filesystems supporting it), and only
+as a last resort with a full copy.
+
+The mirror directory may contain an ``index.json`` file mapping image
+references (e.g. ``shub://username/reponame:tag``) to a dictionary with the
+``path`` of the image (relative to the mirror directory) and its ``sha256``
+checksum. Images can also be referenced directly by their path in the mirror.
+"""
+from __future__ import print_function
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+
+from .base import CodeBuilder
+from .cache import get_file_checksum, get_image_cache
+from .locking import file_lock
+from .singularityhub import SINGULARITY_IMAGES_DIR
+
+MIRROR_DIR = os.environ.get('AIIDA_PLUGIN_CI_IMAGE_MIRROR_DIR', None)
+MIRROR_INDEX_FILENAME = 'index.json'
+
+# ioctl request to clone a file on Linux (from linux/fs.h)
+FICLONE = 0x40049409
+
+
+def reflink(source, destination):
+    """
+    Create ``destination`` as a copy-on-write clone of ``source``
+
+    :raise OSError: if the filesystem (or the platform) does not support reflinks
+    """
+    with open(source, 'rb') as source_handle:
+        with open(destination, 'wb') as destination_handle:
+            try:
+                fcntl.ioctl(destination_handle.fileno(), FICLONE, source_handle.fileno())
+            except (IOError, OSError):
+                destination_handle.close()
+                os.remove(destination)
+                raise OSError(errno.EOPNOTSUPP, "Reflinks not supported")
+
+
+def make_executable(path):
+    """Add the execute permission for whoever can read the file at ``path``"""
+    mode = os.stat(path).st_mode
+    os.chmod(path, mode | (mode & 0o444) >> 2)
+
+
+def provision_file(source, destination):
+    """
+    Place ``source`` at ``destination`` with a hard link, a reflink or a copy (the first that works)
+
+    The file is first created with a temporary name, made executable (images are run directly)
+    and then atomically renamed. A hard link is only used if ``source`` is already executable,
+    since its permissions are shared with the link.
+
+    :return: the method used, one of ``'hardlink'``, ``'reflink'`` and ``'copy'``
+    """
+    tmp_path = '{}.{}.tmp'.format(destination, os.getpid())
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    methods = [('reflink', reflink), ('copy', shutil.copyfile)]
+    if os.access(source, os.X_OK):
+        methods.insert(0, ('hardlink', os.link))
+    for method, function in methods:
+        try:
+            function(source, tmp_path)
+        except (IOError, OSError):
+            if method == 'copy':
+                raise
+            continue
+        if method != 'hardlink':
+            shutil.copymode(source, tmp_path)
+            make_executable(tmp_path)
+        os.rename(tmp_path, destination)
+        return method
+
+
+class LocalMirror(CodeBuilder):
+    """
+    Builder provisioning an image from a local mirror directory
+    """
+    def __init__(self, image, mirror_dir=None, sha256=None):
+        """
+        Setup a builder.
+
+        :param image: the reference of the image in the index of the mirror, or its path
+            relative to the mirror directory
+        :param mirror_dir: the mirror directory (by default, from the
+            ``AIIDA_PLUGIN_CI_IMAGE_MIRROR_DIR`` environment variable)
+        :param sha256: the expected sha256 checksum of the image (by default, the one in the
+            index of the mirror, if any)
+        """
+        self._mirror_dir = mirror_dir or MIRROR_DIR
+        if self._mirror_dir is None:
+            raise ValueError(
+                "No mirror directory: pass 'mirror_dir' or set AIIDA_PLUGIN_CI_IMAGE_MIRROR_DIR")
+        self._image = image
+        self._sha256 = sha256
+        self._image_checksum = None
+        self._lock_wait = None
+        self.provisioning_method = None
+
+    def _resolve(self):
+        """
+        Return the absolute path of the image in the mirror and its expected checksum (or None)
+        """
+        try:
+            with open(os.path.join(self._mirror_dir, MIRROR_INDEX_FILENAME)) as handle:
+                index = json.load(handle)
+        except (IOError, OSError, ValueError):
+            index = {}
+        if self._image in index:
+            entry = index[self._image]
+            path, sha256 = entry['path'], entry.get('sha256')
+        else:
+            path, sha256 = self._image, None
+        if self._sha256 is not None:
+            sha256 = self._sha256
+        return os.path.abspath(os.path.join(self._mirror_dir, path)), sha256
+
+    def get_image_filename(self):
+        """
+        Return the filename of the image in the images directory, unique to its path in the mirror
+        (images with the same name in different mirrors, or folders of a mirror, do not collide)
+        """
+        source = self._resolve()[0]
+        return 'mirror-{}-{}'.format(
+            hashlib.sha256(source.encode('utf8')).hexdigest()[:12], os.path.basename(source))
+
+    def get_image_full_path(self):
+        """
+        Return full absolute path to the where the image will be (once provisioned)
+        """
+        return os.path.abspath(os.path.join(SINGULARITY_IMAGES_DIR, self.get_image_filename()))
+
+    def get_image_checksum(self):
+        """
+        Return the sha256 checksum of the image, or None if the image was not built yet
+        """
+        return self._image_checksum
+
+    def get_build_timings(self):
+        """
+        Return the seconds spent waiting for another build provisioning the same image
+        (``lock_wait``), if ``build()`` was called
+        """
+        if self._lock_wait is None:
+            return {}
+        return {'lock_wait': self._lock_wait}
+
+    def build(self):
+        """
+        Provision the image from the mirror, verifying its checksum.
+
+        The checksum of a file in the mirror is computed only the first time it is
+        provisioned: the image cache records it, keyed by the path, size and
+        modification time of the file in the mirror.
+
+        Builds of the same image are serialized, also across processes, with a lock file next
+        to the image (as for :py:class:`aiida_plugin_ci.code_builders.singularityhub.SingularityHub`).
+        """
+        source, expected_sha256 = self._resolve()
+        stat = os.stat(source)
+        key = 'mirror://{}@{}:{}'.format(source, stat.st_size, stat.st_mtime)
+        filename = self.get_image_filename()
+
+        if not os.path.isdir(SINGULARITY_IMAGES_DIR):
+            try:
+                os.makedirs(SINGULARITY_IMAGES_DIR)
+            except OSError:
+                if not os.path.isdir(SINGULARITY_IMAGES_DIR):
+                    raise
+        image_cache = get_image_cache(SINGULARITY_IMAGES_DIR)
+        lock_path = os.path.join(SINGULARITY_IMAGES_DIR, '{}.lock'.format(filename))
+        with file_lock(lock_path) as self._lock_wait:
+            entry = image_cache.lookup(key, filename, pinned=True)
+            if entry is not None and expected_sha256 in (None, entry['checksum']):
+                self._image_checksum = entry['checksum']
+                self.provisioning_method = 'cached'
+                return
+
+            checksum = get_file_checksum(source)
+            if expected_sha256 is not None and checksum != expected_sha256:
+                raise ValueError("Checksum mismatch for '{}' in the mirror: expected {}, found {}".format(
+                    source, expected_sha256, checksum))
+
+            self.provisioning_method = provision_file(source, self.get_image_full_path())
+            self._image_checksum = image_cache.add(key, filename, checksum=checksum)['checksum']
+
+    def get_full_exec_command(self):
+        """
+        Get the full execution command (as a string)
+        """
+        return self.get_image_full_path()
+
+    @classmethod
+    def print_status(cls):
+        """
+        Print information on the status of required dependencies
+        """
+        if MIRROR_DIR is None:
+            print("- LOCAL MIRROR: no default mirror (AIIDA_PLUGIN_CI_IMAGE_MIRROR_DIR not set)")
+        elif not os.path.isdir(MIRROR_DIR):
+            print("- LOCAL MIRROR: default mirror '{}' not found".format(MIRROR_DIR))
+        else:
+            print("- LOCAL MIRROR: default mirror '{}'".format(MIRROR_DIR))
@@ -0,0 +1,24 @@
+"""
+Inter-process file locks, to coordinate builds of the same image by several processes
+"""
+import contextlib
+import fcntl
+
+from ..timing import monotonic
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """
+    Context manager holding an exclusive lock on ``lock_path`` (created if needed).
+
+    The lock is shared between processes and between threads (each call opens the file
+    again). It yields the number of seconds spent waiting to acquire the lock.
+    """
+    start = monotonic()
+    with open(lock_path, 'a') as handle:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            yield monotonic() - start
+        finally:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
@@ -5,11 +5,14 @@ import contextlib
 import os
 import subprocess
 
-from .base import CodeBuilder
+from .base import CodeBuilder, check_output_with_progress
+from .cache import get_image_cache
+from .instances import SingularityInstancePool
+from .locking import file_lock
 
 # Images could go to SINGULARITY_CACHEDIR if we use 'singularity run' for instance
 # instead of 'singularity pull'. To check, this would avoid the need of a caching dir
-SINGULARITY_IMAGES_DIR = '/tmp/singularity-images'
+SINGULARITY_IMAGES_DIR = os.environ.get('AIIDA_PLUGIN_CI_SINGULARITY_IMAGES_DIR', '/tmp/singularity-images')
 
 @contextlib.contextmanager
 def cd(path, create=False):
@@ -47,6 +50,8 @@ class SingularityHub(CodeBuilder):
         self._tag = tag
         self._commit = commit
         self._exec_command = exec_command
+        self._image_checksum = None
+        self._lock_wait = None
 
         if self._exec_command is not None:
             raise NotImplementedError('Not yet implemented, might require changes in AiiDA')
@@ -87,23 +92,88 @@ class SingularityHub(CodeBuilder):
             self._commit or ""
         )
 
+    def is_pinned(self):
+        """
+        Return True if the image reference is immutable (i.e., a commit is specified)
+        """
+        return bool(self._commit)
+
+    def get_image_checksum(self):
+        """
+        Return the sha256 checksum of the image, or None if the image was not built yet
+        """
+        return self._image_checksum
+
+    def get_build_timings(self):
+        """
+        Return the seconds spent waiting for another process pulling the same image
+        (``lock_wait``), if ``build()`` was called
+        """
+        if self._lock_wait is None:
+            return {}
+        return {'lock_wait': self._lock_wait}
+
     def build(self):
         """
-        Build or fetch the code
+        Build or fetch the code.
+
+        The image is fetched only if it is not already in the image cache
+        (see :py:mod:`aiida_plugin_ci.code_builders.cache`).
+
+        Builds of the same image are serialized, also across processes (e.g. several
+        CI jobs on the same machine), with a lock file next to the image: the first
+        builder pulls the image while the others wait, and then find it in the cache.
+        The image is pulled to a temporary file and renamed only once complete, so
+        a partial image is never visible under the final name. The output of
+        ``singularity pull`` is streamed to the progress callback, if any.
         """
-        from subprocess import CalledProcessError
+        if not os.path.exists(SINGULARITY_IMAGES_DIR):
+            try:
+                os.makedirs(SINGULARITY_IMAGES_DIR)
+            except OSError:
+                # Possibly created concurrently by another builder
+                if not os.path.isdir(SINGULARITY_IMAGES_DIR):
+                    raise
+
+        image_filename = self.get_image_filename()
+        image_cache = get_image_cache(SINGULARITY_IMAGES_DIR)
+        lock_path = os.path.join(SINGULARITY_IMAGES_DIR, '{}.lock'.format(image_filename))
+        with file_lock(lock_path) as self._lock_wait:
+            entry = image_cache.lookup(self.get_pull_string(), image_filename, pinned=self.is_pinned())
+            if entry is not None:
+                self._image_checksum = entry['checksum']
+                return
+
+            tmp_filename = '{}.{}.tmp'.format(image_filename, os.getpid())
+            tmp_path = os.path.join(SINGULARITY_IMAGES_DIR, tmp_filename)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            try:
+                # Pass cwd rather than using cd(), since os.chdir() is process-wide
+                # and several builds may run concurrently in threads
+                check_output_with_progress(
+                    ['singularity', 'pull', '--name', tmp_filename, self.get_pull_string()],
+                    progress=self.report_progress, cwd=SINGULARITY_IMAGES_DIR)
 
-        with cd(SINGULARITY_IMAGES_DIR, create=True):
-            out = subprocess.check_output(                
-                ['singularity', 'pull', '--name', self.get_image_filename(), 
-                self.get_pull_string()])
-                
+                # singularity returns a non-zero error code on failure, but
+                # double check that the image was actually written
+                assert os.path.isfile(tmp_path), "No image file was built"
+                os.rename(tmp_path, self.get_image_full_path())
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
 
-        # Note that if the file was there and the previous command failed
-        # This will not raise.
-        # However, it should be ok as singularity in that case would return
-        # a non-zero error code and therefore there would be an exception
-        assert os.path.isfile(self.get_image_full_path()), "No image file was built"
+            entry = image_cache.add(self.get_pull_string(), image_filename)
+            self._image_checksum = entry['checksum']
+
+    def start_instance_pool(self, size):
+        """
+        Start a pool of ``size`` persistent instances of the image
+        (see :py:mod:`aiida_plugin_ci.code_builders.instances`)
+        """
+        pool = SingularityInstancePool(self.get_image_full_path(), size)
+        pool.start()
+        return pool
 
     def get_full_exec_command(self):
         """
@@ -133,3 +203,5 @@ class SingularityHub(CodeBuilder):
             print("- SINGULARITY: 'singularity' binary not found")
         else:
             print("- SINGULARITY: version {}".format(output.strip()))
+
+        get_image_cache(SINGULARITY_IMAGES_DIR).print_status()
@@ -0,0 +1,142 @@
+"""
+Pools of AiiDA computers over which the tests of a class are dispatched
+
+By default all codes are set up on the ``localhost`` computer. With a pool of computers,
+each code is set up on every computer of the pool (or on those listed in the ``computers``
+key of its declaration in ``code_resources``), and each test is dispatched to the
+least-loaded computer with a free slot (running tests divided by the maximum number of
+concurrent tests of the computer, if any): the codes returned by ``self.codes`` in its
+generate function are those set up on that computer. A test depending on other tests
+(see :py:mod:`aiida_plugin_ci.dependencies`) is dispatched to the computer of its first
+upstream test, so that it can use its remote folders.
+
+Copies of a local computer with separate work directories (see :py:func:`clone_computer`)
+are enough to run the calculations of a single host in parallel, e.g. with the daemon.
+"""
+from __future__ import absolute_import
+
+import copy
+import os
+
+from .code_builders.base import DEFAULT_COMPUTER_NAME
+
+
+def clone_computer(computer_name, base_computer_name=DEFAULT_COMPUTER_NAME, workdir_subfolder=None,
+                   description=None):
+    """
+    Return the name of a copy of a computer, creating it if needed.
+
+    The computer is a copy of ``base_computer_name`` (with all its settings, e.g. the shebang,
+    the prepend and append text and the default number of MPI processes per machine, and its
+    configuration for the current user) whose work directory is the ``workdir_subfolder``
+    subfolder (by default, named as the computer) of the original one.
+    """
+    from aiida.common import exceptions
+    from aiida.orm import Computer
+
+    try:
+        Computer.objects.get(name=computer_name)
+    except exceptions.NotExistent:
+        base_computer = Computer.objects.get(name=base_computer_name)
+        computer = Computer(
+            name=computer_name, hostname=base_computer.hostname,
+            description=description or "Copy of {} for aiida-plugin-ci".format(base_computer_name),
+            transport_type=base_computer.get_transport_type(),
+            scheduler_type=base_computer.get_scheduler_type())
+        computer.set_metadata(copy.deepcopy(base_computer.get_metadata()))
+        computer.set_workdir(os.path.join(base_computer.get_workdir(), workdir_subfolder or computer_name))
+        computer.store()
+        computer.configure(**base_computer.get_configuration())
+    return computer_name
+
+
+def setup_local_computers(num_computers, base_computer_name=DEFAULT_COMPUTER_NAME):
+    """
+    Return the names of ``num_computers`` copies of a computer (``<base>-ci-pool-<i>``),
+    creating them if needed
+    """
+    return [
+        clone_computer('{}-ci-pool-{}'.format(base_computer_name, index), base_computer_name,
+                       workdir_subfolder='ci-pool-{}'.format(index),
+                       description="Computer {} of the pool of aiida-plugin-ci".format(index))
+        for index in range(num_computers)
+    ]
+
+
+def parse_computers(spec):
+    """
+    Parse a comma-separated list of ``NAME[:MAX]`` items, ``MAX`` being the maximum number
+    of tests running at the same time on the computer
+
+    :return: a list of ``(name, max_concurrent)`` tuples, ``max_concurrent`` being None if not given
+    :raise ValueError: if a maximum is not a positive integer
+    """
+    computers = []
+    for item in spec.split(','):
+        name, _, max_concurrent = item.strip().partition(':')
+        if not name:
+            continue
+        if max_concurrent:
+            if not max_concurrent.isdigit() or int(max_concurrent) < 1:
+                raise ValueError("Invalid maximum number of tests for computer '{}': {}".format(name, max_concurrent))
+            computers.append((name, int(max_concurrent)))
+        else:
+            computers.append((name, None))
+    return computers
+
+
+class ComputerPool(object):
+    """
+    The computers over which tests are dispatched, and the tests running on each of them
+    (see the module docstring)
+    """
+    def __init__(self, computers):
+        """
+        :param computers: a list of ``(name, max_concurrent)`` tuples, ``max_concurrent`` being
+            None for no limit; ties between equally loaded computers are broken by this order
+        """
+        self.limits = dict(computers)
+        self._names = [name for name, _ in computers]
+        self._running = {name: set() for name in self._names}
+        self._num_dispatched = {name: 0 for name in self._names}
+        # Computer each test was last dispatched to
+        self._assignments = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def get_load(self, name):
+        """Return the fraction of the slots of a computer in use (the number of running tests if unlimited)"""
+        limit = self.limits[name]
+        return len(self._running[name]) / float(limit) if limit else float(len(self._running[name]))
+
+    def acquire(self, key, candidates=None):
+        """
+        Dispatch a test to the least-loaded computer with a free slot
+
+        :param key: the name of the test, to pass to :py:meth:`release` when it is done
+        :param candidates: optional list of names of the computers to choose from
+        :return: the name of the computer, or None if all candidates are full
+        """
+        free = [
+            name for name in self._names
+            if (candidates is None or name in candidates) and
+            (self.limits[name] is None or len(self._running[name]) < self.limits[name])
+        ]
+        if not free:
+            return None
+        name = min(free, key=lambda name: (self.get_load(name), self._num_dispatched[name], self._names.index(name)))
+        self._running[name].add(key)
+        self._num_dispatched[name] += 1
+        self._assignments[key] = name
+        return name
+
+    def release(self, key):
+        """Free the slot of a test (if it was dispatched)"""
+        name = self._assignments.get(key)
+        if name is not None:
+            self._running[name].discard(key)
+
+    def get_computer(self, key):
+        """Return the name of the computer a test was dispatched to, or None"""
+        return self._assignments.get(key)
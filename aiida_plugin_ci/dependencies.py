@@ -0,0 +1,136 @@
+"""
+Dependencies between the tests of a class
+
+A test can declare, with the ``depends_on`` argument of ``@process_test``, the names of
+other tests of the same class whose process nodes it needs to generate its inputs.
+An upstream test must have a priority lower than or equal to the priority of its
+dependents: tests with different priorities still run one priority after the other,
+while within a priority the tests are ordered (and, in concurrent mode, submitted)
+as soon as their dependencies are done.
+
+Among the tests whose dependencies are done, those with the longest expected duration
+(including the one of the chain of tests depending on them) come first, when expected
+durations are known (see :py:class:`aiida_plugin_ci.history.DurationHistory`): in
+concurrent mode, long tests are thus started first, rather than stretching the run at
+its end.
+"""
+from __future__ import absolute_import
+
+import heapq
+
+
+def get_required_tests(tests, test_names):
+    """
+    Return the names of the given tests and of all the tests they depend on, recursively
+
+    :param tests: the list of all ``SingleTest`` of a class
+    :param test_names: the names of the selected tests
+    :return: a set of test names (unknown dependencies are ignored)
+    """
+    tests_by_name = {test.test_function_name: test for test in tests}
+    required = set()
+    to_visit = list(test_names)
+    while to_visit:
+        test_name = to_visit.pop()
+        if test_name in required or test_name not in tests_by_name:
+            continue
+        required.add(test_name)
+        to_visit.extend(tests_by_name[test_name].depends_on)
+    return required
+
+
+def get_dependency_errors(tests):
+    """
+    Check the dependencies of the tests of a class
+
+    :param tests: the list of all ``SingleTest`` of a class
+    :return: a dictionary mapping the names of the tests with invalid dependencies (unknown
+        test, upstream with a higher priority, or cycle) to a message explaining why; a test
+        depending on a test with invalid dependencies is also invalid
+    """
+    tests_by_name = {test.test_function_name: test for test in tests}
+    errors = {}
+    for test in tests:
+        for upstream_name in test.depends_on:
+            if upstream_name not in tests_by_name:
+                errors[test.test_function_name] = "depends on the unknown test '{}'".format(upstream_name)
+            elif tests_by_name[upstream_name].priority > test.priority:
+                errors[test.test_function_name] = "depends on '{}', that has a higher priority".format(
+                    upstream_name)
+
+    # The tests left over by the topological sort are in a cycle or depend on a cycle
+    sorted_names = {test.test_function_name for test in sort_tests([
+        test for test in tests if test.test_function_name not in errors])}
+    for test in tests:
+        if test.test_function_name not in errors and test.test_function_name not in sorted_names:
+            errors[test.test_function_name] = "has cyclic dependencies"
+
+    # Propagate the errors to the dependents
+    changed = True
+    while changed:
+        changed = False
+        for test in tests:
+            if test.test_function_name in errors:
+                continue
+            for upstream_name in test.depends_on:
+                if upstream_name in errors:
+                    errors[test.test_function_name] = "depends on '{}', that {}".format(
+                        upstream_name, errors[upstream_name])
+                    changed = True
+                    break
+    return errors
+
+
+def _topological_sort(tests, dependents, get_key):
+    """
+    Return the tests sorted so that each test comes after the tests it depends on, taking
+    among the tests whose dependencies are done the one with the smallest ``get_key(test)``
+    """
+    num_pending = {test.test_function_name: 0 for test in tests}
+    for test_dependents in dependents.values():
+        for dependent in test_dependents:
+            num_pending[dependent.test_function_name] += 1
+
+    ready = [(get_key(test), test.test_function_name, test) for test in tests if not num_pending[test.test_function_name]]
+    heapq.heapify(ready)
+    sorted_tests = []
+    while ready:
+        _, _, test = heapq.heappop(ready)
+        sorted_tests.append(test)
+        for dependent in dependents.get(test.test_function_name, []):
+            num_pending[dependent.test_function_name] -= 1
+            if not num_pending[dependent.test_function_name]:
+                heapq.heappush(ready, (get_key(dependent), dependent.test_function_name, dependent))
+    return sorted_tests
+
+
+def sort_tests(tests, durations=None):
+    """
+    Sort the tests so that each test comes after the tests it depends on, and otherwise by
+    priority, expected duration (longest first, see the module docstring) and name.
+
+    Dependencies on tests not in the list are ignored. Tests in a dependency cycle are left out.
+
+    :param tests: a list of ``SingleTest``
+    :param durations: optional dictionary mapping test names to their expected duration in
+        seconds (tests not in it are expected to take no time)
+    :return: the sorted list
+    """
+    names = {test.test_function_name for test in tests}
+    dependents = {}
+    for test in tests:
+        for upstream_name in set(test.depends_on) & names:
+            dependents.setdefault(upstream_name, []).append(test)
+
+    sorted_tests = _topological_sort(tests, dependents, lambda test: (test.priority, 0.))
+    if not durations:
+        return sorted_tests
+
+    # Expected duration of each test followed by the longest chain of its dependents
+    path_durations = {}
+    for test in reversed(sorted_tests):
+        test_name = test.test_function_name
+        path_durations[test_name] = durations.get(test_name, 0.) + max(
+            [path_durations.get(dependent.test_function_name, 0.) for dependent in dependents.get(test_name, [])] or [0.])
+    return _topological_sort(
+        tests, dependents, lambda test: (test.priority, -path_durations.get(test.test_function_name, 0.)))
@@ -0,0 +1,288 @@
+"""
+Static discovery of the tests, without importing the test modules
+
+The test modules are parsed with the ``ast`` module to find the subclasses of
+``TestProcessPlugin`` and their ``@process_test`` methods. The result is cached
+in a manifest in the state directory, and a module is parsed again only if its
+content changed. This allows to describe and select tests without importing
+AiiDA or the plugins.
+
+The description of a class is a dictionary with keys:
+
+- ``module`` and ``class``: the names of the module and of the class
+- ``defines_custom_resources``: whether the class defines ``setup_resources``
+- ``code_names``: the sorted names of the codes in ``code_resources``
+- ``tests``: a list of dictionaries (with keys ``name``, ``priority``,
+  ``entrypoint_name``, ``generate_function``, the name of the function, and
+  ``depends_on``, the list of names of the upstream tests), sorted by priority and name;
+  parametrized tests are described by one entry per case (see :py:mod:`aiida_plugin_ci.parameters`)
+- ``static``: False if the class could not be fully described statically (e.g. the
+  arguments of ``process_test`` are not literals, or a base class is defined in
+  another module); in this case the module must be imported to describe it (see
+  :py:func:`aiida_plugin_ci.utils.get_descriptions`), and the class may turn out not to be
+  a test class at all
+"""
+from __future__ import print_function, absolute_import
+
+import ast
+import fnmatch
+import hashlib
+import json
+import os
+import pkgutil
+
+from .parameters import expand_parameters, get_case_names
+from .state import get_state_file
+
+MANIFEST_FILENAME = 'discovery-manifest.json'
+# Bump to invalidate manifests written by previous versions
+MANIFEST_VERSION = 4
+
+
+def get_test_modules(test_dir):
+    """
+    Return a sorted list of ``(module_name, file_path)`` for the test modules in ``test_dir``,
+    i.e. the valid python modules whose name starts with ``test_``
+    """
+    modules = []
+    for _, module_name, is_package in pkgutil.iter_modules([test_dir]):
+        if not module_name.startswith('test_'):
+            continue
+        if is_package:
+            path = os.path.join(test_dir, module_name, '__init__.py')
+        else:
+            path = os.path.join(test_dir, module_name + '.py')
+        if os.path.isfile(path):
+            modules.append((module_name, os.path.abspath(path)))
+    return sorted(modules)
+
+
+def _get_name(node):
+    """Return the name of a ``Name`` or ``Attribute`` node (e.g. ``b`` for ``a.b``), None otherwise"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _parse_process_test(decorator):
+    """
+    Return the arguments of a ``process_test(...)`` decorator as a dictionary,
+    None if the decorator is not ``process_test``, or False if they are not literals.
+
+    The parameters of a parametrized test are returned under the ``parameters`` key
+    (None if the test is not parametrized).
+    """
+    if not isinstance(decorator, ast.Call) or _get_name(decorator.func) != 'process_test':
+        return None
+    arguments = dict(zip(
+        ['priority', 'entrypoint_name', 'generate_function', 'timeout', 'depends_on', 'parameters', 'ids'],
+        decorator.args))
+    arguments.update({keyword.arg: keyword.value for keyword in decorator.keywords})
+    try:
+        depends_on = ast.literal_eval(arguments['depends_on']) if 'depends_on' in arguments else None
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        if 'ids' in arguments and ast.literal_eval(arguments['ids']) is not None:
+            return False
+        return {
+            'priority': ast.literal_eval(arguments['priority']),
+            'entrypoint_name': ast.literal_eval(arguments['entrypoint_name']),
+            'generate_function': _get_name(arguments['generate_function']),
+            'depends_on': list(depends_on or []),
+            'parameters': ast.literal_eval(arguments['parameters']) if 'parameters' in arguments else None,
+        }
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def _parse_code_names(node):
+    """Return the sorted names of the codes of a ``code_resources`` value, False if not literal"""
+    if isinstance(node, ast.Dict):
+        try:
+            return sorted(ast.literal_eval(key) for key in node.keys)
+        except ValueError:
+            return False
+    try:
+        value = ast.literal_eval(node)
+    except ValueError:
+        return False
+    return sorted(value) if value else []
+
+
+def _parse_class(node, module_name, known_classes):
+    """
+    Return the description of a class definition if it is (or may be) a ``TestProcessPlugin``
+    subclass, None otherwise.
+
+    A class with a base that is neither ``object`` nor defined in the module (e.g. a base class
+    of tests imported from another module) may be a subclass: it is described with
+    ``static`` set to False, so that its module is imported to describe it.
+
+    :param known_classes: the descriptions of the subclasses already found in the module
+    """
+    base_names = [_get_name(base) for base in node.bases]
+    if all(name == 'object' for name in base_names):
+        return None
+
+    description = {
+        'module': module_name,
+        'class': node.name,
+        'defines_custom_resources': False,
+        'code_names': [],
+        'tests': {},
+        'static': all(name == 'TestProcessPlugin' or name in known_classes for name in base_names),
+    }
+    # Inherit from the bases defined in the same module, the first base having precedence
+    for base_name in reversed(base_names):
+        if base_name in known_classes:
+            base = known_classes[base_name]
+            description['defines_custom_resources'] |= base['defines_custom_resources']
+            description['code_names'] = base['code_names']
+            description['tests'].update({test['name']: test for test in base['tests']})
+            description['static'] &= base['static']
+
+    for statement in node.body:
+        if isinstance(statement, ast.Assign) and any(
+                _get_name(target) == 'code_resources' for target in statement.targets):
+            code_names = _parse_code_names(statement.value)
+            if code_names is False:
+                description['static'] = False
+            else:
+                description['code_names'] = code_names
+        elif isinstance(statement, ast.FunctionDef):
+            if statement.name == 'setup_resources':
+                description['defines_custom_resources'] = True
+            if not statement.name.startswith('test_'):
+                continue
+            for decorator in statement.decorator_list:
+                arguments = _parse_process_test(decorator)
+                if arguments is False:
+                    description['static'] = False
+                elif arguments is not None:
+                    parameters = arguments.pop('parameters')
+                    if parameters is None:
+                        test_names = [statement.name]
+                    else:
+                        test_names = get_case_names(statement.name, expand_parameters(parameters))
+                    for test_name in test_names:
+                        description['tests'][test_name] = dict(arguments, name=test_name)
+
+    description['tests'] = sorted(
+        description['tests'].values(), key=lambda test: (test['priority'], test['name']))
+    return description
+
+
+def parse_test_module(source, module_name):
+    """
+    Return a dictionary mapping the names of the ``TestProcessPlugin`` subclasses
+    defined in the module source to their description
+    """
+    classes = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.ClassDef):
+            description = _parse_class(node, module_name, classes)
+            if description is not None:
+                classes[node.name] = description
+    return classes
+
+
+def get_manifest(test_dir, manifest_path=None):
+    """
+    Return the description of all test classes in ``test_dir``, using the cached manifest.
+
+    A module is parsed again only if its size or modification time changed and
+    its sha256 checksum differs from the cached one.
+
+    :return: a dictionary mapping ``module_name.ClassName`` to the class description
+    """
+    manifest_path = manifest_path or get_state_file(MANIFEST_FILENAME)
+    try:
+        with open(manifest_path) as handle:
+            manifest = json.load(handle)
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError("Outdated manifest")
+    except (IOError, OSError, ValueError):
+        manifest = {'version': MANIFEST_VERSION, 'files': {}}
+
+    changed = False
+    descriptions = {}
+    for module_name, path in get_test_modules(test_dir):
+        stat = os.stat(path)
+        entry = manifest['files'].get(path)
+        if (entry is None or entry['module'] != module_name or
+                entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size):
+            with open(path, 'rb') as handle:
+                source = handle.read()
+            checksum = hashlib.sha256(source).hexdigest()
+            if entry is None or entry['module'] != module_name or entry['sha256'] != checksum:
+                entry = {'module': module_name, 'sha256': checksum, 'classes': parse_test_module(source, module_name)}
+            entry.update({'mtime': stat.st_mtime, 'size': stat.st_size})
+            manifest['files'][path] = entry
+            changed = True
+        for class_name, description in entry['classes'].items():
+            descriptions['{}.{}'.format(module_name, class_name)] = description
+
+    if changed:
+        tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            handle.write(json.dumps(manifest, sort_keys=True))
+        os.rename(tmp_path, manifest_path)
+
+    return descriptions
+
+
+def _matches(name, pattern):
+    """Return True if the name is equal to the pattern or matches it"""
+    return name == pattern or fnmatch.fnmatchcase(name, pattern)
+
+
+def select_tests(descriptions, patterns):
+    """
+    Select the classes and tests matching any of the given shell-style patterns.
+
+    A pattern is matched against ``module_name.ClassName`` (selecting all tests of the
+    class) and against ``module_name.ClassName.test_name`` (selecting a single test).
+    A pattern equal to a name also matches it, even if it contains ``[...]`` (e.g. the
+    name of a case of a parametrized test).
+
+    :param descriptions: a dictionary as returned by :py:func:`get_manifest`
+    :return: a dictionary mapping the selected class names to the list of selected
+        test names, or to None if the whole class is selected
+    """
+    selection = {}
+    for class_key, description in descriptions.items():
+        if any(_matches(class_key, pattern) for pattern in patterns):
+            selection[class_key] = None
+            continue
+        test_names = [
+            test['name'] for test in description['tests']
+            if any(_matches('{}.{}'.format(class_key, test['name']), pattern) for pattern in patterns)
+        ]
+        if test_names:
+            selection[class_key] = test_names
+    return selection
+
+
+def print_class_description(description):
+    """
+    Print the description of a test class
+    """
+    if description['defines_custom_resources']:
+        print("  * Test will setup custom resources")
+
+    if description['code_names']:
+        print("  * Codes to setup:")
+        for code_name in description['code_names']:
+            print("    - {}".format(code_name))
+
+    if description['tests']:
+        print("  * Test methods:")
+        for test in description['tests']:
+            print("    - {} (priority {})".format(test['name'], test['priority']))
+            print("      Generating inputs for entrypoint '{}' via function '{}'".format(
+                test['entrypoint_name'], test['generate_function']
+                ))
+            if test.get('depends_on'):
+                print("      Depends on: {}".format(", ".join(test['depends_on'])))
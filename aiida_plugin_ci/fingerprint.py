@@ -0,0 +1,149 @@
+"""
+Fingerprints of the tests, to skip tests whose result cannot have changed
+
+The fingerprint of a test is a hash of:
+
+- the source code of the test class (and of its base classes)
+- the inputs returned by the generate function
+- the version of the python package providing the entry point under test
+- the checksums of the images of the codes of the class
+- the AiiDA version
+
+The result cache stores, for each test, the fingerprint of its last successful run.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import inspect
+import json
+import os
+import time
+
+from .state import get_state_file
+
+RESULT_CACHE_FILENAME = 'result-cache.json'
+
+
+def hash_inputs(inputs):
+    """
+    Return a JSON-serializable representation of (nested) process inputs, where
+    AiiDA nodes are replaced by their hash
+
+    :raise TypeError: if some input cannot be represented
+    """
+    if isinstance(inputs, dict):
+        return {str(key): hash_inputs(value) for key, value in inputs.items()}
+    if isinstance(inputs, (list, tuple)):
+        return [hash_inputs(value) for value in inputs]
+    if inputs is None or isinstance(inputs, (bool, int, float, str, type(u''))):
+        return inputs
+    try:
+        # AiiDA nodes: based on their attributes (and on the file repository content)
+        return {'node': inputs.get_hash()}
+    except AttributeError:
+        raise TypeError("Cannot fingerprint an input of type {}".format(type(inputs)))
+
+
+def get_class_source(test_class):
+    """
+    Return the source of a test class and of all its base classes (except ``TestProcessPlugin``)
+    """
+    from .base import TestProcessPlugin
+
+    sources = []
+    for cls in inspect.getmro(test_class):
+        if issubclass(cls, TestProcessPlugin) and cls is not TestProcessPlugin:
+            sources.append(inspect.getsource(cls))
+    return '\n'.join(sources)
+
+
+def get_entry_point_version(entrypoint_name):
+    """
+    Return the version of the distribution providing an entry point
+    (e.g. ``aiida.calculations:templatereplacer``), or None if it cannot be found
+    """
+    group, _, name = entrypoint_name.partition(':')
+    try:
+        import pkg_resources
+    except ImportError:
+        return None
+    for entry_point in pkg_resources.iter_entry_points(group, name):
+        if entry_point.dist is not None:
+            return '{}=={}'.format(entry_point.dist.project_name, entry_point.dist.version)
+    return None
+
+
+def get_aiida_version():
+    """Return the AiiDA version, or None if AiiDA cannot be imported"""
+    try:
+        import aiida
+    except ImportError:
+        return None
+    return aiida.__version__
+
+
+def get_test_fingerprint(test_class, inputs, entrypoint_name, image_checksums):
+    """
+    Return the fingerprint of a test (a sha256 hex digest), or None if it cannot be computed
+
+    :param test_class: the test class
+    :param inputs: the inputs generated for the test
+    :param entrypoint_name: the entry point of the process under test
+    :param image_checksums: a dictionary with the checksums of the images of the codes of the class
+    """
+    try:
+        data = {
+            'class_source': hashlib.sha256(get_class_source(test_class).encode('utf8')).hexdigest(),
+            'inputs': hash_inputs(inputs),
+            'entrypoint': entrypoint_name,
+            'entrypoint_version': get_entry_point_version(entrypoint_name),
+            'image_checksums': image_checksums,
+            'aiida_version': get_aiida_version(),
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+    except (IOError, OSError, TypeError):
+        return None
+
+
+class ResultCache(object):
+    """
+    Fingerprints of the last successful run of each test
+    """
+    def __init__(self, path=None):
+        self.path = path or get_state_file(RESULT_CACHE_FILENAME)
+        try:
+            with open(self.path) as handle:
+                self._data = json.load(handle)
+        except (IOError, OSError, ValueError):
+            self._data = {}
+
+    def get_class_fingerprints(self, class_name):
+        """
+        Return a dictionary mapping the names of the tests of a class to the
+        fingerprints of their last successful run
+        """
+        return {
+            test_name: entry['fingerprint'] for test_name, entry in self._data.get(class_name, {}).items()
+        }
+
+    def update(self, class_name, run_status):
+        """
+        Update the cache with the statuses of a run of a class.
+
+        Successful tests are recorded with their fingerprint; tests that ran
+        but did not succeed are removed (tests that did not run, i.e. ``CACHED``
+        or ``SKIPPED``, are left unchanged).
+        """
+        class_data = self._data.setdefault(class_name, {})
+        for test_name, test_status in run_status.items():
+            if test_status.get('status') == 'SUCCESS' and test_status.get('fingerprint'):
+                class_data[test_name] = {'fingerprint': test_status['fingerprint'], 'time': time.time()}
+            elif test_status.get('status') not in ('CACHED', 'SKIPPED'):
+                class_data.pop(test_name, None)
+
+    def save(self):
+        """Write the cache to disk"""
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            handle.write(json.dumps(self._data, sort_keys=True, indent=2))
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,229 @@
+"""
+Fixtures: resources needed by the tests (typically AiiDA nodes), built once per scope
+
+A fixture is a method of a test class decorated with ``@fixture``. It is accessed
+as an attribute, and evaluated the first time it is accessed::
+
+    class DoublerTest(TestProcessPlugin):
+
+        @fixture(scope='persistent')
+        def template(self):
+            from aiida.orm import Dict
+            return Dict(dict={'input_file_template': "{value}", ...})
+
+        def generate_inputs(self):
+            return {'template': self.template, ...}
+
+The scope defines for how long the value is reused:
+
+- ``class`` (default): for a run of the class
+- ``session``: for the whole run of the suite (in the current process), by all the
+  classes sharing the fixture (e.g. inheriting it from a common base class)
+- ``persistent``: across runs, for the current AiiDA profile
+
+For ``session`` and ``persistent`` fixtures, the unstored nodes of the value (a node,
+or a list, tuple or dictionary of nodes) are deduplicated by content: a node with the
+same hash already stored in the profile is used instead, otherwise the node is stored.
+The value of a ``persistent`` fixture is moreover recorded in the state directory, keyed
+by the profile and by the source code of the method, so that in later runs its nodes are
+loaded from the profile without calling the method at all: the method should thus only
+depend on its source code. Values that are not made only of nodes are not recorded,
+and behave as for the ``session`` scope.
+
+The seconds spent evaluating each fixture are stored in the ``fixtures`` key of the class
+timings of the class that evaluated it.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import inspect
+import json
+import os
+import threading
+
+from .state import get_state_file
+from .timing import timed
+
+FIXTURES_FILENAME = 'fixtures.json'
+FIXTURE_SCOPES = ('class', 'session', 'persistent')
+
+# Values of the session and persistent fixtures evaluated in this process
+_SESSION_VALUES = {}
+_SESSION_LOCK = threading.RLock()
+
+
+def fixture(function=None, scope='class'):
+    """
+    A decorator to define a fixture in a test class, either as ``@fixture`` or
+    as ``@fixture(scope=...)``
+
+    :param scope: one of ``FIXTURE_SCOPES``
+    """
+    if scope not in FIXTURE_SCOPES:
+        raise ValueError("Invalid fixture scope '{}', valid scopes: {}".format(scope, ", ".join(FIXTURE_SCOPES)))
+
+    def decorator_function(func):
+        return Fixture(func, scope)
+
+    if function is not None:
+        return decorator_function(function)
+    return decorator_function
+
+
+def map_nodes(value, function):
+    """
+    Return a copy of the value with ``function`` applied to each node, the value being a node,
+    or a list, tuple or dictionary (possibly nested) of nodes. Other values are returned unchanged.
+    """
+    from aiida.orm import Node
+
+    if isinstance(value, Node):
+        return function(value)
+    if isinstance(value, dict):
+        return {key: map_nodes(item, function) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(map_nodes(item, function) for item in value)
+    return value
+
+
+def _serialize_nodes(value):
+    """
+    Return a JSON-serializable representation of a value made only of nodes (see :py:func:`map_nodes`)
+
+    :raise ValueError: if the value contains something else than nodes
+    """
+    from aiida.orm import Node
+
+    if isinstance(value, Node):
+        return {'uuid': value.uuid}
+    if isinstance(value, dict):
+        return {'dict': {key: _serialize_nodes(item) for key, item in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'list': [_serialize_nodes(item) for item in value], 'tuple': isinstance(value, tuple)}
+    raise ValueError("Not a node: {!r}".format(value))
+
+
+def _deserialize_nodes(data):
+    """
+    Load the nodes of a value serialized by :py:func:`_serialize_nodes`
+
+    :raise aiida.common.exceptions.NotExistent: if a node is not in the profile
+    """
+    from aiida.orm import load_node
+
+    if 'uuid' in data:
+        return load_node(data['uuid'])
+    if 'dict' in data:
+        return {key: _deserialize_nodes(item) for key, item in data['dict'].items()}
+    items = [_deserialize_nodes(item) for item in data['list']]
+    return tuple(items) if data['tuple'] else items
+
+
+def deduplicate_node(node):
+    """
+    Return a stored node with the same content as the given one: the node itself if it is
+    already stored, else a node with the same hash found in the profile, else the node once stored
+    """
+    from aiida.orm import QueryBuilder
+
+    if node.is_stored:
+        return node
+    node_hash = node.get_hash()
+    if node_hash is not None:
+        query = QueryBuilder()
+        query.append(type(node), filters={'extras._aiida_hash': node_hash}, subclassing=False)
+        query.limit(1)
+        result = query.first()
+        if result is not None:
+            return result[0]
+    node.store()
+    return node
+
+
+class Fixture(object):
+    """
+    Descriptor returned by :py:func:`fixture`, evaluating and memoizing the value of a fixture
+    """
+    def __init__(self, function, scope):
+        self.function = function
+        self.scope = scope
+        self.name = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        with timed(instance.class_timings.setdefault('fixtures', {}), self.name):
+            value = self._get_value(instance)
+        # Cache it in the instance: being a non-data descriptor, the fixture is not called again
+        instance.__dict__[self.name] = value
+        return value
+
+    def _get_value(self, instance):
+        if self.scope == 'class':
+            return self.function(instance)
+
+        with _SESSION_LOCK:
+            if self in _SESSION_VALUES:
+                return _SESSION_VALUES[self]
+            persistent_key = self.get_persistent_key() if self.scope == 'persistent' else None
+            value = self._load_persistent(persistent_key)
+            if value is None:
+                value = map_nodes(self.function(instance), deduplicate_node)
+                self._save_persistent(persistent_key, value)
+            _SESSION_VALUES[self] = value
+            return value
+
+    def get_persistent_key(self):
+        """
+        Return the key of the fixture in the persistent record (specific to the profile and to
+        the source of the method), or None if the source is not available
+        """
+        from aiida.manage.configuration import get_profile
+
+        try:
+            source = inspect.getsource(self.function)
+        except (IOError, TypeError):
+            return None
+        return '{}:{}.{}:{}'.format(
+            get_profile().name, self.function.__module__, self.name,
+            hashlib.sha256(source.encode('utf8')).hexdigest())
+
+    @staticmethod
+    def _load_record():
+        try:
+            with open(get_state_file(FIXTURES_FILENAME)) as handle:
+                return json.load(handle)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _load_persistent(self, persistent_key):
+        """Return the recorded value of a persistent fixture, or None if not available"""
+        from aiida.common.exceptions import NotExistent
+
+        if persistent_key is None:
+            return None
+        data = self._load_record().get(persistent_key)
+        if data is None:
+            return None
+        try:
+            return _deserialize_nodes(data)
+        except NotExistent:
+            # E.g. the nodes were deleted from the profile
+            return None
+
+    def _save_persistent(self, persistent_key, value):
+        """Record the value of a persistent fixture, if it is made only of nodes"""
+        if persistent_key is None:
+            return
+        try:
+            data = _serialize_nodes(value)
+        except ValueError:
+            return
+        record = self._load_record()
+        record[persistent_key] = data
+        path = get_state_file(FIXTURES_FILENAME)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            handle.write(json.dumps(record, sort_keys=True, indent=2))
+        os.rename(tmp_path, path)
@@ -0,0 +1,109 @@
+"""
+History of the durations of previous runs, used to schedule work
+"""
+from __future__ import absolute_import
+
+import json
+import os
+
+from .state import get_state_file
+
+HISTORY_FILENAME = 'durations.json'
+# Weight of the latest duration in the exponential moving average
+SMOOTHING = 0.5
+# Expected duration (in seconds) of a class that never ran, if nothing else ran either
+DEFAULT_CLASS_DURATION = 60.
+# Expected duration (in seconds) of a test that never ran, if no other test ran either
+DEFAULT_TEST_DURATION = 10.
+
+
+def _update_average(durations, key, duration):
+    """Update the moving average ``durations[key]`` with a new duration"""
+    previous = durations.get(key)
+    if previous is None:
+        durations[key] = duration
+    else:
+        durations[key] = SMOOTHING * duration + (1. - SMOOTHING) * previous
+
+
+def _mean(values):
+    values = list(values)
+    return sum(values) / len(values) if values else None
+
+
+def get_run_duration(test_status):
+    """
+    Return the seconds spent running a test (the sum of its timings), or None if its
+    process was not run (e.g. ``CACHED`` or ``SKIPPED``), in which case it is not
+    representative of its duration
+    """
+    timings = test_status.get('timings', {})
+    if 'run_get_node' not in timings and 'engine' not in timings:
+        return None
+    return sum(timings.values())
+
+
+class DurationHistory(object):
+    """
+    Expected durations of test classes and of their tests, as an exponential
+    moving average of the durations measured in previous runs
+    """
+    def __init__(self, path=None):
+        self.path = path or get_state_file(HISTORY_FILENAME)
+        try:
+            with open(self.path) as handle:
+                self._data = json.load(handle)
+        except (IOError, OSError, ValueError):
+            self._data = {}
+        self._data.setdefault('classes', {})
+        self._data.setdefault('tests', {})
+
+    def get_class_duration(self, class_name, default=None):
+        """
+        Return the expected duration of a class.
+
+        If the class never ran, return ``default`` or, if it is None, the mean
+        expected duration of all known classes (``DEFAULT_CLASS_DURATION`` if none is known).
+        """
+        if class_name in self._data['classes']:
+            return self._data['classes'][class_name]
+        if default is not None:
+            return default
+        known = list(self._data['classes'].values())
+        return sum(known) / len(known) if known else DEFAULT_CLASS_DURATION
+
+    def record_class_duration(self, class_name, duration):
+        """Update the expected duration of a class with the duration of a new run"""
+        _update_average(self._data['classes'], class_name, duration)
+
+    def get_test_duration(self, class_name, test_name):
+        """
+        Return the expected duration of a test of a class.
+
+        If the test never ran, return the mean expected duration of the known cases of the
+        same parametrized test (``test_name[...]``), else of the known tests of the class,
+        else of all known tests (``DEFAULT_TEST_DURATION`` if none is known).
+        """
+        class_tests = self._data['tests'].get(class_name, {})
+        if test_name in class_tests:
+            return class_tests[test_name]
+        case_prefix = '{}['.format(test_name.partition('[')[0])
+        for candidates in (
+                [duration for name, duration in class_tests.items() if name.startswith(case_prefix)],
+                class_tests.values(),
+                [duration for tests in self._data['tests'].values() for duration in tests.values()]):
+            mean = _mean(candidates)
+            if mean is not None:
+                return mean
+        return DEFAULT_TEST_DURATION
+
+    def record_test_duration(self, class_name, test_name, duration):
+        """Update the expected duration of a test of a class with the duration of a new run"""
+        _update_average(self._data['tests'].setdefault(class_name, {}), test_name, duration)
+
+    def save(self):
+        """Write the history to disk"""
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as handle:
+            handle.write(json.dumps(self._data, sort_keys=True, indent=2))
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,50 @@
+"""
+Expansion of parametrized tests into cases
+
+A test decorated with ``@process_test(..., parameters=...)`` is expanded into one
+test per case, named ``test_name[<id>]``. The parameters are either a list of
+dictionaries (one per case), or a dictionary mapping each parameter name to the
+list of its values (the cases being all their combinations). The id of a case is
+``name1=value1,name2=value2`` (sorted by name) if all values are numbers, strings,
+booleans or None, and the index of the case otherwise, unless an ``ids`` callable
+(taking the dictionary of a case and returning its id) is given.
+
+This module does not depend on AiiDA, so that it can also be used for the static
+discovery of the tests.
+"""
+from __future__ import absolute_import
+
+import itertools
+
+try:
+    _SCALAR_TYPES = (int, float, bool, type(None), str, unicode, long)  # pylint: disable=undefined-variable
+except NameError:  # Python 3
+    _SCALAR_TYPES = (int, float, bool, type(None), str)
+
+
+def expand_parameters(parameters):
+    """
+    Return the list of cases (dictionaries mapping parameter names to values) of a test
+
+    :param parameters: a dictionary of lists of values, or an iterable of dictionaries
+    """
+    if isinstance(parameters, dict):
+        names = sorted(parameters)
+        return [dict(zip(names, values)) for values in itertools.product(*(parameters[name] for name in names))]
+    return [dict(case) for case in parameters]
+
+
+def get_case_names(test_name, cases, ids=None):
+    """
+    Return the names of the tests of the cases of a parametrized test (see the module docstring)
+    """
+    if ids is not None:
+        suffixes = [str(ids(case)) for case in cases]
+    elif all(isinstance(value, _SCALAR_TYPES) for case in cases for value in case.values()):
+        suffixes = [",".join("{}={}".format(name, case[name]) for name in sorted(case)) for case in cases]
+    else:
+        suffixes = [str(index) for index in range(len(cases))]
+    if len(set(suffixes)) != len(suffixes):
+        # Ambiguous ids (e.g. the same case twice): fall back to the indices
+        suffixes = [str(index) for index in range(len(cases))]
+    return ["{}[{}]".format(test_name, suffix) for suffix in suffixes]
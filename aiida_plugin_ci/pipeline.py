@@ -0,0 +1,124 @@
+"""
+Pipelined runs: each test class is run as soon as its own codes are built, while the
+codes of the following classes are still being built
+
+The builds run on an asyncio event loop in a background thread, each (blocking) build
+in a thread of a bounded executor: :py:func:`build_code_async` is the asyncio interface
+to the code builders, streaming their progress to the event loop. The test classes are
+run by the caller, in the main thread as required by AiiDA, in the given order, except
+that a class whose codes are not built yet is overtaken by the following classes whose
+codes are.
+
+This module requires Python 3, and is only imported when pipelining.
+"""
+import asyncio
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import build_code, get_builder_spec_key
+from .planning import DEFAULT_BUILD_WORKERS, plan_builds
+
+
+async def build_code_async(code_declaration, progress=None, executor=None):
+    """
+    Build a code (see :py:func:`aiida_plugin_ci.base.build_code`) without blocking the event loop
+
+    :param progress: optional callable, called in the event loop with each progress message of the builder
+    :param executor: the executor running the blocking build (by default, the one of the event loop)
+    :return: the ``(code_builder, status)`` tuple returned by :py:func:`aiida_plugin_ci.base.build_code`
+    """
+    loop = asyncio.get_event_loop()
+    if progress is not None:
+        def thread_progress(message):
+            loop.call_soon_threadsafe(progress, message)
+    else:
+        thread_progress = None
+    return await loop.run_in_executor(executor, functools.partial(build_code, code_declaration, thread_progress))
+
+
+async def build_all_async(plan, max_workers=DEFAULT_BUILD_WORKERS, report=None, progress=None, on_built=None):
+    """
+    Build all codes of a plan concurrently, like :py:func:`aiida_plugin_ci.planning.build_all`
+
+    :param progress: optional callable, called in the event loop with the spec key of a code
+        and each progress message of its builder
+    :param on_built: optional callable, called in the event loop with the spec key of each code
+        and the ``(code_builder, status)`` tuple as soon as its build finishes
+    :return: as :py:func:`aiida_plugin_ci.planning.build_all`
+    """
+    results = {}
+    if not plan:
+        return results
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(plan))))
+
+    async def build_one(spec_key, code_declaration):
+        code_progress = functools.partial(progress, spec_key) if progress is not None else None
+        results[spec_key] = await build_code_async(code_declaration, code_progress, executor)
+        if report is not None:
+            report({'type': 'code_build', 'spec_key': spec_key, 'status': results[spec_key][1]})
+        if on_built is not None:
+            on_built(spec_key, results[spec_key])
+
+    try:
+        await asyncio.gather(*[build_one(spec_key, code_declaration) for spec_key, code_declaration in plan.items()])
+    finally:
+        executor.shutdown(wait=False)
+    return results
+
+
+def iter_ready_classes(test_classes, max_workers=DEFAULT_BUILD_WORKERS, report=None, progress=None):
+    """
+    Build the codes of the test classes in a background thread, and yield each class as soon
+    as all its codes are built (see the module docstring)
+
+    :param test_classes: a dictionary of test classes, as returned by
+        :py:func:`aiida_plugin_ci.utils.get_test_classes`
+    :param report: passed to :py:func:`build_all_async`, called in the background thread
+    :param progress: passed to :py:func:`build_all_async`, called in the background thread
+    :return: a generator of ``(class_name, prebuilt_codes)`` tuples, ``prebuilt_codes`` containing
+        (at least) the codes of the class, as the ``prebuilt_codes`` of
+        :py:meth:`aiida_plugin_ci.TestProcessPlugin.run`
+    """
+    built = queue.Queue()
+
+    def run_builds():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(build_all_async(
+                plan_builds(test_classes), max_workers, report, progress,
+                on_built=lambda spec_key, result: built.put((spec_key, result))))
+        except BaseException as exc:  # pylint: disable=broad-except
+            # Raised in the main thread
+            built.put((None, exc))
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=run_builds, name='code-builds')
+    # Do not keep the interpreter alive if the run is interrupted
+    thread.daemon = True
+    thread.start()
+
+    prebuilt_codes = {}
+    pending = [
+        (class_name, {get_builder_spec_key(declaration) for declaration in (test_class.code_resources or {}).values()})
+        for class_name, test_class in test_classes.items()
+    ]
+
+    def add_result(spec_key, result):
+        if spec_key is None:
+            raise result
+        prebuilt_codes[spec_key] = result
+
+    while pending:
+        while not built.empty():
+            add_result(*built.get())
+        ready = [item for item in pending if item[1].issubset(prebuilt_codes)]
+        if not ready:
+            add_result(*built.get())
+            continue
+        pending.remove(ready[0])
+        yield ready[0][0], dict(prebuilt_codes)
+    thread.join()
@@ -0,0 +1,56 @@
+"""
+Build planning: collect the codes declared by all test classes, deduplicate
+them and build them concurrently before running any test
+"""
+from __future__ import print_function, absolute_import
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .base import build_code, get_builder_spec_key
+
+# Default number of codes built at the same time
+DEFAULT_BUILD_WORKERS = 4
+
+
+def plan_builds(test_classes):
+    """
+    Collect all ``code_resources`` declarations of the given test classes.
+
+    :param test_classes: a dictionary of test classes, as returned by
+        :py:func:`aiida_plugin_ci.utils.get_test_classes`
+    :return: a dictionary mapping each distinct builder spec key to one of the
+        code declarations using it
+    """
+    plan = {}
+    for test_class in test_classes.values():
+        for code_declaration in (test_class.code_resources or {}).values():
+            plan.setdefault(get_builder_spec_key(code_declaration), code_declaration)
+    return plan
+
+
+def build_all(plan, max_workers=DEFAULT_BUILD_WORKERS, report=None):
+    """
+    Build all codes of a plan concurrently on a bounded pool of threads.
+
+    :param plan: a dictionary as returned by :py:func:`plan_builds`
+    :param max_workers: the maximum number of codes built at the same time
+    :param report: optional callable, called with a ``code_build`` record (see
+        :py:mod:`aiida_plugin_ci.reporting`) as soon as each build finishes
+    :return: a dictionary mapping each builder spec key to the ``(code_builder, status)``
+        tuple returned by :py:func:`aiida_plugin_ci.base.build_code`, that can be passed
+        as ``prebuilt_codes`` to :py:meth:`aiida_plugin_ci.TestProcessPlugin.run`
+    """
+    if not plan:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(plan)))) as executor:
+        futures = {
+            executor.submit(build_code, code_declaration): spec_key
+            for spec_key, code_declaration in plan.items()
+        }
+        results = {}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if report is not None:
+                report({'type': 'code_build', 'spec_key': futures[future], 'status': future.result()[1]})
+        return results
@@ -0,0 +1,127 @@
+"""
+Streaming report of a test run, as JSON lines
+
+Each line is a JSON object (a *record*) with a ``type`` key and a ``time`` stamp.
+The record types are:
+
+- ``code_build``: a distinct code was built (keys: ``spec_key``, ``status``)
+- ``code_setup``: a code of a class was set up (keys: ``class``, ``code``, ``status``)
+- ``test``: a test finished (keys: ``class``, ``test``, ``status``)
+- ``class``: all tests of a class finished (keys: ``class``, ``timings``, and ``resources`` if
+  the resources of the jobs were sampled)
+- ``suite_end``: the whole run finished
+
+Records are written and flushed as soon as they are available, so that a
+report is usable even if the run is interrupted, and can be followed live.
+"""
+from __future__ import print_function, absolute_import
+
+import json
+import threading
+import time
+
+from .timing import summarize_timings
+
+# Key of the report containing the timings of the classes and the summary
+TIMINGS_KEY = '_timings'
+
+
+class JsonLinesReporter(object):
+    """
+    Write records to a stream (e.g. ``sys.stdout`` or an open file), one JSON object per line
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        """
+        Write a record (a dictionary with at least the ``type`` key) and flush the stream
+        """
+        record = dict(record)
+        record.setdefault('time', time.time())
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            self._stream.write(line + '\n')
+            self._stream.flush()
+
+
+def read_records(stream, follow=False, poll_interval=0.5):
+    """
+    Yield the records from a stream of JSON lines.
+
+    Lines that are not JSON objects (e.g. progress messages printed on the
+    same standard output) are skipped.
+
+    :param stream: an open file
+    :param follow: if True, keep waiting for new lines (like ``tail -f``) until
+        a ``suite_end`` record is read
+    :param poll_interval: when following, seconds to wait before checking for new lines
+    """
+    buffer = ''
+    while True:
+        line = stream.readline()
+        if not line:
+            if not follow:
+                break
+            time.sleep(poll_interval)
+            continue
+        buffer += line
+        if not buffer.endswith('\n'):
+            # Partial line: wait for the writer to complete it
+            continue
+        line, buffer = buffer, ''
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or 'type' not in record:
+            continue
+        yield record
+        if record['type'] == 'suite_end':
+            break
+
+
+def aggregate_records(records):
+    """
+    Rebuild the nested report printed by :py:func:`aiida_plugin_ci.utils.autorun` from the records
+
+    :return: a dictionary mapping class names to dictionaries of test statuses, plus the
+        ``TIMINGS_KEY`` key with the class timings and their summary (and the resources used by
+        the jobs of each class, if sampled)
+    """
+    full_status = {}
+    class_timings = {}
+    class_resources = {}
+    for record in records:
+        if record['type'] == 'test':
+            full_status.setdefault(record['class'], {})[record['test']] = record['status']
+        elif record['type'] == 'class':
+            full_status.setdefault(record['class'], {})
+            class_timings[record['class']] = record['timings']
+            if 'resources' in record:
+                class_resources[record['class']] = record['resources']
+
+    summary = summarize_timings(full_status, class_timings)
+    full_status[TIMINGS_KEY] = {'classes': class_timings, 'summary': summary}
+    if class_resources:
+        full_status[TIMINGS_KEY]['resources'] = class_resources
+    return full_status
+
+
+def print_record(record):
+    """
+    Print a human-readable line for a record
+    """
+    if record['type'] == 'code_build':
+        print("code build {}: {}".format(record["spec_key"], record["status"].get("status", "SUCCESS")))
+    elif record['type'] == 'code_setup':
+        print("{} code '{}': {}".format(
+            record['class'], record['code'], record['status'].get('status', 'UNKNOWN')))
+    elif record['type'] == 'test':
+        print("{}.{}: {}".format(
+            record['class'], record['test'], record['status'].get('status', 'UNKNOWN')))
+    elif record['type'] == 'class':
+        print("{}: done in {:.3f}s".format(record['class'], record['timings'].get('total', 0.)))
+    elif record['type'] == 'suite_end':
+        print("suite finished")
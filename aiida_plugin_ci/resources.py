@@ -0,0 +1,249 @@
+"""
+Accounting of the resources (CPU time, memory, I/O) used by the jobs of the tests
+
+The jobs of the ``direct`` scheduler are detached from the process running the tests,
+so their usage cannot be collected with ``wait4``: instead, a :py:class:`ResourceMonitor`
+thread samples ``/proc`` for the process tree of each local job every ``interval`` seconds.
+The jobs are looked up in the database (see :py:func:`aiida_plugin_ci.timeouts.get_local_job_pids`)
+by :py:meth:`ResourceMonitor.update_job_pids`, that must be called periodically by the thread
+using AiiDA (e.g. from the event loop of the runner), since the ORM is not thread-safe: the
+sampling thread only reads ``/proc``.
+The usage of a test is a dictionary with:
+
+- ``cpu_user`` and ``cpu_system``: the CPU seconds of the job processes (including
+  their children, once waited for)
+- ``peak_rss``: the peak resident memory in bytes, over all the job processes at once
+  (at the sampling times) or of a single process (as recorded by the kernel)
+- ``read_bytes`` and ``write_bytes``: the bytes read from and written to storage
+- ``read_chars`` and ``write_chars``: the bytes passed to read and write system calls
+  (including e.g. pipes, and reads served from the page cache)
+
+Being sampled, the values are lower bounds: whatever happens after the last sample of
+a process is lost (at most ``interval`` seconds), except for the CPU time of children,
+that is added to their parent when they are waited for. Jobs of other schedulers or
+transports, and platforms without ``/proc``, give an empty usage.
+"""
+from __future__ import absolute_import
+
+import os
+import threading
+
+from .timeouts import get_descendant_pids, get_local_job_pids, get_process_children
+
+# Seconds between two samples
+DEFAULT_SAMPLING_INTERVAL = 0.5
+
+IO_KEYS = ('read_bytes', 'write_bytes', 'read_chars', 'write_chars')
+# Keys of the usage summed over the tests in the summary of a class (``peak_rss`` is the maximum)
+SUMMED_KEYS = ('cpu_user', 'cpu_system') + IO_KEYS
+
+try:
+    _CLOCK_TICKS = float(os.sysconf('SC_CLK_TCK'))
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # Not a POSIX platform
+    _CLOCK_TICKS = 100.
+    _PAGE_SIZE = 4096
+
+
+def _read_proc_file(pid, name):
+    with open(os.path.join('/proc', str(pid), name)) as handle:
+        return handle.read()
+
+
+def read_process_usage(pid):
+    """
+    Return the current usage of a process read from ``/proc``, or None if it is not available
+    (e.g. the process terminated)
+
+    :return: a dictionary with the ``cpu_user`` and ``cpu_system`` seconds (including the
+        children waited for), the current ``rss`` and the ``peak_rss`` in bytes, the
+        ``start_time`` (in clock ticks after the boot, to detect reused PIDs) and the I/O
+        counters (``read_bytes``, ``write_bytes``, ``read_chars`` and ``write_chars``, missing
+        if not readable)
+    """
+    try:
+        stat = _read_proc_file(pid, 'stat')
+        status = _read_proc_file(pid, 'status')
+    except (IOError, OSError):
+        return None
+    # The command name (2nd field) is in parentheses and may contain spaces
+    fields = stat.rpartition(')')[2].split()
+    usage = {
+        'cpu_user': (int(fields[11]) + int(fields[13])) / _CLOCK_TICKS,
+        'cpu_system': (int(fields[12]) + int(fields[14])) / _CLOCK_TICKS,
+        'rss': int(fields[21]) * _PAGE_SIZE,
+        'start_time': int(fields[19]),
+        'peak_rss': 0,
+    }
+    for line in status.splitlines():
+        if line.startswith('VmHWM:'):
+            usage['peak_rss'] = int(line.split()[1]) * 1024
+
+    io_keys = {'rchar': 'read_chars', 'wchar': 'write_chars', 'read_bytes': 'read_bytes', 'write_bytes': 'write_bytes'}
+    try:
+        io_counters = _read_proc_file(pid, 'io')
+    except (IOError, OSError):
+        # Not readable, e.g. without the permission to trace the process
+        return usage
+    for line in io_counters.splitlines():
+        key, _, value = line.partition(':')
+        if key in io_keys:
+            usage[io_keys[key]] = int(value)
+    return usage
+
+
+class _TrackedProcess(object):
+    """Usage of a process node being monitored, accumulated over the samples"""
+
+    def __init__(self, process_node):
+        self.process_node = process_node
+        self.job_pids = set()
+        # Start time of each process of the trees, to ignore its PID once reused by another process
+        self.start_times = {}
+        self.cpu = {'cpu_user': 0., 'cpu_system': 0.}
+        self.peak_rss = 0
+        # Last I/O counters of each process of the trees, that do not include those of its children
+        self.io_counters = {}
+
+    def sample(self, children):
+        """Update the usage with the current state of the process trees of the jobs"""
+        cpu = {'cpu_user': 0., 'cpu_system': 0.}
+        total_rss = 0
+        for job_pid in self.job_pids:
+            for pid in [job_pid] + get_descendant_pids(job_pid, children):
+                usage = read_process_usage(pid)
+                if usage is None:
+                    continue
+                if self.start_times.setdefault(pid, usage['start_time']) != usage['start_time']:
+                    if pid == job_pid:
+                        break  # The job terminated, and its PID was reused: skip the whole tree
+                    continue
+                # The CPU time of the processes already waited for is in the one of their parent
+                for key in cpu:
+                    cpu[key] += usage[key]
+                total_rss += usage['rss']
+                self.peak_rss = max(self.peak_rss, usage['peak_rss'])
+                self.io_counters[pid] = {key: value for key, value in usage.items() if key in IO_KEYS}
+        for key, value in cpu.items():
+            self.cpu[key] = max(self.cpu[key], value)
+        self.peak_rss = max(self.peak_rss, total_rss)
+
+    def get_usage(self):
+        """Return the usage accumulated so far (see the module docstring), or None if no job was found"""
+        if not self.job_pids:
+            return None
+        usage = dict(self.cpu, peak_rss=self.peak_rss)
+        for counters in self.io_counters.values():
+            for key, value in counters.items():
+                usage[key] = usage.get(key, 0) + value
+        return usage
+
+
+class ResourceMonitor(object):
+    """
+    A thread sampling the resources used by the local jobs of a set of process nodes
+
+    Usage::
+
+        with ResourceMonitor() as monitor:
+            monitor.add('test_name', process_node)
+            ...  # wait for the process to terminate, calling monitor.update_job_pids() periodically
+            usage = monitor.remove('test_name')
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Start the sampling thread"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name='resource-monitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sampling thread, and wait for it to terminate"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def add(self, key, process_node):
+        """Start monitoring the jobs of a process node (and of the processes it calls)"""
+        with self._lock:
+            self._tracked[key] = _TrackedProcess(process_node)
+
+    def update_job_pids(self, keys=None):
+        """
+        Look up the local jobs of the monitored process nodes, to be sampled by the thread.
+
+        This queries the database, so it must be called from the thread using AiiDA.
+
+        :param keys: optional list of the keys of the nodes to update (by default, all of them)
+        """
+        with self._lock:
+            tracked_processes = [
+                tracked for key, tracked in self._tracked.items() if keys is None or key in keys]
+        for tracked in tracked_processes:
+            try:
+                job_pids = get_local_job_pids(tracked.process_node)
+            except Exception:  # pylint: disable=broad-except
+                # E.g. a transient database error: the jobs already found are still sampled
+                continue
+            with self._lock:
+                tracked.job_pids.update(job_pids)
+
+    def remove(self, key):
+        """
+        Stop monitoring a process node, after a last lookup of its jobs and a last sample
+        (it must be called from the thread using AiiDA, see :py:meth:`update_job_pids`)
+
+        :return: the usage of its jobs (see the module docstring), or None if the key is not
+            monitored or no local job was found
+        """
+        self.update_job_pids([key])
+        with self._lock:
+            tracked = self._tracked.pop(key, None)
+            if tracked is None:
+                return None
+            tracked.sample(get_process_children())
+        return tracked.get_usage()
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                if not self._tracked:
+                    continue
+                children = get_process_children()
+                for tracked in self._tracked.values():
+                    tracked.sample(children)
+
+
+def summarize_resources(run_status):
+    """
+    Return the usage of the jobs of a class summed over its tests (``peak_rss`` being the
+    maximum), or None if no test has a usage
+
+    :param run_status: a dictionary mapping test names to statuses, with the usage of
+        each test (if available) under the ``resources`` key
+    """
+    usages = [test_status['resources'] for test_status in run_status.values() if test_status.get('resources')]
+    if not usages:
+        return None
+    summary = {'peak_rss': max(usage.get('peak_rss', 0) for usage in usages), 'num_tests': len(usages)}
+    for key in SUMMED_KEYS:
+        values = [usage[key] for usage in usages if key in usage]
+        if values:
+            summary[key] = sum(values)
+    return summary
@@ -0,0 +1,274 @@
+"""
+Local store of the results of all runs, in an SQLite database, and queries on it
+
+Each run records its start and end time, each class its timings, and each test its
+status, exception class, duration (the sum of its timings, if its process ran), timings
+and fingerprint. Tests are indexed by name, status and time, and their durations are also
+summed per day, so that the queries below only read the rows they need:
+
+- :py:meth:`ResultsStore.get_flaky_tests`: tests whose outcome changed between runs
+- :py:meth:`ResultsStore.get_duration_trends`: tests whose duration changed the most
+- :py:meth:`ResultsStore.get_last_success`: the last run in which a test succeeded
+
+The database is in the state directory by default, and can be shared by several
+processes (SQLite serializes the writes).
+"""
+from __future__ import absolute_import, division
+
+import json
+import socket
+import sqlite3
+import time
+
+from .history import get_run_duration
+from .state import get_state_file
+
+RESULTS_FILENAME = 'results.sqlite'
+# Version of the schema, stored as the ``user_version`` of the database
+SCHEMA_VERSION = 1
+# Statuses of tests that did not run, ignored when looking for flaky tests
+NOT_RUN_STATUSES = ('CACHED', 'SKIPPED')
+# Seconds to wait for a lock held by another process
+LOCK_TIMEOUT = 30.
+SECONDS_PER_DAY = 86400.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL,
+    hostname TEXT
+);
+CREATE TABLE IF NOT EXISTS classes (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    class_name TEXT NOT NULL,
+    total REAL,
+    timings TEXT,
+    PRIMARY KEY (run_id, class_name)
+);
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    class_name TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    status TEXT,
+    exception_class TEXT,
+    duration REAL,
+    timings TEXT,
+    fingerprint TEXT,
+    time REAL NOT NULL
+);
+-- Number of runs and total duration of each test per day (since the epoch, in UTC), so that
+-- trends over months are computed without reading all the tests
+CREATE TABLE IF NOT EXISTS daily_durations (
+    class_name TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    runs INTEGER NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (class_name, test_name, day)
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS tests_name_time ON tests (class_name, test_name, time);
+CREATE INDEX IF NOT EXISTS tests_status_time ON tests (status, time);
+CREATE INDEX IF NOT EXISTS tests_time ON tests (time);
+"""
+
+
+def split_test_name(full_name):
+    """
+    Split a ``module.ClassName.test_name`` name into the class name and the test name
+    (test names may contain dots, e.g. in the parameters of a case)
+    """
+    parts = full_name.split('.', 2)
+    if len(parts) != 3:
+        raise ValueError("Expected a name like 'module.ClassName.test_name', got '{}'".format(full_name))
+    return '.'.join(parts[:2]), parts[2]
+
+
+class ResultsStore(object):
+    """
+    The SQLite database with the results of the runs (see the module docstring)
+    """
+    def __init__(self, path=None):
+        self.path = path or get_state_file(RESULTS_FILENAME)
+        self._connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+            self._connection.execute('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION))
+
+    def close(self):
+        """Close the database"""
+        self._connection.close()
+
+    def start_run(self):
+        """Record the start of a run, and return its id"""
+        with self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO runs (started, hostname) VALUES (?, ?)', (time.time(), socket.gethostname()))
+        return cursor.lastrowid
+
+    def record_class(self, run_id, class_name, run_status):
+        """
+        Record the statuses of the tests of a class
+
+        :param run_status: a dictionary mapping test names to statuses, as returned by
+            :py:meth:`aiida_plugin_ci.TestProcessPlugin.run`
+        """
+        now = time.time()
+        rows = [
+            (run_id, class_name, test_name, test_status.get('status'), test_status.get('exception_class'),
+             get_run_duration(test_status), json.dumps(test_status.get('timings', {}), sort_keys=True),
+             test_status.get('fingerprint'), now)
+            for test_name, test_status in run_status.items()
+        ]
+        day = int(now // SECONDS_PER_DAY)
+        durations = [(row[5], class_name, row[2], day) for row in rows if row[5] is not None]
+        with self._connection:
+            self._connection.executemany(
+                'INSERT INTO tests (run_id, class_name, test_name, status, exception_class, duration, timings, '
+                'fingerprint, time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO daily_durations (class_name, test_name, day, runs, total) VALUES (?, ?, ?, 0, 0.)',
+                [duration[1:] for duration in durations])
+            self._connection.executemany(
+                'UPDATE daily_durations SET runs = runs + 1, total = total + ? '
+                'WHERE class_name = ? AND test_name = ? AND day = ?', durations)
+
+    def finish_run(self, run_id, class_timings):
+        """
+        Record the end of a run, and the timings of its classes
+
+        :param class_timings: a dictionary mapping class names to their class-level timings
+        """
+        with self._connection:
+            self._connection.execute('UPDATE runs SET finished = ? WHERE id = ?', (time.time(), run_id))
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO classes (run_id, class_name, total, timings) VALUES (?, ?, ?, ?)',
+                [(run_id, class_name, timings.get('total'), json.dumps(timings, sort_keys=True))
+                 for class_name, timings in class_timings.items()])
+
+    def get_last_success(self, class_name, test_name):
+        """
+        Return the last successful run of a test, as a dictionary with the ``run_id``, the
+        ``time``, the ``duration`` and the ``fingerprint``, or None if it never succeeded
+        """
+        row = self._connection.execute(
+            'SELECT run_id, time, duration, fingerprint FROM tests '
+            'WHERE class_name = ? AND test_name = ? AND status = ? ORDER BY time DESC LIMIT 1',
+            (class_name, test_name, 'SUCCESS')).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_flaky_tests(self, num_runs=100):
+        """
+        Return the tests whose status changed between runs, among the last ``num_runs`` runs.
+
+        Tests that did not run (``NOT_RUN_STATUSES``) are ignored.
+
+        :return: a list of dictionaries with the ``class_name`` and ``test_name``, the number of
+            ``runs`` of the test, the number of ``flips`` of its status between consecutive runs,
+            the ``failure_rate`` (the fraction of runs that did not succeed), the ``statuses`` seen
+            and whether the same fingerprint both succeeded and failed (``same_fingerprint``),
+            sorted by decreasing number of flips
+        """
+        start = self._connection.execute(
+            'SELECT MIN(started) FROM (SELECT started FROM runs ORDER BY started DESC LIMIT ?)',
+            (num_runs,)).fetchone()[0]
+        if start is None:
+            return []
+        # Tests are recorded after the start of their run: only read the recent ones, by time
+        rows = self._connection.execute(
+            'SELECT class_name, test_name, status, fingerprint FROM tests INDEXED BY tests_time '
+            'WHERE time >= ? AND status NOT IN ({}) ORDER BY class_name, test_name, time'.format(
+                ', '.join('?' * len(NOT_RUN_STATUSES))),
+            (start,) + NOT_RUN_STATUSES)
+
+        flaky = []
+        current = None
+        for row in rows:
+            key = (row['class_name'], row['test_name'])
+            if current is None or current['key'] != key:
+                if current is not None and current['flips']:
+                    flaky.append(current)
+                current = {'key': key, 'runs': 0, 'flips': 0, 'failures': 0, 'statuses': set(), 'outcomes': {}}
+            succeeded = row['status'] == 'SUCCESS'
+            if current['runs'] and succeeded != current['succeeded']:
+                current['flips'] += 1
+            current['runs'] += 1
+            current['failures'] += 0 if succeeded else 1
+            current['succeeded'] = succeeded
+            current['statuses'].add(row['status'])
+            if row['fingerprint'] is not None:
+                current['outcomes'].setdefault(row['fingerprint'], set()).add(succeeded)
+        if current is not None and current['flips']:
+            flaky.append(current)
+
+        return sorted([{
+            'class_name': test['key'][0],
+            'test_name': test['key'][1],
+            'runs': test['runs'],
+            'flips': test['flips'],
+            'failure_rate': test['failures'] / test['runs'],
+            'statuses': sorted(test['statuses']),
+            'same_fingerprint': any(len(outcomes) == 2 for outcomes in test['outcomes'].values()),
+        } for test in flaky], key=lambda test: (-test['flips'], test['class_name'], test['test_name']))
+
+    def get_duration_trends(self, days=30, min_change=0.):
+        """
+        Compare the mean duration of each test over the last ``days`` days to its mean duration
+        over the ``days`` days before (days are counted in UTC, including the current one)
+
+        :param min_change: only return the tests whose duration changed by more than this
+            fraction (in absolute value)
+        :return: a list of dictionaries with the ``class_name`` and ``test_name``, the ``recent``
+            and ``previous`` mean durations, their number of runs (``recent_runs`` and
+            ``previous_runs``) and the relative ``change``, sorted by decreasing change
+        """
+        split = int(time.time() // SECONDS_PER_DAY) + 1 - int(days)
+        rows = self._connection.execute(
+            'SELECT class_name, test_name, '
+            'SUM(CASE WHEN day >= :split THEN total END) / SUM(CASE WHEN day >= :split THEN runs END) AS recent, '
+            'SUM(CASE WHEN day >= :split THEN runs ELSE 0 END) AS recent_runs, '
+            'SUM(CASE WHEN day < :split THEN total END) / SUM(CASE WHEN day < :split THEN runs END) AS previous, '
+            'SUM(CASE WHEN day < :split THEN runs ELSE 0 END) AS previous_runs '
+            'FROM daily_durations WHERE day >= :start GROUP BY class_name, test_name',
+            {'split': split, 'start': split - int(days)})
+
+        trends = []
+        for row in rows:
+            if not row['recent_runs'] or not row['previous_runs'] or not row['previous']:
+                continue
+            trend = dict(row)
+            trend['change'] = row['recent'] / row['previous'] - 1.
+            if abs(trend['change']) > min_change:
+                trends.append(trend)
+        return sorted(trends, key=lambda trend: (-trend['change'], trend['class_name'], trend['test_name']))
+
+
+def print_flaky_tests(flaky_tests):
+    """Print the result of :py:meth:`ResultsStore.get_flaky_tests`"""
+    print("**** Flaky tests ****")
+    for test in flaky_tests:
+        print("  {:3d} flips in {:3d} runs ({:5.1f}% failed{})  {}.{}  [{}]".format(
+            test['flips'], test['runs'], 100. * test['failure_rate'],
+            ", also with the same fingerprint" if test['same_fingerprint'] else "",
+            test['class_name'], test['test_name'], ", ".join(test['statuses'])))
+
+
+def print_duration_trends(trends):
+    """Print the result of :py:meth:`ResultsStore.get_duration_trends`"""
+    print("**** Duration trends ****")
+    for trend in trends:
+        print("  {:+7.1f}%  {:10.3f}s -> {:10.3f}s  {}.{}".format(
+            100. * trend['change'], trend['previous'], trend['recent'], trend['class_name'], trend['test_name']))
+
+
+def print_last_success(full_name, last_success):
+    """Print the result of :py:meth:`ResultsStore.get_last_success`"""
+    if last_success is None:
+        print("{}: never succeeded".format(full_name))
+        return
+    print("{}: last succeeded on {} (run {}, {:.3f}s, fingerprint {})".format(
+        full_name, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_success['time'])),
+        last_success['run_id'], last_success['duration'] or 0., last_success['fingerprint']))
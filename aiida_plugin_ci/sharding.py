@@ -0,0 +1,165 @@
+"""
+Run test classes in parallel over several worker processes
+
+Classes are assigned to workers so that the expected total duration of each
+worker (based on the durations of previous runs) is balanced. Each worker sets
+up its codes on its own AiiDA computer, a copy of the ``localhost`` computer
+with a separate work directory, so that workers do not collide.
+"""
+from __future__ import print_function, absolute_import
+
+import collections
+import functools
+import multiprocessing
+import traceback
+
+from .code_builders.base import DEFAULT_COMPUTER_NAME
+from .computers import clone_computer
+
+try:
+    from queue import Empty
+except ImportError:  # Python 2
+    from Queue import Empty
+
+# Workers are spawned as fresh interpreters (forked children would share the database
+# connections), which requires the start methods of Python 3
+SHARDING_SUPPORTED = hasattr(multiprocessing, 'get_context')
+
+
+def partition_by_duration(class_names, durations, num_shards):
+    """
+    Split the classes into ``num_shards`` lists with balanced expected durations.
+
+    Classes are assigned longest first, each to the shard with the smallest total so far.
+
+    :param class_names: a list of test class names
+    :param durations: a dictionary with the expected duration of each class
+    :return: a list of ``num_shards`` lists of class names (some possibly empty)
+    """
+    shards = [[] for _ in range(num_shards)]
+    loads = [0.] * num_shards
+    for class_name in sorted(class_names, key=lambda name: (-durations[name], name)):
+        shard_index = loads.index(min(loads))
+        shards[shard_index].append(class_name)
+        loads[shard_index] += durations[class_name]
+    return shards
+
+
+def setup_worker_computer(worker_index, base_computer_name=DEFAULT_COMPUTER_NAME):
+    """
+    Return the name of the computer used by a worker, creating it if needed.
+
+    The computer is a copy of ``base_computer_name`` whose work directory is a
+    ``ci-worker-<worker_index>`` subfolder of the original one.
+    """
+    return clone_computer(
+        '{}-ci-worker-{}'.format(base_computer_name, worker_index), base_computer_name,
+        workdir_subfolder='ci-worker-{}'.format(worker_index),
+        description="Computer of worker {} of aiida-plugin-ci".format(worker_index))
+
+
+def _put_record(result_queue, class_name, record):
+    """Put a record reported by a class in the queue of results"""
+    record = dict(record)
+    record['class'] = class_name
+    result_queue.put(('record', record))
+
+
+def _run_worker(worker_index, profile_name, test_dir, class_run_kwargs, run_kwargs, result_queue):  # pylint: disable=too-many-arguments
+    """
+    Entry point of a worker process: run the given classes and put the results in the queue.
+
+    :param class_run_kwargs: an ordered dictionary mapping the names of the classes to run to
+        the keyword arguments specific to each class, passed to :py:meth:`TestProcessPlugin.run`
+        in addition to ``run_kwargs``
+
+    Each record reported by the classes is put in the queue as a ``('record', record)`` tuple,
+    the ``class`` key being set. After each class, a ``('class', (class_name, status, class_timings))``
+    tuple is put in the queue. ``None`` is put in the queue when the worker is done.
+    """
+    try:
+        from aiida import load_profile
+        from .utils import get_test_classes
+
+        load_profile(profile_name)
+        computer_name = setup_worker_computer(worker_index)
+        test_classes = get_test_classes(
+            test_dir, modules={class_name.split('.')[0] for class_name in class_run_kwargs})
+
+        for class_name, kwargs in class_run_kwargs.items():
+            kwargs = dict(run_kwargs, **kwargs)
+            test_instance = test_classes[class_name]()
+            status = test_instance.run(
+                computer_name=computer_name,
+                report=functools.partial(_put_record, result_queue, class_name), **kwargs)
+            result_queue.put(('class', (class_name, status, test_instance.class_timings)))
+    except Exception:  # pylint: disable=broad-except
+        # Report on the parent stderr, the unfinished classes are reported by the parent
+        traceback.print_exc()
+    finally:
+        result_queue.put(None)
+
+
+def run_sharded(test_dir, durations, jobs, run_kwargs, report=None, class_run_kwargs=None):  # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Run the test classes over ``jobs`` worker processes, yielding results as they arrive.
+
+    :param test_dir: the folder with the tests
+    :param durations: a dictionary with the expected duration of each class to run
+    :param jobs: the number of worker processes
+    :param run_kwargs: keyword arguments for :py:meth:`TestProcessPlugin.run` (must be picklable)
+    :param report: optional callable, called in this process with each record reported
+        by the classes in the workers (see :py:mod:`aiida_plugin_ci.reporting`)
+    :param class_run_kwargs: optional dictionary mapping class names to additional keyword
+        arguments for :py:meth:`TestProcessPlugin.run`, specific to each class (must be picklable)
+    :return: a generator of ``(class_name, status, class_timings)`` tuples. For classes whose
+        worker died before reporting them, ``status`` is None.
+    :raise RuntimeError: if worker processes cannot be spawned (Python 2, see ``SHARDING_SUPPORTED``)
+    """
+    from aiida.manage.configuration import get_profile
+
+    if not SHARDING_SUPPORTED:
+        raise RuntimeError("Running the tests over several worker processes requires Python 3")
+
+    profile_name = get_profile().name
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+
+    workers = []
+    pending = {}
+    for worker_index, class_names in enumerate(partition_by_duration(list(durations), durations, jobs)):
+        if not class_names:
+            continue
+        worker_class_run_kwargs = collections.OrderedDict(
+            (class_name, (class_run_kwargs or {}).get(class_name, {})) for class_name in class_names)
+        worker = context.Process(
+            target=_run_worker,
+            args=(worker_index, profile_name, test_dir, worker_class_run_kwargs, run_kwargs, result_queue))
+        worker.start()
+        workers.append(worker)
+        pending.update({class_name: worker for class_name in class_names})
+
+    num_running = len(workers)
+    while num_running:
+        try:
+            result = result_queue.get(timeout=1.)
+        except Empty:
+            # Make sure we do not wait forever for workers that died without notice
+            if not any(worker.is_alive() for worker in workers):
+                break
+            continue
+        if result is None:
+            num_running -= 1
+            continue
+        result_type, result = result
+        if result_type == 'record':
+            if report is not None:
+                report(result)
+            continue
+        pending.pop(result[0], None)
+        yield result
+
+    for worker in workers:
+        worker.join()
+    for class_name in sorted(pending):
+        yield class_name, None, {}
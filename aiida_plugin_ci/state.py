@@ -0,0 +1,22 @@
+"""
+Location of the files where the runner keeps its state between runs
+(e.g. the history of durations)
+"""
+import os
+
+# Can be changed with the AIIDA_PLUGIN_CI_STATE_DIR environment variable
+STATE_DIR = os.environ.get(
+    'AIIDA_PLUGIN_CI_STATE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'aiida-plugin-ci'))
+
+
+def get_state_file(filename):
+    """
+    Return the full path of a file in the state directory, creating the directory if needed
+    """
+    if not os.path.isdir(STATE_DIR):
+        try:
+            os.makedirs(STATE_DIR)
+        except OSError:
+            if not os.path.isdir(STATE_DIR):
+                raise
+    return os.path.join(STATE_DIR, filename)
@@ -0,0 +1,218 @@
+"""
+Wall-clock timeouts of the tests, and cancellation of the processes that exceed them
+
+The timeout of a test is, in order of precedence:
+
+- the ``timeout`` argument of ``@process_test``
+- the ``max_wallclock_seconds`` option in the inputs of the process, plus
+  ``DEFAULT_TIMEOUT_GRACE`` seconds (for the upload, submission and retrieval)
+- the default timeout of the run, if any
+
+A test that exceeds its timeout is killed (together with the local processes of its
+jobs) and gets the ``TIMEOUT`` status. The timeout is also capped by the time left
+in the budget of the suite, if any: tests that do not start before the budget runs
+out get the ``SKIPPED`` status.
+"""
+from __future__ import absolute_import
+
+import os
+import signal
+import threading
+import time
+
+# Seconds added to ``max_wallclock_seconds`` to get the timeout of a test
+DEFAULT_TIMEOUT_GRACE = 60.
+
+
+def get_test_timeout(test_timeout, inputs, default_timeout=None):
+    """
+    Return the timeout in seconds of a test, or None if it has no timeout
+
+    :param test_timeout: the ``timeout`` of the test as passed to ``@process_test``, or None
+    :param inputs: the inputs of the process
+    :param default_timeout: the timeout for tests that define neither
+    """
+    if test_timeout is not None:
+        return test_timeout
+    try:
+        max_wallclock_seconds = inputs['metadata']['options']['max_wallclock_seconds']
+    except (KeyError, TypeError):
+        max_wallclock_seconds = None
+    if max_wallclock_seconds is not None:
+        return max_wallclock_seconds + DEFAULT_TIMEOUT_GRACE
+    return default_timeout
+
+
+def get_remaining_time(timeout, deadline):
+    """
+    Return the seconds a test can run, given its timeout and the ``deadline`` (a ``time.time()``
+    value, or None) of the suite; None means no limit
+    """
+    if deadline is None:
+        return timeout
+    remaining = max(deadline - time.time(), 0.)
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def get_process_children():
+    """
+    Return a dictionary mapping the PID of each running process to the list of PIDs of its
+    children, read from ``/proc`` (empty if not available)
+    """
+    children = {}
+    try:
+        proc_entries = os.listdir('/proc')
+    except OSError:
+        return children
+    for entry in proc_entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', entry, 'stat')) as handle:
+                stat = handle.read()
+        except (IOError, OSError):
+            continue  # Process terminated meanwhile
+        # The command name (2nd field) is in parentheses and may contain spaces
+        parent_pid = int(stat.rpartition(')')[2].split()[1])
+        children.setdefault(parent_pid, []).append(int(entry))
+    return children
+
+
+def get_descendant_pids(pid, children=None):
+    """
+    Return the PIDs of all descendants of a process
+
+    :param children: the result of :py:func:`get_process_children`, read again if not given
+    """
+    if children is None:
+        children = get_process_children()
+    descendants = []
+    to_visit = [pid]
+    while to_visit:
+        for child_pid in children.get(to_visit.pop(), []):
+            descendants.append(child_pid)
+            to_visit.append(child_pid)
+    return descendants
+
+
+def kill_process_tree(pid, sig=signal.SIGKILL):
+    """
+    Send a signal to a process and to all its descendants, ignoring those that already terminated
+    """
+    # Collect the descendants first: once killed, they would be reparented
+    for target_pid in [pid] + get_descendant_pids(pid):
+        try:
+            os.kill(target_pid, sig)
+        except OSError:
+            pass
+
+
+def get_local_job_pids(process_node):
+    """
+    Return the PIDs of the local job scripts of a process and of all the processes it called.
+
+    Only jobs run by the ``direct`` scheduler through a ``local`` transport are considered,
+    since their job id is the PID of the job script.
+    """
+    from aiida.orm import CalcJobNode
+
+    pids = []
+    for node in [process_node] + list(getattr(process_node, 'called_descendants', [])):
+        if not isinstance(node, CalcJobNode):
+            continue
+        job_id = node.get_job_id()
+        computer = node.computer
+        if (job_id is None or computer is None or computer.get_transport_type() != 'local' or
+                computer.get_scheduler_type() != 'direct'):
+            continue
+        try:
+            pids.append(int(job_id))
+        except ValueError:
+            pass
+    return pids
+
+
+def kill_job_processes(process_node):
+    """
+    Kill the local processes of the jobs of a process and of all the processes it called
+    (see :py:func:`get_local_job_pids`)
+    """
+    for pid in get_local_job_pids(process_node):
+        kill_process_tree(pid)
+
+
+def run_get_node_with_timeout(ProcessClass, inputs, timeout, on_start=None, on_tick=None, tick_interval=1.):  # pylint: disable=too-many-arguments
+    """
+    Run a process in the current interpreter like ``aiida.engine.run_get_node``, killing it if
+    it takes more than ``timeout`` seconds (if not None).
+
+    The timer only schedules the kill on the event loop of the runner: the local processes of
+    the jobs are looked up and killed there, in this thread, since the ORM is not thread-safe.
+
+    :param on_start: optional callable, called with the process node before the process starts
+    :param on_tick: optional callable, called every ``tick_interval`` seconds while the process
+        runs, from the event loop (so it can use the ORM)
+    :return: a tuple ``(process_node, timed_out)``; when the process is killed because of the
+        timeout, the exception raised by its execution is not propagated
+    """
+    from aiida.engine.utils import instantiate_process, loop_scope
+    from aiida.manage.manager import get_manager
+    from plumpy import KilledError
+
+    runner = get_manager().get_runner()
+    timed_out = threading.Event()
+
+    with loop_scope(runner.loop):
+        process = instantiate_process(runner, ProcessClass, **inputs)
+
+        def kill():
+            if process.has_terminated():
+                return
+            timed_out.set()
+            kill_job_processes(process.node)
+            process.kill('Test timed out after {} seconds'.format(timeout))
+
+        def on_timeout():
+            runner.loop.add_callback(kill)
+
+        def tick():
+            if not process.has_terminated():
+                on_tick()
+                runner.loop.call_later(tick_interval, tick)
+
+        if on_start is not None:
+            on_start(process.node)
+        if on_tick is not None:
+            runner.loop.call_later(tick_interval, tick)
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, on_timeout)
+            timer.daemon = True
+            timer.start()
+        try:
+            process.execute()
+        except KilledError:
+            # Killed by someone else (e.g. 'verdi process kill'): report it as any other failure
+            if not timed_out.is_set():
+                raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    return process.node, timed_out.is_set()
+
+
+def kill_submitted_process(process_node, timeout):
+    """
+    Kill a process submitted to the daemon that exceeded its timeout, and its local job processes
+    """
+    from aiida.manage.manager import get_manager
+
+    kill_job_processes(process_node)
+    try:
+        get_manager().get_process_controller().kill_process(
+            process_node.pk, msg='Test timed out after {} seconds'.format(timeout))
+    except Exception:  # pylint: disable=broad-except
+        # The process may have terminated meanwhile, or the daemon be unreachable:
+        # in both cases there is nothing else to do
+        pass
@@ -0,0 +1,67 @@
+"""
+Utilities to measure the time spent in each phase of a test run
+"""
+from __future__ import absolute_import
+
+import contextlib
+import time
+
+try:
+    monotonic = time.monotonic  # pylint: disable=invalid-name
+except AttributeError:  # Python 2
+    monotonic = time.time  # pylint: disable=invalid-name
+
+# Number of entries in each list of the summary
+SUMMARY_LENGTH = 10
+
+
+@contextlib.contextmanager
+def timed(timings, phase):
+    """
+    Context manager storing in ``timings[phase]`` the seconds spent in the block
+    (also if an exception is raised)
+    """
+    start = monotonic()
+    try:
+        yield
+    finally:
+        timings[phase] = monotonic() - start
+
+
+def summarize_timings(full_status, class_timings, length=SUMMARY_LENGTH):
+    """
+    Return a summary of the slowest phases, tests and classes of a run.
+
+    :param full_status: a dictionary mapping class names to their run status
+        (dictionaries mapping test names to statuses with a ``timings`` key)
+    :param class_timings: a dictionary mapping class names to their class-level timings
+        (as in :py:attr:`aiida_plugin_ci.TestProcessPlugin.class_timings`)
+    :return: a dictionary with the ``phases`` (total seconds per phase, over the whole suite),
+        and the ``length`` slowest ``tests`` and ``classes``
+    """
+    phases = {}
+    tests = []
+    for class_name, run_status in full_status.items():
+        for test_name, test_status in run_status.items():
+            timings = test_status.get('timings', {})
+            for phase, seconds in timings.items():
+                phases[phase] = phases.get(phase, 0.) + seconds
+            tests.append(("{}.{}".format(class_name, test_name), sum(timings.values())))
+
+    for timings in class_timings.values():
+        for code_timings in timings.get('codes', {}).values():
+            for phase, seconds in code_timings.items():
+                phases[phase] = phases.get(phase, 0.) + seconds
+        if 'setup_resources' in timings:
+            phases['setup_resources'] = phases.get('setup_resources', 0.) + timings['setup_resources']
+
+    classes = [(class_name, timings.get('total', 0.)) for class_name, timings in class_timings.items()]
+
+    def slowest(items):
+        return [list(item) for item in sorted(items, key=lambda item: (-item[1], item[0]))[:length]]
+
+    return {
+        'phases': slowest(phases.items()),
+        'tests': slowest(tests),
+        'classes': slowest(classes),
+    }
@@ -3,25 +3,56 @@ Module that contains utility functions to autodiscover tests and to run them
 """
 from __future__ import print_function, absolute_import
 
+import functools
 import pkgutil
 import inspect
 import json
+import sys
+import time
 
 from . import TestProcessPlugin
+from .benchmarking import DEFAULT_THRESHOLD, BenchmarkBaselines
+from .discovery import get_manifest, get_test_modules, print_class_description, select_tests
+from .fingerprint import ResultCache
+from .resources import summarize_resources
+from .results import ResultsStore
+from .history import DurationHistory, get_run_duration
+from .sharding import SHARDING_SUPPORTED, run_sharded
+from .reporting import TIMINGS_KEY, JsonLinesReporter
+from .timing import monotonic, summarize_timings
+from .planning import DEFAULT_BUILD_WORKERS, build_all, plan_builds
 
-def get_test_classes(test_dir):
+def _load_module(test_dir, module_name):
+    """
+    Import the module ``module_name`` from the ``test_dir`` directory
+    """
+    try:
+        import importlib.util
+        from importlib.machinery import PathFinder
+    except ImportError:  # Python 2
+        importer = pkgutil.get_importer(test_dir)
+        return importer.find_module(module_name).load_module(module_name)
+
+    spec = PathFinder.find_spec(module_name, [test_dir])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def get_test_classes(test_dir, modules=None):
     """
     Find all tests in the test_dir directory, defined as:
 
     - valid python modules
     - filename starting with ``test_``
+
+    :param modules: if specified, only import the test modules with these names
     """
     ret_dict = {}
-    for importer, package_name, _ in pkgutil.iter_modules([test_dir]):
-        if not package_name.startswith('test_'):
+    for package_name, _ in get_test_modules(test_dir):
+        if modules is not None and package_name not in modules:
             continue
-        loader = importer.find_module(package_name)
-        module = loader.load_module(package_name)
+        module = _load_module(test_dir, package_name)
         for name, obj in inspect.getmembers(module):
             if (inspect.isclass(obj) and 
                     issubclass(obj, TestProcessPlugin) and
@@ -29,28 +60,315 @@ def get_test_classes(test_dir):
                 ret_dict["{}.{}".format(package_name, name)] = obj
     return ret_dict
 
-def describe(test_dir):
+def get_descriptions(test_dir):
+    """
+    Return the description of all test classes in ``test_dir``
+    (see :py:func:`aiida_plugin_ci.discovery.get_manifest`).
+
+    Only the modules with classes that cannot be described statically (e.g. with computed
+    parameters, or with a base class imported from another module) are imported, to describe
+    their classes; the classes that turn out not to be test classes are left out.
+    """
+    descriptions = get_manifest(test_dir)
+    non_static_modules = {description['module'] for description in descriptions.values() if not description['static']}
+    if non_static_modules:
+        descriptions = {
+            class_key: description for class_key, description in descriptions.items()
+            if description['module'] not in non_static_modules
+        }
+        for class_key, test_class in get_test_classes(test_dir, modules=non_static_modules).items():
+            descriptions[class_key] = test_class.get_description()
+    return descriptions
+
+def get_selected_test_classes(test_dir, patterns=None):
+    """
+    Return the test classes matching the patterns, importing only the modules defining them.
+
+    :param patterns: a list of patterns (see :py:func:`aiida_plugin_ci.discovery.select_tests`);
+        if None, all tests are selected
+    :return: a tuple ``(test_classes, selection)``; ``test_classes`` is a dictionary as returned
+        by :py:func:`get_test_classes`, and ``selection`` maps each class name to the list of
+        names of the selected tests (or to None if all tests of the class are selected)
+    """
+    if patterns is None:
+        test_classes = get_test_classes(test_dir)
+        return test_classes, {test_name: None for test_name in test_classes}
+
+    selection = select_tests(get_descriptions(test_dir), patterns)
+    test_classes = get_test_classes(test_dir, modules={class_key.split('.')[0] for class_key in selection})
+    return {key: test_classes[key] for key in selection if key in test_classes}, selection
+
+def describe(test_dir, patterns=None):
     """
     Autodiscover all tests and print their description
+
+    The test modules are not imported, unless a class cannot be described statically
+    (see :py:mod:`aiida_plugin_ci.discovery`).
+
+    :param patterns: if specified, only describe the matching tests
+        (see :py:func:`aiida_plugin_ci.discovery.select_tests`)
     """
-    for test_name, test_class in get_test_classes(test_dir).items():
+    descriptions = get_descriptions(test_dir)
+    selection = select_tests(descriptions, patterns) if patterns is not None else descriptions
+    for test_name in sorted(selection):
+        description = descriptions[test_name]
+        if patterns is not None and selection[test_name] is not None:
+            description = dict(description)
+            description['tests'] = [test for test in description['tests'] if test['name'] in selection[test_name]]
         print("**** {} ****".format(test_name))
-        test_class.print_description()
+        print_class_description(description)
 
-def autorun(test_dir, verbose):
+class _BuildProgressPrinter(object):
+    """
+    Print the progress messages of the code builders, at most one per code every ``interval`` seconds
+    """
+    def __init__(self, interval=1.):
+        self.interval = interval
+        self._last_printed = {}
+
+    def __call__(self, spec_key, message):
+        now = monotonic()
+        last_printed = self._last_printed.get(spec_key)
+        if last_printed is None or now - last_printed >= self.interval:
+            self._last_printed[spec_key] = now
+            print("  code build {}: {}".format(spec_key, message))
+
+def _add_class_to_record(report, class_name, record):
+    """Add the class name to a record and report it"""
+    record = dict(record)
+    record['class'] = class_name
+    report(record)
+
+def autorun(test_dir, verbose, build_workers=DEFAULT_BUILD_WORKERS, concurrent=False, jobs=1,  # pylint: disable=too-many-arguments,too-many-locals
+            stream=None, patterns=None, force=False, calculation_caching=False, test_timeout=None, budget=None,
+            benchmark_repeats=None, baselines_path=None, update_baselines=False, perf_threshold=DEFAULT_THRESHOLD,
+            resource_accounting=False, instance_pool_size=None, computers=None, results_db=None):
     """
     Autodiscover all tests and run them
+
+    All codes declared by the test classes are deduplicated and built concurrently
+    (on at most ``build_workers`` threads). When the classes are run one after the other
+    in this process (``jobs`` is one, and not benchmarking) on Python 3, each class is run
+    as soon as its own codes are built, while the other codes are still being built (see
+    :py:mod:`aiida_plugin_ci.pipeline`); otherwise, all codes are built before running the tests.
+    If ``concurrent`` is True, the tests of each class with the same priority are
+    submitted together to the daemon (see :py:meth:`TestProcessPlugin.run`).
+    If ``jobs`` is larger than one, the test classes are run over ``jobs`` worker
+    processes (see :py:mod:`aiida_plugin_ci.sharding`); on Python 2, where worker processes
+    cannot be spawned, a warning is printed and the classes are run in this process.
+
+    By default, a JSON report is printed at the end. If ``stream`` (an open file) is
+    given, a record is instead written to it as soon as each code is built or set up
+    and each test finishes (see :py:mod:`aiida_plugin_ci.reporting`), and the
+    statuses are not kept in memory; the report can then be rebuilt with
+    :py:func:`aiida_plugin_ci.reporting.aggregate_records`.
+
+    If ``patterns`` is specified, only the matching tests are run
+    (see :py:func:`aiida_plugin_ci.discovery.select_tests`).
+
+    The durations of the classes and of their tests are recorded after each run
+    (see :py:class:`aiida_plugin_ci.history.DurationHistory`), to balance the worker processes
+    and to run the longest tests of each priority first.
+
+    Tests whose fingerprint did not change since their last successful run are not
+    run again, and are reported with the ``CACHED`` status
+    (see :py:mod:`aiida_plugin_ci.fingerprint`), unless ``force`` is True.
+
+    If ``calculation_caching`` is True, AiiDA caching is enabled for the entry points under
+    test (see :py:meth:`TestProcessPlugin.run`); with ``concurrent``, it does not apply, since
+    the daemon runs the calculations with its own caching configuration, and a warning is printed.
+
+    ``test_timeout`` is the timeout in seconds of the tests that do not define one
+    (see :py:mod:`aiida_plugin_ci.timeouts`). If ``budget`` is specified, the tests still
+    running ``budget`` seconds after the start (including the build of the codes) are
+    killed, and the tests not started yet are reported with the ``SKIPPED`` status.
+
+    If ``resource_accounting`` is True, the CPU time, peak memory and I/O of the local jobs of
+    each test are recorded in its status, and summed per class in the ``resources`` key of the
+    timings section of the report (see :py:mod:`aiida_plugin_ci.resources`).
+
+    If ``instance_pool_size`` is specified, each class starts a pool of this many persistent
+    instances for each of its Singularity codes, and runs its calculations in them
+    (see :py:mod:`aiida_plugin_ci.code_builders.instances`).
+
+    If ``computers`` (a list of ``(computer_name, max_concurrent)`` tuples) is specified, the
+    codes are set up on each of these computers, and the tests are dispatched to the
+    least-loaded one (see :py:mod:`aiida_plugin_ci.computers`). It cannot be combined with
+    ``jobs`` larger than one, since each worker process would enforce the maximum number of
+    tests of each computer on its own.
+
+    If ``results_db`` is specified (a path, or True for the default one in the state
+    directory), the run and the statuses of all tests are recorded in an SQLite database, to
+    query flaky tests and duration trends (see :py:mod:`aiida_plugin_ci.results`).
+
+    If ``benchmark_repeats`` is specified, the classes are instead benchmarked, one at a time,
+    running each test ``benchmark_repeats`` times: tests significantly slower (by more than
+    ``perf_threshold``, relative) than their baseline in ``baselines_path`` (by default, in the
+    state directory) are reported with the ``PERF_REGRESSION`` status
+    (see :py:meth:`TestProcessPlugin.benchmark`). In this mode, fingerprints and the history of
+    durations are neither used nor updated, and ``jobs``, ``concurrent``, ``force``,
+    ``calculation_caching`` and ``budget`` are ignored.
+
+    :raise ValueError: if both ``computers`` and ``jobs`` larger than one are specified
     """
+    if computers and jobs > 1:
+        raise ValueError("The tests cannot be dispatched over computers with more than one worker process")
+    deadline = time.time() + budget if budget is not None else None
+    if jobs > 1 and not SHARDING_SUPPORTED:
+        print("WARNING: --jobs requires Python 3, running all classes in this process", file=sys.stderr)
+        jobs = 1
     full_status = {}
+    report = JsonLinesReporter(stream) if stream is not None else None
 
-    for test_name, test_class in get_test_classes(test_dir).items():
-        print("**** {} ****".format(test_name))
-        # instantiate and run
-        status = test_class().run(verbose=verbose)
+    test_classes, selection = get_selected_test_classes(test_dir, patterns)
+    plan = plan_builds(test_classes)
+    if verbose:
+        print("**** Building {} distinct code(s) ****".format(len(plan)))
+    if not benchmark_repeats and jobs <= 1 and sys.version_info[0] >= 3:
+        from .pipeline import iter_ready_classes
+        prebuilt_codes = None
+        ready_classes = iter_ready_classes(
+            test_classes, max_workers=build_workers, report=report,
+            progress=_BuildProgressPrinter() if verbose else None)
+    else:
+        prebuilt_codes = build_all(plan, max_workers=build_workers, report=report)
+        ready_classes = ((test_name, prebuilt_codes) for test_name in test_classes)
+
+    history = DurationHistory()
+    result_cache = ResultCache()
+    run_kwargs = {
+        'prebuilt_codes': prebuilt_codes, 'concurrent': concurrent, 'calculation_caching': calculation_caching,
+        'default_timeout': test_timeout, 'deadline': deadline, 'resource_accounting': resource_accounting,
+        'instance_pool_size': instance_pool_size, 'computers': computers,
+    }
+    class_run_kwargs = {
+        test_name: {
+            'tests': selection[test_name],
+            'previous_fingerprints': None if force else result_cache.get_class_fingerprints(test_name),
+            'expected_durations': {
+                test.test_function_name: history.get_test_duration(test_name, test.test_function_name)
+                for test in test_class.get_tests()
+            },
+        } for test_name, test_class in test_classes.items()
+    }
+    class_timings = {}
+    results_store = None
+    if results_db:
+        results_store = ResultsStore(results_db if results_db is not True else None)
+        run_id = results_store.start_run()
+
+    def store_status(test_name, status):
+        if not benchmark_repeats:
+            result_cache.update(test_name, status)
+            result_cache.save()
+        if results_store is not None:
+            results_store.record_class(run_id, test_name, status)
+        if report is not None:
+            # Only keep what is needed for the summaries of timings and resources
+            status = {
+                key: {field: value[field] for field in ('timings', 'resources') if field in value}
+                for key, value in status.items()
+            }
         full_status[test_name] = status
-    
+
+    if benchmark_repeats:
+        baselines = BenchmarkBaselines(baselines_path)
+        for test_name, test_class in test_classes.items():
+            print("**** {} ****".format(test_name))
+            test_instance = test_class()
+            class_report = functools.partial(_add_class_to_record, report, test_name) if report else None
+            status = test_instance.benchmark(
+                benchmark_repeats, verbose=verbose, prebuilt_codes=prebuilt_codes, report=class_report,
+                tests=selection[test_name], baselines=baselines, threshold=perf_threshold,
+                update_baselines=update_baselines, default_timeout=test_timeout)
+            baselines.save()
+            store_status(test_name, status)
+            class_timings[test_name] = test_instance.class_timings
+    elif jobs > 1:
+        durations = {
+            test_name: history.get_class_duration(test_name) for test_name in test_classes
+        }
+        for test_name, status, timings in run_sharded(
+                test_dir, durations, jobs, run_kwargs, report=report, class_run_kwargs=class_run_kwargs):
+            print("**** {} ****".format(test_name))
+            if status is None:
+                print("  -> WORKER DIED BEFORE REPORTING THIS CLASS")
+                status = {}
+            elif verbose:
+                for test_function_name in sorted(status):
+                    print("  -> test '{}' run, status: {}".format(
+                        test_function_name, status[test_function_name].get('status', "UNKNOWN")))
+            store_status(test_name, status)
+            class_timings[test_name] = timings
+    else:
+        for test_name, class_prebuilt_codes in ready_classes:
+            print("**** {} ****".format(test_name))
+            # instantiate and run
+            test_instance = test_classes[test_name]()
+            class_report = functools.partial(_add_class_to_record, report, test_name) if report else None
+            status = test_instance.run(
+                verbose=verbose, report=class_report,
+                **dict(run_kwargs, prebuilt_codes=class_prebuilt_codes, **class_run_kwargs[test_name]))
+            store_status(test_name, status)
+            class_timings[test_name] = test_instance.class_timings
+
+    if not benchmark_repeats:
+        for test_name, timings in class_timings.items():
+            if 'total' in timings:
+                history.record_class_duration(test_name, timings['total'])
+        for test_name, status in full_status.items():
+            for test_function_name, test_status in status.items():
+                duration = get_run_duration(test_status)
+                if duration is not None:
+                    history.record_test_duration(test_name, test_function_name, duration)
+        history.save()
+    if results_store is not None:
+        results_store.finish_run(run_id, class_timings)
+        results_store.close()
+
+    summary = summarize_timings(full_status, class_timings)
+    class_resources = {}
+    if resource_accounting:
+        class_resources = {test_name: summarize_resources(status) for test_name, status in full_status.items()}
+    if verbose:
+        print_timings_summary(summary)
+        if resource_accounting:
+            print_resources_summary(class_resources)
+
+    if report is not None:
+        report({'type': 'suite_end'})
+        return
+
+    # Class names always contain a dot, so they cannot clash with this key
+    full_status[TIMINGS_KEY] = {'classes': class_timings, 'summary': summary}
+    if resource_accounting:
+        full_status[TIMINGS_KEY]['resources'] = class_resources
     print(json.dumps(full_status, sort_keys=True, indent=2))
 
+def print_timings_summary(summary):
+    """
+    Print the summary returned by :py:func:`aiida_plugin_ci.timing.summarize_timings`
+    """
+    for section in ['phases', 'classes', 'tests']:
+        print("**** Slowest {} ****".format(section))
+        for name, seconds in summary[section]:
+            print("  {:10.3f}s  {}".format(seconds, name))
+
+def print_resources_summary(class_resources):
+    """
+    Print the resources used by the jobs of each class, as returned by
+    :py:func:`aiida_plugin_ci.resources.summarize_resources`
+    """
+    print("**** Resources used by the jobs ****")
+    for class_name in sorted(class_resources):
+        resources = class_resources[class_name]
+        if resources is None:
+            print("  {}: no local job sampled".format(class_name))
+            continue
+        print("  {}: CPU {:.3f}s user + {:.3f}s system, peak RSS {:.1f} MiB, read {:.1f} MiB, written {:.1f} MiB".format(
+            class_name, resources['cpu_user'], resources['cpu_system'], resources['peak_rss'] / 1024. ** 2,
+            resources.get('read_chars', 0) / 1024. ** 2, resources.get('write_chars', 0) / 1024. ** 2))
+
 def print_aiida_version():
     """
     Print the AiiDA version in the current virtual env.
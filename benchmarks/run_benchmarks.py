@@ -0,0 +1,231 @@
+#!/usr/bin/env runaiida
+"""
+Benchmarks of the overhead of the test runner
+
+Synthetic test classes with 1, 10, 100 and 1000 ``@process_test`` methods are
+generated in a temporary folder. Each test runs a ``templatereplacer``
+calculation with a trivial local shell script (``localexecutable`` builder, no
+network access). For each size, the script measures:
+
+- the discovery time (static manifest, cold and warm, and importing the module)
+- the code setup time
+- the latency of each test (mean, median and 95th percentile), and the part of it
+  that is not spent in the AiiDA engine (the runner overhead)
+- the number of tests run per second
+
+The benchmark fails if any of the tests does not succeed.
+
+Results are written as JSON, and can be compared with a previous baseline.
+Requires a profile with a 'localhost' computer (local transport, direct scheduler).
+"""
+from __future__ import print_function, absolute_import, division
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+from aiida_plugin_ci.discovery import get_manifest
+from aiida_plugin_ci.timing import monotonic
+from aiida_plugin_ci.utils import get_test_classes
+
+DEFAULT_SIZES = [1, 10, 100, 1000]
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# Reads a value from stdin and prints its double, as expected by the 'templatereplacer.doubler' parser
+DOUBLER_SCRIPT = """#!/bin/bash
+read value
+echo $(( value * 2 ))
+echo $(( value * 3 )) > triple_value.tmp
+"""
+
+MODULE_HEADER = '''"""
+Synthetic benchmark tests, generated by run_benchmarks.py
+"""
+from aiida_plugin_ci import TestProcessPlugin, process_test
+
+class Bench{size}(TestProcessPlugin):
+    """Synthetic benchmark class with {size} tests"""
+
+    code_resources = {{
+        'doubler': {{
+            'type': 'localexecutable',
+            'parameters': {{'script': {script!r}, 'name': 'doubler'}},
+            'input_plugin_name': 'templatereplacer'
+        }},
+    }}
+
+    def setup_resources(self):
+        from aiida.orm import Dict
+
+        self.template = Dict(dict={{
+            'input_file_template': "{{value}}",
+            'input_through_stdin': True,
+            'input_file_name': 'value_to_double.txt',
+            'output_file_name': 'output.txt',
+            'retrieve_temporary_files': ['triple_value.tmp']
+        }}).store()
+
+    def generate_inputs(self, value):
+        from aiida.orm import Dict
+
+        return {{
+            'code': self.codes['doubler'],
+            'parameters': Dict(dict={{'value': value}}),
+            'template': self.template,
+            'metadata': {{
+                'options': {{
+                    'resources': {{'num_machines': 1}},
+                    'max_wallclock_seconds': 60,
+                    'withmpi': False,
+                    'parser_name': 'templatereplacer.doubler',
+                }}
+            }}
+        }}
+'''
+
+TEST_TEMPLATE = '''
+    def generate_inputs_{index}(self):
+        return self.generate_inputs({index})
+
+    @process_test(0, 'aiida.calculations:templatereplacer', generate_inputs_{index})
+    def test_{index}(self, node):
+        assert node.outputs.output_parameters.dict.value == 2 * {index}
+'''
+
+
+def write_test_module(test_dir, size):
+    """Write a module with a synthetic test class with ``size`` tests, return the class name"""
+    source = MODULE_HEADER.format(size=size, script=DOUBLER_SCRIPT)
+    source += ''.join(TEST_TEMPLATE.format(index=index) for index in range(size))
+    with open(os.path.join(test_dir, 'test_bench_{}.py'.format(size)), 'w') as handle:
+        handle.write(source)
+    return 'test_bench_{0}.Bench{0}'.format(size)
+
+
+def get_statistics(values):
+    """Return the mean, median and 95th percentile of a list of values"""
+    values = sorted(values)
+    if not values:
+        return {'mean': None, 'median': None, 'p95': None}
+    return {
+        'mean': sum(values) / len(values),
+        'median': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(0.95 * len(values)))],
+    }
+
+
+def benchmark_size(size):
+    """Run the benchmark for a synthetic class with ``size`` tests, return the results"""
+    test_dir = tempfile.mkdtemp()
+    try:
+        class_name = write_test_module(test_dir, size)
+        manifest_path = os.path.join(test_dir, 'manifest.json')
+
+        start = monotonic()
+        get_manifest(test_dir, manifest_path=manifest_path)
+        discovery_cold = monotonic() - start
+        start = monotonic()
+        get_manifest(test_dir, manifest_path=manifest_path)
+        discovery_warm = monotonic() - start
+        start = monotonic()
+        test_class = get_test_classes(test_dir)[class_name]
+        discovery_import = monotonic() - start
+
+        test_instance = test_class()
+        start = monotonic()
+        run_status = test_instance.run()
+        wall_time = monotonic() - start
+    finally:
+        shutil.rmtree(test_dir)
+
+    failed = sorted(test_name for test_name, status in run_status.items() if status.get('status') != 'SUCCESS')
+    if failed:
+        # The timings of failing tests are not representative
+        raise RuntimeError("{} of the {} benchmark tests did not succeed, e.g. {}: {}".format(
+            len(failed), size, failed[0], run_status[failed[0]]))
+
+    latencies = [sum(status['timings'].values()) for status in run_status.values()]
+    overheads = [
+        latency - status['timings'].get('run_get_node', 0.)
+        for latency, status in zip(latencies, run_status.values())
+    ]
+    code_timings = test_instance.class_timings.get('codes', {}).get('doubler', {})
+    return {
+        'num_tests': size,
+        'num_successful': size,
+        'discovery_manifest_cold': discovery_cold,
+        'discovery_manifest_warm': discovery_warm,
+        'discovery_import': discovery_import,
+        'code_setup': sum(code_timings.values()),
+        'setup_resources': test_instance.class_timings.get('setup_resources'),
+        'test_latency': get_statistics(latencies),
+        'runner_overhead': get_statistics(overheads),
+        'tests_per_second': size / wall_time if wall_time else None,
+        'wall_time': wall_time,
+    }
+
+
+def get_metadata():
+    """Return information on the environment of the benchmark"""
+    import aiida
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'aiida': aiida.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def print_comparison(results, baseline):
+    """Print the ratio of each result to the same result in the baseline"""
+    for size, size_results in sorted(results['results'].items(), key=lambda item: int(item[0])):
+        print("**** {} tests ****".format(size))
+        baseline_results = baseline['results'].get(size, {})
+        for key in ['discovery_manifest_warm', 'discovery_import', 'code_setup', 'tests_per_second']:
+            if size_results.get(key) and baseline_results.get(key):
+                print("  {:25s} {:10.4f} (baseline {:10.4f}, ratio {:.2f})".format(
+                    key, size_results[key], baseline_results[key], size_results[key] / baseline_results[key]))
+        for key in ['test_latency', 'runner_overhead']:
+            current, previous = size_results[key]['median'], baseline_results.get(key, {}).get('median')
+            if current and previous:
+                print("  {:25s} {:10.4f} (baseline {:10.4f}, ratio {:.2f})".format(
+                    key + ' (median)', current, previous, current / previous))
+
+
+def main():
+    """Run the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of the test runner")
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=DEFAULT_SIZES, help="comma-separated numbers of tests per class")
+    parser.add_argument('-o', '--output', help="file where to write the results (default: a new "
+                        "timestamped file in {})".format(BASELINES_DIR))
+    parser.add_argument('--compare', metavar='BASELINE', help="compare the results with a previous baseline")
+    args = parser.parse_args()
+
+    results = {'metadata': get_metadata(), 'results': {}}
+    for size in args.sizes:
+        print("Running benchmark with {} tests...".format(size))
+        results['results'][str(size)] = benchmark_size(size)
+
+    output = args.output
+    if output is None:
+        if not os.path.isdir(BASELINES_DIR):
+            os.makedirs(BASELINES_DIR)
+        output = os.path.join(BASELINES_DIR, 'baseline-{}.json'.format(
+            datetime.datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w') as handle:
+        handle.write(json.dumps(results, sort_keys=True, indent=2))
+    print("Results written to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as handle:
+            print_comparison(results, json.load(handle))
+
+
+if __name__ == "__main__":
+    main()
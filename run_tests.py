@@ -1,19 +1,155 @@
-#!/usr/bin/env runaiida
+#!/usr/bin/env python
 from __future__ import print_function
 
+import argparse
+import json
 import sys
 
+from aiida_plugin_ci.benchmarking import DEFAULT_THRESHOLD
+from aiida_plugin_ci.computers import parse_computers, setup_local_computers
+from aiida_plugin_ci.reporting import aggregate_records, print_record, read_records
+from aiida_plugin_ci.results import (ResultsStore, print_duration_trends, print_flaky_tests, print_last_success,
+                                     split_test_name)
 from aiida_plugin_ci.utils import autorun, describe, status
 
 TEST_FOLDER = 'test_examples'
 
+def load_profile():
+    """
+    Load the default AiiDA profile, as ``runaiida`` would: only needed to run the tests, so
+    that describing them does not need AiiDA nor a profile
+    """
+    from aiida import load_profile as load_aiida_profile
+
+    load_aiida_profile()
+
+def get_parser():
+    """Return the command line parser"""
+    parser = argparse.ArgumentParser(description="Run the AiiDA plugin tests")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('-v', dest='describe', action='store_true',
+                      help="run a dry-run inspecting the tests")
+    mode.add_argument('-s', dest='status', action='store_true',
+                      help="check the status of the dependencies (singularity, aiida)")
+    mode.add_argument('--aggregate', metavar='REPORT',
+                      help="rebuild the JSON report from a JSON-lines report written with --stream")
+    mode.add_argument('--follow', metavar='REPORT',
+                      help="follow live a JSON-lines report written with --stream")
+    mode.add_argument('--flaky', action='store_true',
+                      help="list the tests whose status changed between the last --last-runs runs "
+                      "recorded with --results-db")
+    mode.add_argument('--trends', action='store_true',
+                      help="compare the mean duration of the tests over the last --days days, "
+                      "recorded with --results-db, to the --days days before")
+    mode.add_argument('--last-good', metavar='TEST',
+                      help="print the last run recorded with --results-db in which the test "
+                      "(module.ClassName.test_name) succeeded")
+    parser.add_argument('-c', '--concurrent', action='store_true',
+                        help="submit the tests with the same priority together to the daemon")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of worker processes over which test classes are spread")
+    parser.add_argument('-k', '--select', metavar='PATTERN', action='append',
+                        help="only consider the classes (module.ClassName) or tests "
+                        "(module.ClassName.test_name) matching the shell-style PATTERN; can be repeated")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="run all tests, also those whose fingerprint did not change since "
+                        "their last successful run")
+    parser.add_argument('--aiida-caching', action='store_true',
+                        help="enable AiiDA caching for the entry points under test: identical "
+                        "calculations already in the profile are cloned instead of executed")
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help="kill the tests running for more than SECONDS, unless they define their "
+                        "own timeout or max_wallclock_seconds")
+    parser.add_argument('--budget', type=float, metavar='SECONDS',
+                        help="kill the tests still running SECONDS after the start of the suite, "
+                        "and skip the remaining ones")
+    parser.add_argument('--benchmark', type=int, metavar='K',
+                        help="run each test K times and report PERF_REGRESSION for the tests "
+                        "significantly slower than their baseline")
+    parser.add_argument('--baselines', metavar='FILE',
+                        help="JSON file with the benchmark baselines (default: in the state directory); "
+                        "tests without a baseline get one")
+    parser.add_argument('--update-baselines', action='store_true',
+                        help="replace the baselines with the samples of this benchmark run")
+    parser.add_argument('--perf-threshold', type=float, default=DEFAULT_THRESHOLD, metavar='FRACTION',
+                        help="minimal relative slowdown of the median wall time or calculation job runtime "
+                        "to report a regression (default: %(default)s)")
+    parser.add_argument('--resources', action='store_true',
+                        help="sample the CPU time, peak memory and I/O of the local jobs of each test, "
+                        "and report them per test and per class")
+    parser.add_argument('--singularity-instances', type=int, metavar='N',
+                        help="start N persistent instances of each Singularity image used by a class, "
+                        "and run its calculations in them instead of starting a container for each")
+    parser.add_argument('--computers', type=parse_computers, metavar='NAME[:MAX],...',
+                        help="set up the codes on these AiiDA computers, and dispatch each test to the "
+                        "least-loaded one, running at most MAX tests at the same time on it")
+    parser.add_argument('--local-computers', type=int, metavar='N',
+                        help="add N copies of the localhost computer, with separate work directories, "
+                        "to the computers of --computers (created on first use)")
+    parser.add_argument('--max-per-computer', type=int, metavar='MAX',
+                        help="maximum number of tests running at the same time on each computer "
+                        "without an explicit MAX")
+    parser.add_argument('--results-db', nargs='?', const=True, metavar='FILE',
+                        help="record the run in this SQLite database (default: in the state directory), "
+                        "or query it with --flaky, --trends and --last-good")
+    parser.add_argument('--last-runs', type=int, default=100, metavar='N',
+                        help="number of runs considered by --flaky (default: %(default)s)")
+    parser.add_argument('--days', type=int, default=30, metavar='DAYS',
+                        help="length of the windows compared by --trends (default: %(default)s)")
+    parser.add_argument('--stream', metavar='REPORT',
+                        help="write a JSON record to REPORT ('-' for stdout) as soon as each "
+                        "code is setup and each test finishes, instead of a JSON report at the end")
+    return parser
+
 if __name__ == "__main__":
-    if sys.argv[1:2] == ['-v']:
-        describe(TEST_FOLDER)
-    elif sys.argv[1:2] == ['-s']:
+    parser = get_parser()
+    args = parser.parse_args()
+    if (args.computers or args.local_computers) and args.jobs > 1:
+        # Each worker would enforce the maximum number of tests per computer on its own
+        parser.error("--computers and --local-computers cannot be used with --jobs larger than 1")
+    if args.describe:
+        describe(TEST_FOLDER, patterns=args.select)
+    elif args.status:
         status()
-    elif sys.argv[1:2] == []:
-        autorun(TEST_FOLDER, verbose=True)
+    elif args.aggregate:
+        with open(args.aggregate) as report:
+            print(json.dumps(aggregate_records(read_records(report)), sort_keys=True, indent=2))
+    elif args.follow:
+        with open(args.follow) as report:
+            for record in read_records(report, follow=True):
+                print_record(record)
+    elif args.flaky or args.trends or args.last_good:
+        results_store = ResultsStore(args.results_db if args.results_db is not True else None)
+        if args.flaky:
+            print_flaky_tests(results_store.get_flaky_tests(args.last_runs))
+        elif args.trends:
+            print_duration_trends(results_store.get_duration_trends(args.days))
+        else:
+            print_last_success(args.last_good, results_store.get_last_success(*split_test_name(args.last_good)))
+        results_store.close()
     else:
-        print("Pass either -v or no cmdline parameter", file=sys.stderr)
-        sys.exit(1)
+        load_profile()
+        computers = None
+        if args.computers or args.local_computers:
+            computers = list(args.computers or [])
+            computers += [(name, None) for name in setup_local_computers(args.local_computers or 0)]
+            computers = [(name, max_concurrent or args.max_per_computer) for name, max_concurrent in computers]
+        autorun_kwargs = {
+            'verbose': True, 'concurrent': args.concurrent, 'jobs': args.jobs, 'patterns': args.select,
+            'force': args.force,
+            'calculation_caching': args.aiida_caching,
+            'test_timeout': args.timeout, 'budget': args.budget,
+            'benchmark_repeats': args.benchmark, 'baselines_path': args.baselines,
+            'update_baselines': args.update_baselines, 'perf_threshold': args.perf_threshold,
+            'resource_accounting': args.resources,
+            'instance_pool_size': args.singularity_instances,
+            'computers': computers,
+            'results_db': args.results_db,
+        }
+        if args.stream == '-':
+            autorun(TEST_FOLDER, stream=sys.stdout, **autorun_kwargs)
+        elif args.stream:
+            with open(args.stream, 'w') as stream:
+                autorun(TEST_FOLDER, stream=stream, **autorun_kwargs)
+        else:
+            autorun(TEST_FOLDER, **autorun_kwargs)
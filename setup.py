@@ -34,7 +34,7 @@ setup(
     license=the_license,
     author='Giovanni Pizzi',
     version=version,
-    install_requires=[],
+    install_requires=['futures; python_version<"3"'],
     extras_require={
     },
     packages=find_packages(),
@@ -3,7 +3,7 @@ Some example plugin tests as a demonstrator
 """
 from __future__ import print_function, absolute_import
 
-from aiida_plugin_ci import TestProcessPlugin, process_test
+from aiida_plugin_ci import TestProcessPlugin, fixture, process_test
 
 class CustomTest(TestProcessPlugin):
     """A simple test"""
@@ -23,20 +23,25 @@ class CustomTest(TestProcessPlugin):
         },
     }
 
-    def setup_resources(self):
+    @fixture(scope='persistent')
+    def template(self):
         """
-        Setup some resources into the DB only once for all tests
+        The template, stored in the DB only once (and then reused also in later runs)
         """
         from aiida.orm import Dict
 
-        self.template = Dict(dict={
+        return Dict(dict={
             'cmdline_params': ["1"],
             'input_file_template': "{value}",  # File just contains the value to double
             'input_file_name': 'value_to_double.txt',
             'output_file_name': 'output.txt',
             'retrieve_temporary_files': ['triple_value.tmp']
-        }).store()
+        })
 
+    def setup_resources(self):
+        """
+        Setup some resources only once for all tests
+        """
         self.options_dict = {
             'resources': {
                 'num_machines': 1
@@ -0,0 +1,130 @@
+"""
+Tests of the benchmark mode and of the comparison of the samples to their baselines
+"""
+import contextlib
+import sys
+import types
+
+import pytest
+
+from aiida_plugin_ci import base, benchmarking
+from aiida_plugin_ci.benchmarking import BenchmarkBaselines
+
+
+def _generate_inputs(self):  # pylint: disable=unused-argument
+    return {}
+
+
+class CyclicTests(base.TestProcessPlugin):
+    """Two tests depending on each other, and an independent one"""
+
+    @base.process_test(0, 'dummy', _generate_inputs, depends_on=['test_b'])
+    def test_a(self, node):
+        pass
+
+    @base.process_test(0, 'dummy', _generate_inputs, depends_on=['test_a'])
+    def test_b(self, node):
+        pass
+
+    @base.process_test(0, 'dummy', _generate_inputs)
+    def test_c(self, node):
+        pass
+
+
+CLASS_NAME = '{}.CyclicTests'.format(CyclicTests.__module__)
+
+
+@pytest.fixture
+def fake_benchmark(monkeypatch):
+    """Install a fake ``aiida.manage.caching``, and run tests without setting up codes nor running processes"""
+    modules = {
+        'aiida': types.ModuleType('aiida'),
+        'aiida.manage': types.ModuleType('aiida.manage'),
+        'aiida.manage.caching': types.ModuleType('aiida.manage.caching'),
+    }
+    modules['aiida.manage.caching'].disable_caching = contextlib.contextmanager(lambda: (yield))
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.setattr(base.TestProcessPlugin, '_setup_class', lambda self, *args, **kwargs: True)
+    samples = {}
+
+    def benchmark_test(self, test, repeats, default_timeout):  # pylint: disable=unused-argument
+        return {'status': 'SUCCESS', 'benchmark': dict(samples[test.test_function_name])}
+
+    monkeypatch.setattr(base.TestProcessPlugin, '_benchmark_test', benchmark_test)
+    return samples
+
+
+def test_benchmark_cyclic_dependencies(fake_benchmark, tmpdir):
+    """Tests in a dependency cycle are reported as INVALID_DEPENDENCIES, the others are benchmarked"""
+    fake_benchmark['test_c'] = {'wall_times': [1., 1.1], 'calcjob_times': [0.5, 0.6]}
+    run_status = CyclicTests().benchmark(baselines=BenchmarkBaselines(str(tmpdir.join('baselines.json'))))
+
+    assert run_status['test_a']['status'] == 'INVALID_DEPENDENCIES'
+    assert run_status['test_b']['status'] == 'INVALID_DEPENDENCIES'
+    assert run_status['test_c']['status'] == 'SUCCESS'
+
+
+def test_benchmark_calcjob_regression(fake_benchmark, tmpdir):
+    """A regression of the runtime of the calculation jobs alone is reported, with the metric that regressed"""
+    baselines = BenchmarkBaselines(str(tmpdir.join('baselines.json')))
+    baselines.set(CLASS_NAME, 'test_c', [1.0, 1.1, 0.9, 1.0], [0.5, 0.6, 0.5, 0.4])
+    fake_benchmark['test_c'] = {'wall_times': [1.0, 0.9, 1.1, 1.0], 'calcjob_times': [2.0, 2.1, 1.9, 2.2]}
+    status = CyclicTests().benchmark(baselines=baselines, tests=['test_c'])['test_c']
+
+    assert status['status'] == 'PERF_REGRESSION'
+    assert status['regressions'] == ['calcjob_times']
+    assert not status['benchmark']['baseline']['wall_times']['regression']
+    assert status['benchmark']['baseline']['calcjob_times']['regression']
+
+
+def test_benchmark_missing_calcjob_samples(fake_benchmark, tmpdir):
+    """Baselines without calculation job runtimes (e.g. written by older versions) only compare the wall times"""
+    baselines = BenchmarkBaselines(str(tmpdir.join('baselines.json')))
+    baselines.set(CLASS_NAME, 'test_c', [1.0, 1.1, 0.9, 1.0], [])
+    fake_benchmark['test_c'] = {'wall_times': [2.0, 2.1, 1.9, 2.2], 'calcjob_times': [2.0, 2.1, 1.9, 2.2]}
+    status = CyclicTests().benchmark(baselines=baselines, tests=['test_c'])['test_c']
+
+    assert status['status'] == 'PERF_REGRESSION'
+    assert status['regressions'] == ['wall_times']
+    assert sorted(status['benchmark']['baseline']) == ['wall_times']
+
+
+def test_exact_p_values():
+    """The exact p-values of the one-sided Mann-Whitney U test, also with ties"""
+    # All samples larger: only 1 of the C(6, 3) = 20 (or C(8, 4) = 70) permutations is as extreme
+    assert benchmarking.get_slowdown_p_value([4, 5, 6], [1, 2, 3]) == pytest.approx(1 / 20.)
+    assert benchmarking.get_slowdown_p_value([5, 6, 7, 8], [1, 2, 3, 4]) == pytest.approx(1 / 70.)
+    # All samples smaller: all permutations are as extreme
+    assert benchmarking.get_slowdown_p_value([1, 2, 3], [4, 5, 6]) == pytest.approx(1.)
+    # Ties count half: U = 3.5, reached by 2 of the 6 permutations
+    assert benchmarking.get_slowdown_p_value([2, 3], [1, 2]) == pytest.approx(1 / 3.)
+    assert benchmarking.get_slowdown_p_value([1, 1], [1, 1]) == pytest.approx(1.)
+
+
+def test_normal_approximation(monkeypatch):
+    """Above ``MAX_EXACT_PERMUTATIONS``, the normal approximation (with continuity correction) is used"""
+    samples = [3.5, 5.5, 7.5, 9.5, 11.5, 13.5, 15.5, 18.5]
+    baseline = [1, 2, 4, 6, 8, 10, 12, 14]
+    exact_p_value = benchmarking.get_slowdown_p_value(samples, baseline)
+    monkeypatch.setattr(benchmarking, 'MAX_EXACT_PERMUTATIONS', 0)
+
+    # U = 16, mean 8 and standard deviation sqrt(12): z = 7.5 / sqrt(12)
+    assert benchmarking.get_slowdown_p_value([5, 6, 7, 8], [1, 2, 3, 4]) == pytest.approx(0.015191, abs=1e-6)
+    assert benchmarking.get_slowdown_p_value(samples, baseline) == pytest.approx(exact_p_value, abs=0.01)
+
+
+def test_compare_to_baseline():
+    """A regression needs both a significant p-value and a slowdown of the median above the threshold"""
+    baseline = [1.0, 1.1, 0.9, 1.0]
+
+    comparison = benchmarking.compare_to_baseline([2.0, 2.1, 1.9, 2.2], baseline)
+    assert comparison['median'] == pytest.approx(1.0)
+    assert comparison['slowdown'] == pytest.approx(1.05)
+    assert comparison['p_value'] == pytest.approx(1 / 70.)
+    assert comparison['regression']
+
+    # Significant but small slowdown
+    assert not benchmarking.compare_to_baseline([1.15, 1.16, 1.17, 1.18], baseline, threshold=0.2)['regression']
+    # Large slowdown, but not significant with so few samples
+    assert not benchmarking.compare_to_baseline([2.0, 2.1], baseline[:2])['regression']
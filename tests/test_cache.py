@@ -0,0 +1,56 @@
+"""
+Tests of the eviction of the image cache
+"""
+import json
+import os
+import subprocess
+
+from aiida_plugin_ci.code_builders import cache
+from aiida_plugin_ci.code_builders.cache import ImageCache
+
+
+def _write_image(cache_dir, filename, size):
+    with open(os.path.join(cache_dir, filename), 'wb') as handle:
+        handle.write(b'x' * size)
+
+
+def _get_dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def test_eviction_skips_images_in_use(tmpdir, monkeypatch):
+    """Images used by a running process are kept, the ones of finished processes are evicted"""
+    cache_dir = str(tmpdir)
+    image_cache = ImageCache(cache_dir, max_size=250)
+    for filename in ['old', 'used', 'new']:
+        _write_image(cache_dir, filename, 100)
+
+    dead_pid = _get_dead_pid()
+    monkeypatch.setattr(cache.os, 'getpid', lambda: dead_pid)
+    image_cache.add('old', 'old')
+    monkeypatch.undo()
+    image_cache.add('used', 'used')
+    image_cache.add('new', 'new')
+
+    assert sorted(json.load(open(image_cache.index_path))['entries']) == ['new', 'used']
+    assert not os.path.exists(os.path.join(cache_dir, 'old'))
+    assert os.path.exists(os.path.join(cache_dir, 'used'))
+
+
+def test_hard_linked_images_do_not_count(tmpdir):
+    """Images hard-linked from elsewhere take no space in the budget, and are not evicted"""
+    cache_dir = str(tmpdir.mkdir('cache'))
+    mirror_image = str(tmpdir.join('mirror-image'))
+    with open(mirror_image, 'wb') as handle:
+        handle.write(b'y' * 1000)
+    os.link(mirror_image, os.path.join(cache_dir, 'linked'))
+
+    image_cache = ImageCache(cache_dir, max_size=150)
+    image_cache.add('linked', 'linked')
+    _write_image(cache_dir, 'local', 100)
+    image_cache.add('local', 'local')
+
+    assert image_cache.get_statistics()['size'] == 100
+    assert os.path.exists(os.path.join(cache_dir, 'linked'))
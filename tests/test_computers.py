@@ -0,0 +1,139 @@
+"""
+Tests of the copies of computers used by the pools of computers and by the workers
+
+AiiDA is not needed: ``aiida.orm.Computer`` is replaced by a fake keeping its settings in the
+metadata, as the one of AiiDA does.
+"""
+import sys
+import types
+
+import pytest
+
+from aiida_plugin_ci.computers import clone_computer
+
+
+class NotExistent(Exception):
+    """Stand-in for ``aiida.common.exceptions.NotExistent``"""
+
+
+class _FakeComputerCollection(object):
+    def __init__(self):
+        self.stored = {}
+
+    def get(self, name):
+        try:
+            return self.stored[name]
+        except KeyError:
+            raise NotExistent(name)
+
+
+class FakeComputer(object):
+    """Stand-in for ``aiida.orm.Computer``"""
+    objects = None
+
+    def __init__(self, name, hostname, description='', transport_type='', scheduler_type='', workdir=None):  # pylint: disable=too-many-arguments
+        self.name = name
+        self.hostname = hostname
+        self.description = description
+        self._transport_type = transport_type
+        self._scheduler_type = scheduler_type
+        self._metadata = {}
+        self._configuration = None
+        if workdir is not None:
+            self.set_workdir(workdir)
+
+    def store(self):
+        self.objects.stored[self.name] = self
+        return self
+
+    def configure(self, **kwargs):
+        self._configuration = kwargs
+
+    def get_configuration(self):
+        return dict(self._configuration or {})
+
+    def get_transport_type(self):
+        return self._transport_type
+
+    def get_scheduler_type(self):
+        return self._scheduler_type
+
+    def get_metadata(self):
+        return self._metadata
+
+    def set_metadata(self, metadata):
+        self._metadata = metadata
+
+    def get_workdir(self):
+        return self._metadata.get('workdir')
+
+    def set_workdir(self, workdir):
+        self._metadata['workdir'] = workdir
+
+    def get_shebang(self):
+        return self._metadata.get('shebang')
+
+    def get_prepend_text(self):
+        return self._metadata.get('prepend_text', '')
+
+    def get_append_text(self):
+        return self._metadata.get('append_text', '')
+
+    def get_mpirun_command(self):
+        return self._metadata.get('mpirun_command', ['mpirun', '-np', '{tot_num_mpiprocs}'])
+
+    def get_default_mpiprocs_per_machine(self):
+        return self._metadata.get('default_mpiprocs_per_machine')
+
+
+@pytest.fixture
+def base_computer(monkeypatch):
+    """A configured ``localhost`` computer with non-default settings, in fake ``aiida`` modules"""
+    monkeypatch.setattr(FakeComputer, 'objects', _FakeComputerCollection())
+    modules = {
+        'aiida': types.ModuleType('aiida'),
+        'aiida.common': types.ModuleType('aiida.common'),
+        'aiida.common.exceptions': types.ModuleType('aiida.common.exceptions'),
+        'aiida.orm': types.ModuleType('aiida.orm'),
+    }
+    modules['aiida.common'].exceptions = modules['aiida.common.exceptions']
+    modules['aiida.common.exceptions'].NotExistent = NotExistent
+    modules['aiida.orm'].Computer = FakeComputer
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+
+    computer = FakeComputer(
+        'localhost', 'localhost.localdomain', description='Local machine', transport_type='local',
+        scheduler_type='direct', workdir='/scratch/aiida')
+    computer.set_metadata(dict(
+        computer.get_metadata(), shebang='#!/bin/bash -l', prepend_text='module load qe',
+        append_text='rm -f core', mpirun_command=['srun', '-n', '{tot_num_mpiprocs}'],
+        default_mpiprocs_per_machine=8))
+    computer.store()
+    computer.configure(safe_interval=0.5, use_login_shell=False)
+    return computer
+
+
+def test_clone_copies_all_settings(base_computer):
+    """The copy has the same settings and configuration as the original, except for its work directory"""
+    assert clone_computer('localhost-ci-pool-0', 'localhost', workdir_subfolder='ci-pool-0') == 'localhost-ci-pool-0'
+    clone = FakeComputer.objects.get('localhost-ci-pool-0')
+
+    assert clone.hostname == base_computer.hostname
+    for getter in ['get_transport_type', 'get_scheduler_type', 'get_shebang', 'get_prepend_text',
+                   'get_append_text', 'get_mpirun_command', 'get_default_mpiprocs_per_machine',
+                   'get_configuration']:
+        assert getattr(clone, getter)() == getattr(base_computer, getter)(), getter
+    assert clone.get_workdir() == '/scratch/aiida/ci-pool-0'
+    assert base_computer.get_workdir() == '/scratch/aiida'
+    assert {key: value for key, value in clone.get_metadata().items() if key != 'workdir'} == {
+        key: value for key, value in base_computer.get_metadata().items() if key != 'workdir'}
+
+
+def test_existing_clone_unchanged(base_computer):  # pylint: disable=unused-argument
+    """A copy created by a previous run is reused as it is"""
+    existing = FakeComputer('localhost-ci-worker-0', 'other', workdir='/other').store()
+
+    assert clone_computer('localhost-ci-worker-0', 'localhost') == 'localhost-ci-worker-0'
+    assert FakeComputer.objects.get('localhost-ci-worker-0') is existing
+    assert existing.get_workdir() == '/other'
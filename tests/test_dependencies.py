@@ -0,0 +1,82 @@
+"""
+Tests of the checks of the dependencies between the tests of a class, and of the ordering of the tests
+"""
+from aiida_plugin_ci.base import SingleTest
+from aiida_plugin_ci.dependencies import get_dependency_errors, get_required_tests, sort_tests
+
+
+def _test(name, priority=0, depends_on=()):
+    """Return a ``SingleTest`` with only the fields used by the dependency checks"""
+    return SingleTest(
+        priority=priority, test_function_name=name, entrypoint_name='dummy', generate_function=None,
+        test_function=None, timeout=None, depends_on=list(depends_on), parameters=None)
+
+
+def _names(tests):
+    return [test.test_function_name for test in tests]
+
+
+def test_valid_dependencies():
+    """Valid dependencies, also on a test with the same or a lower priority, have no errors"""
+    tests = [_test('test_scf', 0), _test('test_nscf', 0, ['test_scf']), _test('test_bands', 10, ['test_nscf'])]
+
+    assert get_dependency_errors(tests) == {}
+    assert get_required_tests(tests, ['test_bands']) == {'test_scf', 'test_nscf', 'test_bands'}
+
+
+def test_unknown_dependency():
+    """A test depending on an unknown test is invalid, and so are its dependents"""
+    tests = [_test('test_a', 0, ['test_missing']), _test('test_b', 0, ['test_a']), _test('test_c')]
+    errors = get_dependency_errors(tests)
+
+    assert errors == {
+        'test_a': "depends on the unknown test 'test_missing'",
+        'test_b': "depends on 'test_a', that depends on the unknown test 'test_missing'",
+    }
+    assert get_required_tests(tests, ['test_b']) == {'test_a', 'test_b'}
+
+
+def test_higher_priority_dependency():
+    """A test cannot depend on a test with a higher priority"""
+    tests = [_test('test_a', 10), _test('test_b', 0, ['test_a'])]
+
+    assert get_dependency_errors(tests) == {'test_b': "depends on 'test_a', that has a higher priority"}
+
+
+def test_cyclic_dependencies():
+    """Tests in a cycle and their dependents are invalid, and left out of the sorted tests"""
+    tests = [
+        _test('test_a', 0, ['test_b']),
+        _test('test_b', 0, ['test_a']),
+        _test('test_c', 0, ['test_b']),
+        _test('test_d'),
+    ]
+    errors = get_dependency_errors(tests)
+
+    assert sorted(errors) == ['test_a', 'test_b', 'test_c']
+    assert errors['test_a'] == errors['test_b'] == "has cyclic dependencies"
+    assert _names(sort_tests(tests)) == ['test_d']
+
+
+def test_sort_without_durations():
+    """Without durations, the tests are sorted by priority and name, after the tests they depend on"""
+    tests = [_test('test_c', 0, ['test_d']), _test('test_b', 10), _test('test_a', 10), _test('test_d', 0)]
+
+    assert _names(sort_tests(tests)) == ['test_d', 'test_c', 'test_a', 'test_b']
+
+
+def test_sort_longest_first():
+    """Within a priority, the tests with the longest expected duration (with their dependents) come first"""
+    tests = [
+        _test('test_a'),
+        _test('test_b'),
+        _test('test_c', depends_on=['test_a']),
+        _test('test_d', 10),
+        _test('test_e', 10),
+    ]
+    durations = {'test_a': 1., 'test_b': 5., 'test_c': 10., 'test_d': 1., 'test_e': 2.}
+
+    # test_a comes first since, followed by test_c, it takes 11 seconds
+    assert _names(sort_tests(tests, durations)) == ['test_a', 'test_c', 'test_b', 'test_e', 'test_d']
+    durations['test_c'] = 1.
+    assert _names(sort_tests(tests, durations)) == ['test_b', 'test_a', 'test_c', 'test_e', 'test_d']
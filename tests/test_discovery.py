@@ -0,0 +1,81 @@
+"""
+Tests of the static discovery of the test classes
+"""
+import sys
+import textwrap
+
+import pytest
+
+from aiida_plugin_ci import state, utils
+from aiida_plugin_ci.discovery import parse_test_module
+
+BASE_MODULE = '''
+from aiida_plugin_ci import TestProcessPlugin, process_test
+
+def generate_inputs(self):
+    return {}
+
+class PluginTestBase(TestProcessPlugin):
+    code_resources = {'pw': {}}
+
+    @process_test(10, 'quantumespresso.pw', generate_inputs)
+    def test_scf(self, node):
+        pass
+'''
+
+DERIVED_MODULE = '''
+from aiida_plugin_ci import process_test
+from plugin_base import PluginTestBase, generate_inputs
+
+class Helper(object):
+    pass
+
+class NotATest(dict):
+    pass
+
+class TestDerived(PluginTestBase):
+    @process_test(20, 'quantumespresso.pw', generate_inputs, depends_on=['test_scf'])
+    def test_bands(self, node):
+        pass
+'''
+
+
+@pytest.fixture
+def test_dir(tmpdir, monkeypatch):
+    """A test directory whose test module defines a class with a base imported from another module"""
+    monkeypatch.setattr(state, 'STATE_DIR', str(tmpdir.mkdir('state')))
+    test_dir = tmpdir.mkdir('tests')
+    test_dir.join('plugin_base.py').write(BASE_MODULE)
+    test_dir.join('test_derived.py').write(DERIVED_MODULE)
+    monkeypatch.syspath_prepend(str(test_dir))
+    yield str(test_dir)
+    for module_name in ['plugin_base', 'test_derived']:
+        sys.modules.pop(module_name, None)
+
+
+def test_parse_imported_base():
+    """Classes with a base from another module are described as not static, plain classes are ignored"""
+    classes = parse_test_module(textwrap.dedent(DERIVED_MODULE), 'test_derived')
+
+    assert sorted(classes) == ['NotATest', 'TestDerived']
+    assert not classes['TestDerived']['static']
+    assert [test['name'] for test in classes['TestDerived']['tests']] == ['test_bands']
+
+
+def test_describe_imported_base(test_dir, capsys):
+    """The module of a class with an imported base is imported to describe the class, with the inherited tests"""
+    utils.describe(test_dir, patterns=['test_derived.TestDerived.test_scf'])
+    output = capsys.readouterr()[0]
+
+    assert '**** test_derived.TestDerived ****' in output
+    assert 'test_scf' in output
+    assert 'test_bands' not in output
+    assert 'NotATest' not in output
+
+
+def test_select_imported_base(test_dir):
+    """Tests inherited from a base imported from another module can be selected"""
+    test_classes, selection = utils.get_selected_test_classes(test_dir, ['*.TestDerived.test_bands'])
+
+    assert selection == {'test_derived.TestDerived': ['test_bands']}
+    assert sorted(test_classes) == ['test_derived.TestDerived']
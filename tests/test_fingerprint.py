@@ -0,0 +1,106 @@
+"""
+Tests of the fingerprints of the tests, and of the cache of the fingerprints of their last successful run
+"""
+import sys
+import textwrap
+
+import pytest
+
+from aiida_plugin_ci import fingerprint
+from aiida_plugin_ci.fingerprint import ResultCache, get_test_fingerprint
+
+TEST_MODULE = '''
+from aiida_plugin_ci import TestProcessPlugin, process_test
+
+def generate_inputs(self):
+    return {{}}
+
+class PluginTests(TestProcessPlugin):
+    @process_test(10, 'aiida.calculations:templatereplacer', generate_inputs)
+    def test_run(self, node):
+        assert {condition}
+'''
+
+
+class FakeNode(object):
+    """A stand-in for an AiiDA node, with its hash"""
+    def __init__(self, node_hash):
+        self.node_hash = node_hash
+
+    def get_hash(self):
+        return self.node_hash
+
+
+@pytest.fixture
+def import_test_class(tmpdir, monkeypatch):
+    """Return a function writing and importing a test module, returning its test class"""
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr(fingerprint, 'get_entry_point_version', lambda entrypoint_name: 'aiida-plugin==1.0')
+    monkeypatch.setattr(fingerprint, 'get_aiida_version', lambda: '1.0.0')
+    module_names = []
+
+    def import_test_class(condition):
+        module_name = 'fingerprinted_{}'.format(len(module_names))
+        tmpdir.join('{}.py'.format(module_name)).write(textwrap.dedent(TEST_MODULE.format(condition=condition)))
+        module_names.append(module_name)
+        __import__(module_name)
+        return sys.modules[module_name].PluginTests
+
+    yield import_test_class
+    for module_name in module_names:
+        sys.modules.pop(module_name, None)
+
+
+def test_fingerprint_changes(import_test_class, monkeypatch):
+    """The fingerprint changes with the inputs, the source of the class, the images and the plugin version"""
+    test_class = import_test_class('node.is_finished_ok')
+    entrypoint_name = 'aiida.calculations:templatereplacer'
+    inputs = {'parameters': FakeNode('a'), 'metadata': {'options': {'max_wallclock_seconds': 60}}}
+    checksums = {'code': 'sha256:0'}
+    reference = get_test_fingerprint(test_class, inputs, entrypoint_name, checksums)
+
+    assert reference is not None
+    assert get_test_fingerprint(test_class, dict(inputs), entrypoint_name, dict(checksums)) == reference
+    assert get_test_fingerprint(test_class, dict(inputs, parameters=FakeNode('b')), entrypoint_name,
+                                checksums) != reference
+    assert get_test_fingerprint(test_class, dict(inputs, metadata={}), entrypoint_name, checksums) != reference
+    assert get_test_fingerprint(
+        import_test_class('not node.is_failed'), inputs, entrypoint_name, checksums) != reference
+    assert get_test_fingerprint(test_class, inputs, entrypoint_name, {'code': 'sha256:1'}) != reference
+
+    monkeypatch.setattr(fingerprint, 'get_entry_point_version', lambda entrypoint_name: 'aiida-plugin==1.1')
+    assert get_test_fingerprint(test_class, inputs, entrypoint_name, checksums) != reference
+
+
+def test_fingerprint_unknown_input(import_test_class):
+    """Tests with inputs that cannot be fingerprinted have no fingerprint"""
+    test_class = import_test_class('node.is_finished_ok')
+
+    assert get_test_fingerprint(test_class, {'file': object()}, 'aiida.calculations:templatereplacer', {}) is None
+
+
+def test_result_cache(tmpdir, import_test_class):
+    """The cache keeps the fingerprint of the last success, and forgets it when the test ran without succeeding"""
+    path = str(tmpdir.join('result-cache.json'))
+    entrypoint_name = 'aiida.calculations:templatereplacer'
+    old_fingerprint = get_test_fingerprint(import_test_class('node.is_finished_ok'), {}, entrypoint_name, {})
+    result_cache = ResultCache(path)
+    result_cache.update('test_plugin.PluginTests', {
+        'test_run': {'status': 'SUCCESS', 'fingerprint': old_fingerprint},
+        'test_other': {'status': 'SUCCESS', 'fingerprint': 'other'},
+        'test_no_fingerprint': {'status': 'SUCCESS'},
+    })
+    result_cache.save()
+
+    result_cache = ResultCache(path)
+    previous_fingerprints = result_cache.get_class_fingerprints('test_plugin.PluginTests')
+    assert previous_fingerprints == {'test_run': old_fingerprint, 'test_other': 'other'}
+    # A stale entry does not match the fingerprint of the changed test
+    new_fingerprint = get_test_fingerprint(import_test_class('not node.is_failed'), {}, entrypoint_name, {})
+    assert previous_fingerprints['test_run'] != new_fingerprint
+
+    result_cache.update('test_plugin.PluginTests', {
+        'test_run': {'status': 'FAILED', 'fingerprint': new_fingerprint},
+        'test_other': {'status': 'CACHED', 'fingerprint': 'other'},
+    })
+    assert result_cache.get_class_fingerprints('test_plugin.PluginTests') == {'test_other': 'other'}
@@ -0,0 +1,63 @@
+"""
+Tests of the history of the durations of the classes and of the tests
+"""
+import os
+
+import pytest
+
+from aiida_plugin_ci import history, state
+from aiida_plugin_ci.history import DurationHistory, get_run_duration
+
+
+@pytest.fixture
+def state_dir(tmpdir, monkeypatch):
+    state_dir = str(tmpdir.mkdir('state'))
+    monkeypatch.setattr(state, 'STATE_DIR', state_dir)
+    return state_dir
+
+
+def test_defaults(state_dir):  # pylint: disable=unused-argument
+    """Without history, classes are expected to take 60 seconds and tests 10 seconds"""
+    durations = DurationHistory()
+
+    assert durations.get_class_duration('test_a.A') == history.DEFAULT_CLASS_DURATION == 60.
+    assert durations.get_class_duration('test_a.A', default=5.) == 5.
+    assert durations.get_test_duration('test_a.A', 'test_1') == history.DEFAULT_TEST_DURATION == 10.
+
+
+def test_moving_average(state_dir):
+    """The expected durations are exponential moving averages, saved in the state directory"""
+    durations = DurationHistory()
+    for duration in [10., 20., 5.]:
+        durations.record_class_duration('test_a.A', duration)
+        durations.record_test_duration('test_a.A', 'test_1', 2 * duration)
+    durations.save()
+
+    assert os.path.isfile(os.path.join(state_dir, history.HISTORY_FILENAME))
+    durations = DurationHistory()
+    # 10, then 0.5 * 20 + 0.5 * 10 = 15, then 0.5 * 5 + 0.5 * 15 = 10
+    assert durations.get_class_duration('test_a.A') == pytest.approx(10.)
+    assert durations.get_test_duration('test_a.A', 'test_1') == pytest.approx(20.)
+
+
+def test_unknown_durations(state_dir):  # pylint: disable=unused-argument
+    """Unknown durations are the mean of the other cases of the test, else of the class, else of all tests"""
+    durations = DurationHistory()
+    durations.record_class_duration('test_a.A', 30.)
+    durations.record_class_duration('test_b.B', 50.)
+    durations.record_test_duration('test_a.A', 'test_1[kpoints=2]', 2.)
+    durations.record_test_duration('test_a.A', 'test_1[kpoints=4]', 4.)
+    durations.record_test_duration('test_a.A', 'test_2', 12.)
+
+    assert durations.get_class_duration('test_c.C') == pytest.approx(40.)
+    assert durations.get_test_duration('test_a.A', 'test_1[kpoints=8]') == pytest.approx(3.)
+    assert durations.get_test_duration('test_a.A', 'test_3') == pytest.approx(6.)
+    assert durations.get_test_duration('test_c.C', 'test_1') == pytest.approx(6.)
+
+
+def test_run_duration():
+    """Only the tests whose process ran have a duration"""
+    assert get_run_duration({'status': 'SUCCESS', 'timings': {'generate_inputs': 1., 'run_get_node': 2.}}) == 3.
+    assert get_run_duration({'status': 'SUCCESS', 'timings': {'engine': 2.}}) == 2.
+    assert get_run_duration({'status': 'CACHED', 'timings': {'generate_inputs': 1., 'fingerprint': 0.1}}) is None
+    assert get_run_duration({'status': 'SKIPPED'}) is None
@@ -0,0 +1,178 @@
+"""
+Tests of the download of images from HTTP URLs, against a local HTTP server
+"""
+import hashlib
+import os
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import pytest
+
+from aiida_plugin_ci.code_builders import httpimage
+from aiida_plugin_ci.code_builders.httpimage import HttpImage
+
+IMAGE_DATA = os.urandom(300 * 1024 + 123)
+IMAGE_SHA256 = hashlib.sha256(IMAGE_DATA).hexdigest()
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """Serves the image, with range requests and an ``ETag`` if ``ranges`` is set on the server"""
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        server = self.server
+        byte_range = self.headers.get('Range')
+        with server.lock:
+            server.requests.append(byte_range)
+            # Requests resuming a dropped one only differ by their first byte
+            chunk_end = byte_range.rpartition('-')[2] if byte_range else None
+            drop = server.drop_first_requests and chunk_end not in server.dropped
+            if drop:
+                server.dropped.add(chunk_end)
+        if byte_range and server.ranges:
+            first, last = [int(value) for value in byte_range.partition('=')[2].split('-')]
+            last = min(last, len(IMAGE_DATA) - 1)
+            body = IMAGE_DATA[first:last + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, len(IMAGE_DATA)))
+            self.send_header('ETag', '"v1"')
+        else:
+            body = IMAGE_DATA
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if drop and len(body) > 1:
+            # The connection drops in the middle of the response
+            body = body[:len(body) // 2]
+        self.wfile.write(body)
+
+
+class ImageServer(ThreadingMixIn, HTTPServer):
+    """HTTP server of the image, recording the ``Range`` header of each request"""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ImageRequestHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.ranges = True
+        # Drop the connection of the first request of each chunk
+        self.drop_first_requests = False
+        self.dropped = set()
+
+    def get_url(self, path):
+        return 'http://127.0.0.1:{}/{}'.format(self.server_address[1], path)
+
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    """A local server of the image, with the images directory in a temporary folder"""
+    monkeypatch.setattr(httpimage, 'SINGULARITY_IMAGES_DIR', str(tmpdir.mkdir('images')))
+    monkeypatch.setattr(httpimage.time, 'sleep', lambda seconds: None)
+    image_server = ImageServer()
+    thread = threading.Thread(target=image_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield image_server
+    image_server.shutdown()
+    image_server.server_close()
+
+
+def _is_executable(path):
+    return os.stat(path).st_mode & 0o111 == 0o111
+
+
+def _get_part_files():
+    return [filename for filename in os.listdir(httpimage.SINGULARITY_IMAGES_DIR) if '.part' in filename]
+
+
+def test_chunked_download(server):
+    """The image is downloaded in chunks, also when connections drop, verified and made executable"""
+    server.drop_first_requests = True
+    builder = HttpImage(server.get_url('v2/blobs/sha256:{}'.format(IMAGE_SHA256)), chunk_size=CHUNK_SIZE,
+                        connections=3)
+    builder.build()
+
+    with open(builder.get_image_full_path(), 'rb') as handle:
+        assert handle.read() == IMAGE_DATA
+    assert builder.get_image_checksum() == IMAGE_SHA256
+    assert builder.downloaded_bytes == len(IMAGE_DATA)
+    assert _is_executable(builder.get_image_full_path())
+    assert not _get_part_files()
+    assert server.dropped
+
+
+def test_resume_interrupted_download(server, monkeypatch):
+    """A download interrupted after some chunks only downloads the missing ones at the next build"""
+    download_chunk = HttpImage._download_chunk  # pylint: disable=protected-access
+    downloads = []
+
+    def crashing_download_chunk(self, path, first, last, cancelled):  # pylint: disable=too-many-arguments
+        if len(downloads) >= 2:
+            raise ValueError("Simulated crash")
+        downloads.append(first)
+        return download_chunk(self, path, first, last, cancelled)
+
+    url = server.get_url('image.sif')
+    monkeypatch.setattr(HttpImage, '_download_chunk', crashing_download_chunk)
+    with pytest.raises(ValueError):
+        HttpImage(url, sha256=IMAGE_SHA256, chunk_size=CHUNK_SIZE, connections=1).build()
+    monkeypatch.setattr(HttpImage, '_download_chunk', download_chunk)
+
+    del server.requests[:]
+    builder = HttpImage(url, sha256=IMAGE_SHA256, chunk_size=CHUNK_SIZE, connections=1)
+    builder.build()
+
+    assert builder.resumed_bytes == 2 * CHUNK_SIZE
+    assert builder.downloaded_bytes == len(IMAGE_DATA) - 2 * CHUNK_SIZE
+    assert builder.get_image_checksum() == IMAGE_SHA256
+    # Besides the probe of the size ('bytes=0-0'), only the missing chunks were requested
+    requested = {int(byte_range.partition('=')[2].split('-')[0])
+                 for byte_range in server.requests if byte_range != 'bytes=0-0'}
+    assert not requested & set(downloads)
+    assert _is_executable(builder.get_image_full_path())
+    assert not _get_part_files()
+
+
+def test_checksum_mismatch(server):
+    """An image with the wrong checksum is not kept, nor its partial file"""
+    builder = HttpImage(server.get_url('image.sif'), sha256='0' * 64, chunk_size=CHUNK_SIZE)
+    with pytest.raises(ValueError):
+        builder.build()
+
+    assert not os.path.exists(builder.get_image_full_path())
+    assert not _get_part_files()
+
+
+def test_stream_without_ranges(server):
+    """Images of servers not supporting range requests are downloaded in a single stream"""
+    server.ranges = False
+    builder = HttpImage(server.get_url('image.sif'), sha256=IMAGE_SHA256, chunk_size=CHUNK_SIZE)
+    builder.build()
+
+    with open(builder.get_image_full_path(), 'rb') as handle:
+        assert handle.read() == IMAGE_DATA
+    assert server.requests.count(None) == 1
+    assert _is_executable(builder.get_image_full_path())
+
+
+def test_cache_hit(server):
+    """A cached image is not downloaded again, and is made executable if it is not"""
+    url = server.get_url('image.sif')
+    HttpImage(url, sha256=IMAGE_SHA256, chunk_size=CHUNK_SIZE).build()
+    del server.requests[:]
+    builder = HttpImage(url, sha256=IMAGE_SHA256, chunk_size=CHUNK_SIZE)
+    os.chmod(builder.get_image_full_path(), 0o644)
+    builder.build()
+
+    assert not server.requests
+    assert builder.get_image_checksum() == IMAGE_SHA256
+    assert _is_executable(builder.get_image_full_path())
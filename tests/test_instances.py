@@ -0,0 +1,142 @@
+"""
+Tests of the pools of Singularity instances, against a fake ``singularity`` on the PATH
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from aiida_plugin_ci.code_builders import instances
+from aiida_plugin_ci.code_builders.instances import SingularityInstancePool
+
+pytestmark = pytest.mark.skipif(sys.platform.startswith('win'), reason="requires a POSIX shell")
+
+# Records the running instances as files in $FAKE_SINGULARITY_STATE; 'exec' waits for the
+# file $FAKE_SINGULARITY_RELEASE, if set, before printing its arguments
+FAKE_SINGULARITY = """#!/bin/sh
+state="$FAKE_SINGULARITY_STATE"
+case "$1 $2" in
+    "instance start")
+        touch "$state/running-$4" ;;
+    "instance stop")
+        [ -f "$state/running-$3" ] || exit 255
+        rm -f "$state/running-$3" ;;
+    "exec instance://"*)
+        name="${2#instance://}"
+        [ -f "$state/running-$name" ] || exit 255
+        shift 3
+        if [ -n "$FAKE_SINGULARITY_RELEASE" ]; then
+            while [ ! -f "$FAKE_SINGULARITY_RELEASE" ]; do sleep 0.05; done
+        fi
+        echo "instance $name $*" ;;
+    *)
+        exit 1 ;;
+esac
+"""
+
+
+@pytest.fixture
+def image_path(tmpdir, monkeypatch):
+    """An image printing its arguments, with a fake ``singularity`` on the PATH"""
+    bin_dir = tmpdir.mkdir('bin')
+    singularity = bin_dir.join('singularity')
+    singularity.write(FAKE_SINGULARITY)
+    singularity.chmod(0o755)
+    monkeypatch.setenv('PATH', '{}{}{}'.format(bin_dir, os.pathsep, os.environ.get('PATH', '')))
+    monkeypatch.setenv('FAKE_SINGULARITY_STATE', str(tmpdir.mkdir('state')))
+    monkeypatch.delenv('FAKE_SINGULARITY_RELEASE', raising=False)
+
+    image = tmpdir.mkdir('images').join('image.sif')
+    image.write('#!/bin/sh\necho "image $*"\n')
+    image.chmod(0o755)
+    return str(image)
+
+
+def _get_running(tmpdir):
+    return sorted(name[len('running-'):] for name in os.listdir(str(tmpdir.join('state'))))
+
+
+def _wait_for(condition, timeout=10.):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+def _run(pool, *args):
+    return subprocess.check_output([pool.get_exec_command()] + list(args)).decode().strip()
+
+
+def test_pool_routes_to_instances(tmpdir, image_path):
+    """Calculations run in the instances of the pool, and in the image once it is stopped"""
+    pool = SingularityInstancePool(image_path, 2)
+    pool.start()
+    instance_names = list(pool.instance_names)
+    assert _get_running(tmpdir) == sorted(instance_names)
+
+    output = _run(pool, 'a', 'b')
+    assert output.split(' ', 2)[0] == 'instance'
+    assert output.split(' ', 2)[1] in instance_names
+    assert output.split(' ', 2)[2] == 'a b'
+
+    pool.stop()
+    assert not _get_running(tmpdir)
+    assert not os.listdir(instances.get_pool_dir(image_path))
+    assert _run(pool, 'a', 'b') == 'image a b'
+
+
+def test_stop_keeps_instances_in_use(tmpdir, image_path, monkeypatch):
+    """An instance still running a calculation is only stopped when the calculation finishes"""
+    release_path = str(tmpdir.join('release'))
+    monkeypatch.setenv('FAKE_SINGULARITY_RELEASE', release_path)
+    pool = SingularityInstancePool(image_path, 1)
+    pool.start()
+    instance_name = pool.instance_names[0]
+    users_dir = os.path.join(instances.get_pool_dir(image_path), instance_name + instances.USERS_SUFFIX)
+
+    calculation = subprocess.Popen([pool.get_exec_command(), 'long'], stdout=subprocess.PIPE)
+    try:
+        _wait_for(lambda: os.path.isdir(users_dir) and os.listdir(users_dir))
+        # E.g. the pool of another process, whose calculations were routed to this one
+        pool.stop()
+        assert _get_running(tmpdir) == [instance_name]
+        # New calculations are not routed to the retired instance
+        assert _run(pool, 'new') == 'image new'
+    finally:
+        open(release_path, 'w').close()
+        output = calculation.communicate()[0].decode().strip()
+
+    assert calculation.returncode == 0
+    assert output == 'instance {} long'.format(instance_name)
+    # The last user stopped it
+    assert not _get_running(tmpdir)
+    assert not os.listdir(instances.get_pool_dir(image_path))
+
+
+def test_stale_instances_stopped(tmpdir, image_path):
+    """Instances of processes that died, and retired instances whose last user was killed, are stopped"""
+    dead = subprocess.Popen(['true'])
+    dead.wait()
+    stale = SingularityInstancePool(image_path, 2)
+    stale.start()
+    pool_dir = instances.get_pool_dir(image_path)
+    # The first instance was registered by a dead process, the second was retired and its user killed
+    with open(os.path.join(pool_dir, stale.instance_names[0]), 'w') as handle:
+        handle.write(str(dead.pid))
+    retired_name = stale.instance_names[1]
+    os.rename(os.path.join(pool_dir, retired_name), os.path.join(pool_dir, retired_name + instances.RETIRED_SUFFIX))
+    users_dir = os.path.join(pool_dir, retired_name + instances.USERS_SUFFIX)
+    os.mkdir(users_dir)
+    open(os.path.join(users_dir, str(dead.pid)), 'w').close()
+
+    pool = SingularityInstancePool(image_path, 1)
+    pool.start()
+    try:
+        assert _get_running(tmpdir) == pool.instance_names
+        assert sorted(os.listdir(pool_dir)) == pool.instance_names
+    finally:
+        pool.stop()
+        stale.instance_names = []
+        stale.stop()
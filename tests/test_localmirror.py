@@ -0,0 +1,88 @@
+"""
+Tests of the provisioning of images from a local mirror
+"""
+import os
+import stat
+import threading
+
+from aiida_plugin_ci.code_builders import localmirror
+from aiida_plugin_ci.code_builders.localmirror import LocalMirror, provision_file
+
+
+def _write_image(path, mode=0o644):
+    with open(path, 'wb') as handle:
+        handle.write(b'image')
+    os.chmod(path, mode)
+
+
+def test_same_basename_different_filenames(tmpdir):
+    """Images with the same name in different folders of the mirror get different files"""
+    mirror_dir = tmpdir.mkdir('mirror')
+    for folder in ['a', 'b']:
+        _write_image(str(mirror_dir.mkdir(folder).join('image.sif')))
+
+    filenames = {LocalMirror(os.path.join(folder, 'image.sif'), str(mirror_dir)).get_image_filename()
+                 for folder in ['a', 'b']}
+    assert len(filenames) == 2
+
+
+def test_copy_is_executable(tmpdir):
+    """Images are executable also when copied from a mirror whose images are not"""
+    source = str(tmpdir.join('image.sif'))
+    _write_image(source)
+    destination = str(tmpdir.join('provisioned'))
+
+    method = provision_file(source, destination)
+
+    assert method in ('reflink', 'copy')
+    assert os.stat(destination).st_mode & stat.S_IXUSR
+    assert not os.stat(source).st_mode & stat.S_IXUSR
+
+
+def test_hardlink_of_executable(tmpdir):
+    """Executable images are hard-linked"""
+    source = str(tmpdir.join('image.sif'))
+    _write_image(source, 0o755)
+    destination = str(tmpdir.join('provisioned'))
+
+    assert provision_file(source, destination) == 'hardlink'
+    assert os.stat(destination).st_mode & stat.S_IXUSR
+
+
+def test_build(tmpdir, monkeypatch):
+    """An image is provisioned into the images directory, executable"""
+    monkeypatch.setattr(localmirror, 'SINGULARITY_IMAGES_DIR', str(tmpdir.join('images')))
+    mirror_dir = tmpdir.mkdir('mirror')
+    _write_image(str(mirror_dir.join('image.sif')))
+
+    builder = LocalMirror('image.sif', str(mirror_dir))
+    builder.build()
+
+    assert os.access(builder.get_image_full_path(), os.X_OK)
+    assert builder.get_image_checksum() is not None
+
+
+def test_concurrent_builds(tmpdir, monkeypatch):
+    """Builds of the same image in several threads provision it once, the others use the cache"""
+    monkeypatch.setattr(localmirror, 'SINGULARITY_IMAGES_DIR', str(tmpdir.join('images')))
+    mirror_dir = tmpdir.mkdir('mirror')
+    _write_image(str(mirror_dir.join('image.sif')))
+    builders = [LocalMirror('image.sif', str(mirror_dir)) for _ in range(8)]
+    errors = []
+
+    def build(builder):
+        try:
+            builder.build()
+        except Exception as exception:  # pylint: disable=broad-except
+            errors.append(exception)
+
+    threads = [threading.Thread(target=build, args=(builder,)) for builder in builders]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    methods = sorted(builder.provisioning_method for builder in builders)
+    assert methods.count('cached') == len(builders) - 1
+    assert all('lock_wait' in builder.get_build_timings() for builder in builders)
@@ -0,0 +1,57 @@
+"""
+Tests of the expansion of parametrized tests into cases, and of the names of the cases
+"""
+from aiida_plugin_ci.parameters import expand_parameters, get_case_names
+
+
+def test_expand_grid():
+    """A dictionary of lists expands into all combinations, by sorted parameter name"""
+    cases = expand_parameters({'kpoints': [2, 4], 'ecutwfc': [30, 40]})
+
+    assert cases == [
+        {'ecutwfc': 30, 'kpoints': 2},
+        {'ecutwfc': 30, 'kpoints': 4},
+        {'ecutwfc': 40, 'kpoints': 2},
+        {'ecutwfc': 40, 'kpoints': 4},
+    ]
+    assert get_case_names('test_scf', cases) == [
+        'test_scf[ecutwfc=30,kpoints=2]',
+        'test_scf[ecutwfc=30,kpoints=4]',
+        'test_scf[ecutwfc=40,kpoints=2]',
+        'test_scf[ecutwfc=40,kpoints=4]',
+    ]
+
+
+def test_expand_list():
+    """A list (or any iterable) of dictionaries gives one case per dictionary, copied"""
+    case = {'smearing': 'cold'}
+    cases = expand_parameters(iter([case, {'smearing': 'gaussian'}]))
+
+    assert cases == [{'smearing': 'cold'}, {'smearing': 'gaussian'}]
+    assert cases[0] is not case
+    assert expand_parameters({'kpoints': []}) == []
+
+
+def test_unprintable_values():
+    """Cases with values that are not numbers nor strings are named by their index"""
+    cases = expand_parameters([{'structure': ('Si', 2)}, {'structure': ('Ge', 2)}])
+
+    assert get_case_names('test_relax', cases) == ['test_relax[0]', 'test_relax[1]']
+
+
+def test_colliding_names():
+    """Cases whose ids would be the same (e.g. the same value as a number and as a string) are named by their index"""
+    cases = expand_parameters({'kpoints': [1, '1', 2]})
+
+    assert get_case_names('test_scf', cases) == ['test_scf[0]', 'test_scf[1]', 'test_scf[2]']
+    assert get_case_names('test_scf', [{'kpoints': 2}, {'kpoints': 2}]) == ['test_scf[0]', 'test_scf[1]']
+
+
+def test_ids():
+    """The ``ids`` callable names the cases, unless it returns the same id for several cases"""
+    cases = expand_parameters([{'structure': ('Si', 2)}, {'structure': ('Ge', 2)}])
+
+    assert get_case_names('test_relax', cases, ids=lambda case: case['structure'][0]) == [
+        'test_relax[Si]', 'test_relax[Ge]']
+    assert get_case_names('test_relax', cases, ids=lambda case: case['structure'][1]) == [
+        'test_relax[0]', 'test_relax[1]']
@@ -0,0 +1,78 @@
+"""
+Tests of the planning of the builds of the codes of all test classes
+"""
+import threading
+
+import pytest
+
+from aiida_plugin_ci import base
+from aiida_plugin_ci.planning import build_all, plan_builds
+
+
+class StubBuilder(object):
+    """A code builder recording its builds, without building anything"""
+    builds = []
+    lock = threading.Lock()
+
+    def __init__(self, image, fail=False):
+        self.image = image
+        self.fail = fail
+
+    def set_progress_callback(self, progress):
+        pass
+
+    def build(self):
+        with self.lock:
+            self.builds.append(self.image)
+        if self.fail:
+            raise RuntimeError("Cannot build {}".format(self.image))
+
+    def get_build_timings(self):
+        return {}
+
+
+@pytest.fixture
+def stub_builder(monkeypatch):
+    monkeypatch.setitem(base.CODE_BUILDERS, 'stub', StubBuilder)
+    monkeypatch.setattr(StubBuilder, 'builds', [])
+    return StubBuilder
+
+
+def _test_class(name, code_resources):
+    return type(name, (base.TestProcessPlugin,), {'code_resources': code_resources})
+
+
+def test_plan_deduplicates(stub_builder):
+    """Identical code declarations of several classes (also with different code names) are built once"""
+    pw_code = {'type': 'stub', 'parameters': {'image': 'pw.sif'}, 'input_plugin': 'quantumespresso.pw'}
+    test_classes = {
+        'test_a.A': _test_class('A', {'pw': pw_code, 'ph': {'type': 'stub', 'parameters': {'image': 'ph.sif'}}}),
+        'test_b.B': _test_class('B', {'pw-code': dict(pw_code, input_plugin='quantumespresso.pw2wannier90')}),
+        'test_c.C': _test_class('C', None),
+    }
+    plan = plan_builds(test_classes)
+
+    assert len(plan) == 2
+    records = []
+    results = build_all(plan, max_workers=4, report=records.append)
+
+    assert sorted(stub_builder.builds) == ['ph.sif', 'pw.sif']
+    assert sorted(results) == sorted(plan)
+    assert results[base.get_builder_spec_key(pw_code)][0].image == 'pw.sif'
+    assert sorted(record['spec_key'] for record in records) == sorted(plan)
+
+
+def test_build_failure(stub_builder):  # pylint: disable=unused-argument
+    """A failed build is reported in its status, without stopping the other builds"""
+    plan = plan_builds({
+        'test_a.A': _test_class('A', {
+            'broken': {'type': 'stub', 'parameters': {'image': 'broken.sif', 'fail': True}},
+            'pw': {'type': 'stub', 'parameters': {'image': 'pw.sif'}},
+        }),
+    })
+    results = {code_builder.image if code_builder else 'broken': status
+               for code_builder, status in build_all(plan).values()}
+
+    assert results['broken']['status'] == 'BUILDING_CODE_FAILED'
+    assert 'status' not in results['pw.sif']
+    assert build_all({}) == {}
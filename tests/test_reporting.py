@@ -0,0 +1,89 @@
+"""
+Tests of the streaming report of a run, as JSON lines
+"""
+import itertools
+import json
+
+from aiida_plugin_ci.reporting import TIMINGS_KEY, JsonLinesReporter, aggregate_records, read_records
+
+
+class GrowingStream(object):
+    """A stand-in for a file being written: ``readline`` returns the given chunks, and '' when waiting for more"""
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+        self.num_waits = 0
+
+    def readline(self):
+        if not self._chunks:
+            raise AssertionError("Read past the end of the report")
+        chunk = self._chunks.pop(0)
+        self.num_waits += 0 if chunk else 1
+        return chunk
+
+
+def _write_report(path, records):
+    with open(path, 'w') as handle:
+        reporter = JsonLinesReporter(handle)
+        for record in records:
+            reporter(record)
+
+
+def test_aggregate_several_reports(tmpdir):
+    """The reports of several processes (e.g. one per worker) are aggregated into one"""
+    paths = [str(tmpdir.join('worker-0.jsonl')), str(tmpdir.join('worker-1.jsonl'))]
+    _write_report(paths[0], [
+        {'type': 'code_build', 'spec_key': 'pw', 'status': {}},
+        {'type': 'test', 'class': 'test_a.A', 'test': 'test_1', 'status': {'status': 'SUCCESS',
+                                                                           'timings': {'run_get_node': 2.}}},
+        {'type': 'class', 'class': 'test_a.A', 'timings': {'total': 3.}},
+    ])
+    _write_report(paths[1], [
+        {'type': 'test', 'class': 'test_b.B', 'test': 'test_2', 'status': {'status': 'FAILED',
+                                                                           'timings': {'run_get_node': 5.}}},
+        {'type': 'class', 'class': 'test_b.B', 'timings': {'total': 6.}, 'resources': {'cpu_user': 1.}},
+        {'type': 'suite_end'},
+    ])
+    with open(paths[0]) as report_0, open(paths[1]) as report_1:
+        report = aggregate_records(itertools.chain(read_records(report_0), read_records(report_1)))
+
+    assert report['test_a.A'] == {'test_1': {'status': 'SUCCESS', 'timings': {'run_get_node': 2.}}}
+    assert report['test_b.B']['test_2']['status'] == 'FAILED'
+    assert report[TIMINGS_KEY]['classes'] == {'test_a.A': {'total': 3.}, 'test_b.B': {'total': 6.}}
+    assert report[TIMINGS_KEY]['resources'] == {'test_b.B': {'cpu_user': 1.}}
+    assert report[TIMINGS_KEY]['summary']['classes'] == [['test_b.B', 6.], ['test_a.A', 3.]]
+
+
+def test_read_skips_other_lines(tmpdir):
+    """Lines that are not records (e.g. progress messages) are skipped, and a truncated last line is ignored"""
+    path = tmpdir.join('report.jsonl')
+    path.write('\n'.join([
+        'Building codes...',
+        json.dumps({'type': 'test', 'class': 'test_a.A', 'test': 'test_1', 'status': {}}),
+        json.dumps([1, 2]),
+        json.dumps({'no_type': True}),
+        '{"type": "class", "cla',
+    ]))
+    with open(str(path)) as report:
+        assert [record['type'] for record in read_records(report)] == ['test']
+
+
+def test_follow_truncated_line():
+    """When following, a line being written is read once complete, until the end of the suite"""
+    test_line = json.dumps({'type': 'test', 'class': 'test_a.A', 'test': 'test_1', 'status': {}}) + '\n'
+    class_line = json.dumps({'type': 'class', 'class': 'test_a.A', 'timings': {}}) + '\n'
+    stream = GrowingStream([
+        test_line,
+        '',
+        class_line[:10],
+        '',
+        '',
+        class_line[10:],
+        '',
+        json.dumps({'type': 'suite_end'}) + '\n',
+        'not read',
+    ])
+    records = list(read_records(stream, follow=True, poll_interval=0.))
+
+    assert [record['type'] for record in records] == ['test', 'class', 'suite_end']
+    assert records[1]['class'] == 'test_a.A'
+    assert stream.num_waits == 4
@@ -0,0 +1,46 @@
+"""
+Tests of the sampling of the resources used by the jobs of the tests
+"""
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from aiida_plugin_ci import resources
+from aiida_plugin_ci.resources import ResourceMonitor
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason="requires /proc")
+
+
+def test_jobs_looked_up_in_calling_thread(monkeypatch):
+    """The jobs are only looked up by the thread calling the monitor, the sampling thread only reads /proc"""
+    job = subprocess.Popen([sys.executable, '-c', 'sum(range(10**7)); open("/dev/null", "w").write("x" * 4096)'])
+    lookup_threads = []
+
+    def get_local_job_pids(process_node):  # pylint: disable=unused-argument
+        lookup_threads.append(threading.current_thread())
+        return [job.pid]
+
+    monkeypatch.setattr(resources, 'get_local_job_pids', get_local_job_pids)
+    with ResourceMonitor(interval=0.01) as monitor:
+        monitor.add('test', object())
+        monitor.update_job_pids()
+        while job.poll() is None:
+            time.sleep(0.05)
+        usage = monitor.remove('test')
+
+    assert set(lookup_threads) == {threading.current_thread()}
+    assert usage is not None
+    assert usage['cpu_user'] + usage['cpu_system'] > 0.
+    assert usage['peak_rss'] > 0
+
+
+def test_no_job_found(monkeypatch):
+    """Processes without local jobs have no usage"""
+    monkeypatch.setattr(resources, 'get_local_job_pids', lambda process_node: [])
+    with ResourceMonitor(interval=0.01) as monitor:
+        monitor.add('test', object())
+        time.sleep(0.05)
+        assert monitor.remove('test') is None
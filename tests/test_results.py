@@ -0,0 +1,125 @@
+"""
+Tests of the queries on the SQLite database of the results of the runs
+"""
+import pytest
+
+from aiida_plugin_ci import results
+from aiida_plugin_ci.results import SECONDS_PER_DAY, ResultsStore
+
+CLASS_NAME = 'test_plugin.TestPlugin'
+# Noon (UTC) of a day
+TODAY = 20000 * SECONDS_PER_DAY + SECONDS_PER_DAY / 2
+
+
+class Clock(object):
+    """A stand-in for the ``time`` module, returning a time set by the test"""
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(TODAY)
+    monkeypatch.setattr(results, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmpdir, clock):  # pylint: disable=unused-argument
+    store = ResultsStore(str(tmpdir.join('results.sqlite')))
+    yield store
+    store.close()
+
+
+def _status(status, duration=1., fingerprint=None):
+    test_status = {'status': status, 'timings': {'run_get_node': duration}, 'fingerprint': fingerprint}
+    if status in results.NOT_RUN_STATUSES:
+        test_status['timings'] = {}
+    return test_status
+
+
+def _record_runs(store, clock, runs):
+    """Record one run per dictionary mapping test names to statuses, one minute apart"""
+    for run_status in runs:
+        clock.now += 60.
+        run_id = store.start_run()
+        store.record_class(run_id, CLASS_NAME, run_status)
+        store.finish_run(run_id, {CLASS_NAME: {'total': 1.}})
+
+
+def test_flaky_tests(store, clock):
+    """The flips of the status of a test are counted, ignoring the runs in which it did not run"""
+    _record_runs(store, clock, [
+        {'test_flaky': _status('SUCCESS'), 'test_stable': _status('SUCCESS'), 'test_broken': _status('FAILED')},
+        {'test_flaky': _status('FAILED'), 'test_stable': _status('CACHED'), 'test_broken': _status('SUCCESS')},
+        {'test_flaky': _status('CACHED'), 'test_stable': _status('SUCCESS'), 'test_broken': _status('SUCCESS')},
+        {'test_flaky': _status('SUCCESS'), 'test_stable': _status('SKIPPED'), 'test_broken': _status('SUCCESS')},
+    ])
+    flaky_tests = store.get_flaky_tests()
+
+    assert [test['test_name'] for test in flaky_tests] == ['test_flaky', 'test_broken']
+    assert flaky_tests[0]['runs'] == 3
+    assert flaky_tests[0]['flips'] == 2
+    assert flaky_tests[0]['failure_rate'] == pytest.approx(1 / 3.)
+    assert flaky_tests[0]['statuses'] == ['FAILED', 'SUCCESS']
+    assert flaky_tests[1]['flips'] == 1
+
+    # Only the last runs are considered
+    assert [test['test_name'] for test in store.get_flaky_tests(num_runs=3)] == ['test_flaky']
+    assert store.get_flaky_tests(num_runs=2) == []
+
+
+def test_flaky_same_fingerprint(store, clock):
+    """Tests that both succeeded and failed with the same fingerprint are reported as such"""
+    _record_runs(store, clock, [
+        {'test_same': _status('SUCCESS', fingerprint='a'), 'test_changed': _status('SUCCESS', fingerprint='a')},
+        {'test_same': _status('FAILED', fingerprint='a'), 'test_changed': _status('FAILED', fingerprint='b')},
+    ])
+    same_fingerprint = {test['test_name']: test['same_fingerprint'] for test in store.get_flaky_tests()}
+
+    assert same_fingerprint == {'test_same': True, 'test_changed': False}
+
+
+def test_duration_trends(store, clock):
+    """The mean durations of the last days are compared to the ones of as many days before"""
+    for days_ago, duration in [(5, 100.), (3, 1.), (2, 2.), (1, 3.), (0, 3.)]:
+        clock.now = TODAY - days_ago * SECONDS_PER_DAY
+        _record_runs(store, clock, [
+            {'test_slower': _status('SUCCESS', duration), 'test_faster': _status('SUCCESS', 10. / duration),
+             'test_same': _status('SUCCESS', 5.)},
+            {'test_slower': _status('SUCCESS', duration), 'test_cached': _status('CACHED')},
+        ])
+    clock.now = TODAY
+    # Days 1 and 0 against days 3 and 2, the 5th day before is too old
+    trends = store.get_duration_trends(days=2)
+
+    assert [trend['test_name'] for trend in trends] == ['test_slower', 'test_faster']
+    assert trends[0]['recent'] == pytest.approx(3.)
+    assert trends[0]['previous'] == pytest.approx(1.5)
+    assert trends[0]['recent_runs'] == trends[0]['previous_runs'] == 4
+    assert trends[0]['change'] == pytest.approx(1.)
+    assert trends[1]['change'] == pytest.approx((10. / 3) / 7.5 - 1.)
+    assert [trend['test_name'] for trend in store.get_duration_trends(days=2, min_change=0.6)] == ['test_slower']
+
+    # The current day counts as one of the recent days, also just before midnight
+    clock.now = TODAY + SECONDS_PER_DAY / 2 - 1
+    assert store.get_duration_trends(days=1) == []
+    assert store.get_duration_trends(days=2)[0]['change'] == pytest.approx(1.)
+
+
+def test_last_success(store, clock):
+    """The last run in which a test succeeded is returned"""
+    _record_runs(store, clock, [
+        {'test_a': _status('SUCCESS', 1., 'a')},
+        {'test_a': _status('SUCCESS', 2., 'b')},
+        {'test_a': _status('FAILED', 3., 'c')},
+    ])
+    last_success = store.get_last_success(CLASS_NAME, 'test_a')
+
+    assert last_success['run_id'] == 2
+    assert last_success['duration'] == pytest.approx(2.)
+    assert last_success['fingerprint'] == 'b'
+    assert store.get_last_success(CLASS_NAME, 'test_b') is None
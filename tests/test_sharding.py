@@ -0,0 +1,23 @@
+"""
+Tests of the partition of the test classes over the worker processes
+"""
+from aiida_plugin_ci.sharding import partition_by_duration
+
+
+def test_partition_balanced():
+    """Classes are assigned longest first to the least loaded worker"""
+    durations = {'a.A': 7., 'b.B': 5., 'c.C': 4., 'd.D': 3., 'e.E': 2., 'f.F': 1.}
+    shards = partition_by_duration(list(durations), durations, 2)
+
+    assert shards == [['a.A', 'd.D', 'f.F'], ['b.B', 'c.C', 'e.E']]
+    assert [sum(durations[name] for name in shard) for shard in shards] == [11., 11.]
+
+
+def test_partition_more_jobs_than_classes():
+    """With more workers than classes, each class is assigned to exactly one worker, the others get none"""
+    durations = {'a.A': 1., 'b.B': 1., 'c.C': 0.}
+    shards = partition_by_duration(list(durations), durations, 5)
+
+    assert len(shards) == 5
+    assert sorted(name for shard in shards for name in shard) == ['a.A', 'b.B', 'c.C']
+    assert sorted(len(shard) for shard in shards) == [0, 0, 1, 1, 1]
@@ -0,0 +1,131 @@
+"""
+Tests of the timeouts of the tests run in the current interpreter
+
+AiiDA is not needed: the parts of ``aiida`` and ``plumpy`` used by
+:py:func:`aiida_plugin_ci.timeouts.run_get_node_with_timeout` are replaced by fakes running
+the process on a minimal event loop.
+"""
+import sys
+import threading
+import types
+
+try:
+    from queue import Empty, Queue
+except ImportError:  # Python 2
+    from Queue import Empty, Queue
+
+import pytest
+
+from aiida_plugin_ci import base
+
+
+class KilledError(Exception):
+    """Stand-in for ``plumpy.KilledError``"""
+
+
+class Namespace(object):
+    """Object with the given attributes"""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeLoop(object):
+    """Event loop whose callbacks are run by the process, in the thread executing it"""
+    def __init__(self):
+        self.callbacks = Queue()
+
+    def add_callback(self, callback, *args):
+        self.callbacks.put((callback, args))
+
+
+class FakeProcess(object):
+    """Process running until it is killed, or for ``duration`` seconds"""
+    def __init__(self, loop, duration):
+        self._loop = loop
+        self._duration = duration
+        self._killed = False
+        self._terminated = False
+        self.node = Namespace()
+
+    def has_terminated(self):
+        return self._terminated
+
+    def kill(self, msg):  # pylint: disable=unused-argument
+        self._killed = True
+
+    def execute(self):
+        while not self._killed:
+            try:
+                callback, args = self._loop.callbacks.get(timeout=self._duration)
+            except Empty:
+                self._terminated = True
+                return
+            callback(*args)
+        self._terminated = True
+        raise KilledError()
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+@pytest.fixture
+def fake_aiida(monkeypatch):
+    """Install fake ``aiida`` and ``plumpy`` modules, and return the list of threads looking up job processes"""
+    runner = Namespace(loop=FakeLoop())
+    lookup_threads = []
+
+    def get_local_job_pids(process_node):  # pylint: disable=unused-argument
+        lookup_threads.append(threading.current_thread())
+        return []
+
+    modules = {
+        'aiida': types.ModuleType('aiida'),
+        'aiida.engine': types.ModuleType('aiida.engine'),
+        'aiida.engine.utils': types.ModuleType('aiida.engine.utils'),
+        'aiida.manage': types.ModuleType('aiida.manage'),
+        'aiida.manage.manager': types.ModuleType('aiida.manage.manager'),
+        'plumpy': types.ModuleType('plumpy'),
+    }
+    modules['aiida.engine.utils'].instantiate_process = lambda runner, ProcessClass, **inputs: ProcessClass(
+        runner.loop, **inputs)
+    modules['aiida.engine.utils'].loop_scope = lambda loop: _NullContext()
+    modules['aiida.manage.manager'].get_manager = lambda: Namespace(get_runner=lambda: runner)
+    modules['plumpy'].KilledError = KilledError
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.setattr('aiida_plugin_ci.timeouts.get_local_job_pids', get_local_job_pids)
+    return lookup_threads
+
+
+def _get_test(timeout):
+    return base.SingleTest(
+        priority=0, test_function_name='test_slow', entrypoint_name='dummy', generate_function=None,
+        test_function=None, timeout=timeout, depends_on=(), parameters=None)
+
+
+def test_timeout_status_in_serial_mode(fake_aiida):
+    """A test killed after its timeout gets the TIMEOUT status, and the kill runs in this thread"""
+    test_class = base.TestProcessPlugin()
+    timings = {}
+    status = test_class._run_get_status(  # pylint: disable=protected-access
+        FakeProcess, {'duration': 10.}, _get_test(0.1), timings, calculation_caching=False, timeout=0.1)
+
+    assert status['status'] == 'TIMEOUT'
+    assert status['timeout'] == 0.1
+    assert fake_aiida == [threading.current_thread()]
+    assert 'test_slow' in test_class.process_nodes
+
+
+def test_no_timeout(fake_aiida):
+    """A process terminating before its timeout is not killed"""
+    from aiida_plugin_ci.timeouts import run_get_node_with_timeout
+
+    _, timed_out = run_get_node_with_timeout(FakeProcess, {'duration': 0.05}, 5.)
+
+    assert not timed_out
+    assert not fake_aiida